@@ -113,4 +113,64 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": False,
     "BLACKLIST_AFTER_ROTATION": False,
     "AUTH_HEADER_TYPES": ("Bearer",),
-}
\ No newline at end of file
+}
+
+# CACHE
+# Use a shared backend (e.g. CACHE_URL=rediscache://...) in multi-worker deployments so the
+# catalog version stamps reach every worker.
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# CATALOG
+# How often a worker checks whether a catalog table (tasks, cards, rules...) changed in another worker.
+CATALOG_CHECK_SECONDS = env.int("CATALOG_CHECK_SECONDS", default=5)
+# Age after which a catalog is reloaded regardless of its version stamp (0 disables it). With a
+# process-local cache the stamps never reach other workers, so this bounds how long they serve
+# old prices and rules.
+CATALOG_MAX_AGE_SECONDS = env.int(
+    "CATALOG_MAX_AGE_SECONDS",
+    default=30 if CACHES["default"]["BACKEND"].endswith(("LocMemCache", "DummyCache")) else 0,
+)
+
+# WRITE-BEHIND BALANCES
+# Credits are buffered per process and applied in one bulk UPDATE every WRITE_BEHIND_FLUSH_MS.
+# A flush interval of 0 disables the background flusher (flush manually).
+WRITE_BEHIND_BALANCES = env.bool("WRITE_BEHIND_BALANCES", default=False)
+WRITE_BEHIND_FLUSH_MS = env.int("WRITE_BEHIND_FLUSH_MS", default=500)
+WRITE_BEHIND_LOG_DIR = env.str("WRITE_BEHIND_LOG_DIR", default=str(BASE_DIR / "write_behind"))
+WRITE_BEHIND_FSYNC = env.bool("WRITE_BEHIND_FSYNC", default=True)
+
+# LEADERBOARDS
+# The leaderboards serve a stored top LEADERBOARD_SIZE rows, rebuilt every LEADERBOARD_SNAPSHOT_SECONDS,
+# or after LEADERBOARD_SNAPSHOT_MIN_SECONDS once a score crosses the last-place score.
+LEADERBOARD_SIZE = env.int("LEADERBOARD_SIZE", default=1000)
+LEADERBOARD_SNAPSHOT_SECONDS = env.int("LEADERBOARD_SNAPSHOT_SECONDS", default=60)
+LEADERBOARD_SNAPSHOT_MIN_SECONDS = env.int("LEADERBOARD_SNAPSHOT_MIN_SECONDS", default=5)
+
+# LEADERBOARD BACKEND
+# "snapshot" ranks in the database; "engine" keeps an in-process sorted index (see rank_engine.py),
+# reloaded every LEADERBOARD_ENGINE_RECONCILE_SECONDS and snapshotted to LEADERBOARD_ENGINE_PATH.
+LEADERBOARD_BACKEND = env.str("LEADERBOARD_BACKEND", default="snapshot")
+LEADERBOARD_ENGINE_PATH = env.str("LEADERBOARD_ENGINE_PATH", default=str(BASE_DIR / "leaderboard.bin"))
+LEADERBOARD_ENGINE_RECONCILE_SECONDS = env.int("LEADERBOARD_ENGINE_RECONCILE_SECONDS", default=30)
+
+# TASK CLAIMS
+# Lifetime of a user's cached last-claim times, used by the tasks list. A claim invalidates
+# them only in the cache of the worker that handled it, so with a process-local cache the
+# lifetime is kept short; other workers may show a claimed task as unclaimed until then.
+TASK_CLAIMS_CACHE_SECONDS = env.int(
+    "TASK_CLAIMS_CACHE_SECONDS",
+    default=5 if CACHES["default"]["BACKEND"].endswith(("LocMemCache", "DummyCache")) else 3600,
+)
+
+# AUTOMINE
+# Offline card income is paid for at most AUTOMINE_CAP_HOURS since the user's last visit,
+# or AUTOMINE_AUTOBOT_CAP_HOURS once the user bought the auto-pray bot.
+AUTOMINE_CAP_HOURS = env.int("AUTOMINE_CAP_HOURS", default=3)
+AUTOMINE_AUTOBOT_CAP_HOURS = env.int("AUTOMINE_AUTOBOT_CAP_HOURS", default=12)
+
+# IMAGE VARIANTS
+# Task and card images are stored with resized WebP (and AVIF, when Pillow supports it) copies of
+# these widths. Image URLs are built from MEDIA_BASE_URL (e.g. a CDN, "https://cdn.example.com/media/")
+# when it is set, and from the request host otherwise.
+IMAGE_VARIANT_WIDTHS = env.list("IMAGE_VARIANT_WIDTHS", cast=int, default=[128, 256, 512])
+MEDIA_BASE_URL = env.str("MEDIA_BASE_URL", default="")
@@ -18,6 +18,7 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
+from user_app import images
 
 urlpatterns = [
     # Django Admin
@@ -31,4 +32,4 @@ urlpatterns += [
     path("api/", include("user_app.url.admin_urls")),
     path("api/user/", include("user_app.url.user_urls")),
     path("api/user/", include("user_app.url.pray_urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+] + static(settings.MEDIA_URL, view=images.serve, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
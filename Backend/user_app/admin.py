@@ -72,11 +72,21 @@ class CardsAdmin(admin.ModelAdmin):
 class CardsDetailsAdmin(admin.ModelAdmin):
     list_display = ["card", "level_number", "burning_points", "automine_points"]
 
+# Admin: CardUnlockRule
+# ------------------------------------------------------------------------------------------
+class CardUnlockRuleAdmin(admin.ModelAdmin):
+    list_display = ["card", "user_level", "required_card", "required_card_level"]
+
 # Admin: UserCardClaim
 # ------------------------------------------------------------------------------------------
 class UserCardClaimAdmin(admin.ModelAdmin):
     list_display = ["user", "card"]
 
+# Admin: PendingReferralReward
+# ------------------------------------------------------------------------------------------
+class PendingReferralRewardAdmin(admin.ModelAdmin):
+    list_display = ["referee", "refferer_telegram_id", "created_at", "processed_at"]
+
 def _register(model, admin_class):
     admin.site.register(model, admin_class)
 
@@ -88,6 +98,8 @@ _register(Tasks, TasksAdmin)
 _register(UserTaskClaim, UserTaskClaimAdmin)
 _register(Cards, CardsAdmin)
 _register(CardsDetails, CardsDetailsAdmin)
+_register(CardUnlockRule, CardUnlockRuleAdmin)
 _register(UserCardClaim, UserCardClaimAdmin)
 _register(DailyReward, DailyRewardAdmin)
-_register(UserDailyReward, UserDailyRewardAdmin)
\ No newline at end of file
+_register(UserDailyReward, UserDailyRewardAdmin)
+_register(PendingReferralReward, PendingReferralRewardAdmin)
\ No newline at end of file
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+from user_app import wallet
+from user_app.models import User, UserCardClaim
+
+# Automine Engine
+# -----------------------------------------------------------------------------------------
+# Card income is stored lazily, like energy: the user keeps `automine_rate_per_hour` (the
+# automine_points of every claimed card at its current level) and `automine_synced_at`, the
+# instant income was last paid up to. When the user comes back the income since then is
+# computed in closed form, capped at AUTOMINE_CAP_HOURS (AUTOMINE_AUTOBOT_CAP_HOURS with the
+# auto-pray bot), and credited. No job ever walks the users table.
+
+class AutomineState:
+    """
+    Income owed to a user at a given instant.
+
+    Attributes:
+        points (int): Whole points owed.
+        synced_at (datetime): Instant the income is paid up to once `points` are credited;
+            the fraction of a point left over is carried forward.
+    """
+    def __init__(self, points, synced_at):
+        self.points = points
+        self.synced_at = synced_at
+
+def cap(user):
+    """
+    Longest offline stretch the user is paid for.
+    """
+    hours = settings.AUTOMINE_AUTOBOT_CAP_HOURS if user.autobot_status else settings.AUTOMINE_CAP_HOURS
+    return timedelta(hours=hours)
+
+def pending(user, at=None):
+    """
+    Compute the income owed at `at` from the stored rate and timestamp.
+    """
+    at = at or now()
+    if user.automine_synced_at is None or not user.automine_rate_per_hour:
+        return AutomineState(0, at)
+
+    elapsed = max(at - user.automine_synced_at, timedelta(0))
+    if elapsed >= cap(user):
+        return AutomineState(int(user.automine_rate_per_hour * cap(user) / timedelta(hours=1)), at)
+
+    points = int(user.automine_rate_per_hour * elapsed / timedelta(hours=1))
+    paid = timedelta(hours=points / user.automine_rate_per_hour)
+    return AutomineState(points, user.automine_synced_at + paid)
+
+def settle(user, at=None):
+    """
+    Credit the income owed and move `automine_synced_at` forward.
+
+    Nothing is written while no whole point is owed. The write is conditional on the
+    timestamp that was read, so concurrent settles pay the income once; the losing request
+    credits nothing.
+
+    Returns:
+        int: Points credited.
+    """
+    state = pending(user, at)
+    if not state.points:
+        return 0
+    try:
+        wallet.credit(
+            user, state.points,
+            conditions={"automine_synced_at": user.automine_synced_at}, automine_synced_at=state.synced_at,
+        )
+    except wallet.WalletError:
+        user.refresh_from_db(fields=["automine_rate_per_hour", "automine_synced_at"])
+        return 0
+    return state.points
+
+def rate_change(user, delta, at=None):
+    """
+    Columns to write with the card purchase that adds `delta` points per hour to the rate.
+
+    Call `settle` first so the old rate is paid up to the purchase. A user earning nothing
+    so far starts earning at `at`.
+
+    Returns:
+        dict: Column updates for the purchase's wallet write.
+    """
+    fields = {"automine_rate_per_hour": F("automine_rate_per_hour") + delta}
+    if user.automine_synced_at is None or not user.automine_rate_per_hour:
+        fields["automine_synced_at"] = at or now()
+    return fields
+
+def backfill_rates():
+    """
+    Recompute every user's automine_rate_per_hour from their claimed cards in a single
+    UPDATE, e.g. after the automine_points of a card level were changed. Users without
+    a sync time start earning now.
+
+    Returns:
+        int: Number of users updated.
+    """
+    rates = (
+        UserCardClaim.objects.filter(user=OuterRef("pk"))
+        .order_by()
+        .values("user")
+        .annotate(total=Sum(
+            "card__cards_details__automine_points",
+            filter=Q(card__cards_details__level_number=F("card_level")),
+        ))
+        .values("total")
+    )
+    User.objects.filter(automine_synced_at__isnull=True).update(automine_synced_at=now())
+    return User.objects.update(automine_rate_per_hour=Coalesce(Subquery(rates), 0))
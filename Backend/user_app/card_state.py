@@ -0,0 +1,52 @@
+from user_app import catalog, unlocks
+from user_app.models import UserCardClaim
+
+# Card State
+# -----------------------------------------------------------------------------------------
+# Per-user fields of the cards page. The user's claims are read with one query; everything
+# else (cards, level curves, unlock rules) comes from the catalogs, so opening the cards
+# page costs the same number of queries however many cards the user holds.
+
+NO_POINTS = (None, None)
+MAX_LEVEL = 11 # Cards cannot be upgraded past this level
+
+def level_points(card_id, level):
+    """
+    Price and income of one card level, from the cached level curve.
+
+    Returns:
+        tuple or None: (burning_points, automine_points), or None if the level does not exist.
+    """
+    return catalog.cards_details().curve.get((card_id, level))
+
+def claimed_levels(user):
+    """
+    Level of each card the user has claimed.
+
+    Returns:
+        dict: Card id -> card level.
+    """
+    return dict(UserCardClaim.objects.filter(user=user).values_list("card_id", "card_level"))
+
+def build(user):
+    """
+    Claim, level, status and points of every card for one user.
+
+    Returns:
+        dict: Card id -> {"claim", "level", "status", "burning_points", "automine_points"}.
+    """
+    levels = claimed_levels(user)
+    statuses = unlocks.get_graph().evaluate(user.level_number, levels)
+    curve = catalog.cards_details().curve
+    state = {}
+    for card in catalog.cards().rows:
+        level = levels.get(card.pk, 0) # Unclaimed cards show their level 0 prices
+        burning_points, automine_points = curve.get((card.pk, level), NO_POINTS)
+        state[card.pk] = {
+            "claim": card.pk in levels,
+            "level": level,
+            "status": statuses.get(card.pk, "locked"),
+            "burning_points": burning_points,
+            "automine_points": automine_points,
+        }
+    return state
@@ -0,0 +1,195 @@
+import json
+import time
+import uuid
+from hashlib import sha256
+from threading import Lock
+from types import SimpleNamespace
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from user_app import images
+from user_app.models import Cards, CardsDetails, DailyReward, RefferReward, Tasks
+
+# Catalog
+# -----------------------------------------------------------------------------------------
+# Catalog tables (tasks, cards, card levels, daily rewards, referral rewards and level
+# rules) change only through the admin, so every worker keeps them in memory, indexed and
+# with their static fields already serialized. Saving or deleting a catalog row drops the
+# local copy and, once the transaction commits, bumps the catalog's version stamp in the
+# shared cache; other workers compare that stamp at most every CATALOG_CHECK_SECONDS and
+# reload when it moved. A process-local cache never shows them the stamp, so there every
+# copy is also reloaded once it is CATALOG_MAX_AGE_SECONDS old.
+
+class Catalog:
+    """
+    One catalog held in process memory.
+
+    Args:
+        name (str): Name of the catalog, used for its version key.
+        load (callable): Builds the in-memory data from the database.
+    """
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.version_key = f"user_app:catalog:{name}:version"
+        self._entry = None # (data, version, checked_at, loaded_at)
+        self._lock = Lock()
+
+    def get(self):
+        """
+        Return the catalog data, loading it lazily and reloading it when the version moved.
+        """
+        entry = self._entry
+        if entry is not None and time.monotonic() - entry[2] < settings.CATALOG_CHECK_SECONDS and not self._expired(entry):
+            return entry[0]
+
+        version = cache.get(self.version_key)
+        with self._lock:
+            now = time.monotonic()
+            if self._entry is None or self._entry[1] != version or self._expired(self._entry):
+                self._entry = (self.load(), version, now, now)
+            else:
+                self._entry = (self._entry[0], version, now, self._entry[3])
+            return self._entry[0]
+
+    def _expired(self, entry):
+        max_age = settings.CATALOG_MAX_AGE_SECONDS
+        return bool(max_age) and time.monotonic() - entry[3] >= max_age
+
+    def invalidate(self):
+        """
+        Drop the local copy now and, once the surrounding transaction commits, drop it again
+        and bump the shared version so every worker reloads.
+
+        Bumping before the commit would let a worker reload the old rows and keep them
+        under the new version; the second drop discards anything this worker reloaded
+        before the commit.
+        """
+        self._drop()
+        transaction.on_commit(self._publish)
+
+    def _drop(self):
+        with self._lock:
+            self._entry = None
+
+    def _publish(self):
+        self._drop()
+        cache.set(self.version_key, uuid.uuid4().hex, None)
+
+def image_url(image):
+    """
+    URL of an image field (see images.media_url), or None if it is empty.
+    """
+    return images.media_url(image.name) if image else None
+
+def load_tasks():
+    rows = list(Tasks.objects.all())
+    return SimpleNamespace(
+        rows=rows,
+        by_id={task.pk: task for task in rows},
+        serialized={
+            task.pk: {
+                "id": str(task.pk),
+                "name": task.name,
+                "description": task.description,
+                "task_type": task.task_type,
+                "points": task.points,
+                "image": image_url(task.image),
+                "image_variants": images.variant_urls(task.image_variants),
+                "url": task.url,
+                "action": task.action,
+                "is_telegram": task.is_telegram,
+            }
+            for task in rows
+        },
+    )
+
+def load_cards():
+    rows = list(Cards.objects.all())
+    return SimpleNamespace(
+        rows=rows,
+        by_id={card.pk: card for card in rows},
+        serialized={
+            card.pk: {
+                "id": str(card.pk),
+                "name": card.name,
+                "number": card.number,
+                "image": image_url(card.image),
+                "image_variants": images.variant_urls(card.image_variants),
+                "description": card.description,
+                "card_type": card.card_type,
+            }
+            for card in rows
+        },
+    )
+
+def etag(payload):
+    """
+    Strong ETag of a JSON-serializable payload.
+    """
+    return '"%s"' % sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:32]
+
+def load_cards_details():
+    rows = list(CardsDetails.objects.select_related("card").order_by("card_id", "level_number"))
+    by_card = {}
+    for detail in rows:
+        by_card.setdefault(detail.card_id, []).append(detail)
+    # Serialized level curve of every card, with ETags for the curve endpoint
+    curves = {
+        card_id: {
+            "id": str(card_id),
+            "levels": [
+                {
+                    "level_number": detail.level_number,
+                    "burning_points": detail.burning_points,
+                    "automine_points": detail.automine_points,
+                }
+                for detail in details
+            ],
+        }
+        for card_id, details in by_card.items()
+    }
+    return SimpleNamespace(
+        rows=rows,
+        by_key={(detail.card_id, detail.level_number): detail for detail in rows},
+        by_card=by_card,
+        # Level curve: (card, level) -> (burning_points, automine_points)
+        curve={
+            (detail.card_id, detail.level_number): (detail.burning_points, detail.automine_points)
+            for detail in rows
+        },
+        curves=curves,
+        curve_etags={card_id: etag(payload) for card_id, payload in curves.items()},
+        curves_etag=etag(list(curves.values())),
+    )
+
+def load_daily_rewards():
+    rows = list(DailyReward.objects.order_by("day"))
+    return SimpleNamespace(rows=rows, by_day={reward.day: reward for reward in rows})
+
+def load_reffer_rewards():
+    return dict(RefferReward.objects.values_list("level_number", "reward_amount"))
+
+TASKS = Catalog("tasks", load_tasks)
+CARDS = Catalog("cards", load_cards)
+CARDS_DETAILS = Catalog("cards_details", load_cards_details)
+DAILY_REWARDS = Catalog("daily_rewards", load_daily_rewards)
+REFFER_REWARDS = Catalog("reffer_rewards", load_reffer_rewards)
+
+def tasks():
+    return TASKS.get()
+
+def cards():
+    return CARDS.get()
+
+def cards_details():
+    return CARDS_DETAILS.get()
+
+def daily_rewards():
+    return DAILY_REWARDS.get()
+
+def reffer_rewards():
+    """
+    Referral reward amounts keyed by level_number.
+    """
+    return REFFER_REWARDS.get()
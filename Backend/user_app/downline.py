@@ -0,0 +1,108 @@
+from collections import Counter, defaultdict
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from user_app.models import DownlineStats, PendingReferralReward, ReferralClosure, User
+
+# Downline
+# -----------------------------------------------------------------------------------------
+# The referral tree is stored as a closure table: one ReferralClosure row per
+# (ancestor, descendant) pair up to MAX_DEPTH levels apart, written when the descendant
+# signs up. DownlineStats keeps the size and combined balance of every tier of a user's
+# downline. Both are maintained out of band by the referral worker: sizes grow with each
+# batch of processed signups (`add_members`), balances are recomputed periodically
+# (`refresh_balances`), so neither signups nor wallet updates write to an upline's stats.
+
+MAX_DEPTH = 3
+
+def link(user):
+    """
+    Add a newly created user below their referrer.
+
+    Args:
+        user (User): The new user, with `reffered_by` set to the referrer's telegram_id.
+    """
+    referrer = User.objects.filter(telegram_id=user.reffered_by).exclude(pk=user.pk).values_list("pk", flat=True).first()
+    if referrer is None:
+        return
+    upline = [(referrer, 1)] + [
+        (ancestor, depth + 1)
+        for ancestor, depth in ReferralClosure.objects.filter(
+            descendant_id=referrer, depth__lt=MAX_DEPTH
+        ).values_list("ancestor_id", "depth")
+    ]
+    ReferralClosure.objects.bulk_create([
+        ReferralClosure(ancestor_id=ancestor, descendant=user, depth=depth) for ancestor, depth in upline
+    ])
+
+def add_members(referee_ids):
+    """
+    Count a batch of processed signups in the tier sizes of their upline, with one
+    UPDATE per tier that gained members.
+
+    Args:
+        referee_ids (list): Ids of the newly counted users.
+    """
+    gained = Counter(
+        ReferralClosure.objects.filter(descendant_id__in=referee_ids).values_list("ancestor_id", "depth")
+    )
+    if not gained:
+        return
+    DownlineStats.objects.bulk_create(
+        [DownlineStats(user_id=ancestor, depth=depth) for ancestor, depth in gained], ignore_conflicts=True
+    )
+    for (ancestor, depth), count in sorted(gained.items()): # Same lock order in every worker
+        DownlineStats.objects.filter(user_id=ancestor, depth=depth).update(members=F("members") + count)
+
+def refresh_balances():
+    """
+    Recompute the combined balance of every downline tier in a single UPDATE.
+
+    Returns:
+        int: Number of tiers updated.
+    """
+    totals = (
+        ReferralClosure.objects.filter(ancestor_id=OuterRef("user_id"), depth=OuterRef("depth"))
+        .order_by()
+        .values("ancestor_id")
+        .annotate(total=Sum("descendant__balance"))
+        .values("total")
+    )
+    return DownlineStats.objects.update(balance=Coalesce(Subquery(totals), 0))
+
+def rebuild():
+    """
+    Recompute the closure table and the downline stats from `reffered_by`. Signups
+    still waiting for the referral worker are left out of the tier sizes, which the
+    worker counts when it processes them.
+
+    Returns:
+        int: Number of closure rows written.
+    """
+    users = {
+        telegram_id: (pk, reffered_by, balance)
+        for pk, telegram_id, reffered_by, balance in User.objects.values_list("pk", "telegram_id", "reffered_by", "balance")
+    }
+    waiting = set(PendingReferralReward.objects.filter(processed_at__isnull=True).values_list("referee_id", flat=True))
+    closures, stats = [], defaultdict(lambda: [0, 0])
+    for pk, reffered_by, balance in users.values():
+        ancestor, seen = reffered_by, {pk}
+        for depth in range(1, MAX_DEPTH + 1):
+            if ancestor not in users or users[ancestor][0] in seen:
+                break
+            ancestor_pk = users[ancestor][0]
+            closures.append(ReferralClosure(ancestor_id=ancestor_pk, descendant_id=pk, depth=depth))
+            stats[ancestor_pk, depth][0] += pk not in waiting
+            stats[ancestor_pk, depth][1] += balance
+            seen.add(ancestor_pk)
+            ancestor = users[ancestor][1]
+
+    with transaction.atomic():
+        ReferralClosure.objects.all().delete()
+        DownlineStats.objects.all().delete()
+        ReferralClosure.objects.bulk_create(closures, batch_size=1000)
+        DownlineStats.objects.bulk_create([
+            DownlineStats(user_id=user_id, depth=depth, members=members, balance=balance)
+            for (user_id, depth), (members, balance) in stats.items()
+        ], batch_size=1000)
+    return len(closures)
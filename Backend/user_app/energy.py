@@ -0,0 +1,104 @@
+from django.utils.timezone import now
+from user_app.levels import get_rule
+
+# Energy Engine
+# -----------------------------------------------------------------------------------------
+# Energy is stored lazily: only the last known value and the time it was computed are
+# persisted on the user. The current value is derived in closed form on every request,
+# so there is no periodic refill job.
+#
+# For a user at a given level, using that level's Rules row:
+#   - tap power  = per_tap + multitap_level        (points credited per tap)
+#   - capacity   = number_of_tap                   (energy when full, one energy per tap)
+#   - refill     = point_refill + recharging_speed_level  (energy regained per second)
+
+class EnergyState:
+    """
+    Snapshot of a user's energy at a given instant.
+
+    Attributes:
+        energy (float): Energy available at `at`.
+        capacity (int): Maximum energy for the user's level.
+        tap_power (int): Points credited per tap.
+        at (datetime): Instant the snapshot refers to.
+    """
+    def __init__(self, energy, capacity, tap_power, at):
+        self.energy = energy
+        self.capacity = capacity
+        self.tap_power = tap_power
+        self.at = at
+
+def tap_power(user):
+    """
+    Points credited for a single tap at the user's current level.
+    """
+    rule = get_rule(user.level_number)
+    return (rule.per_tap if rule else 1) + user.multitap_level
+
+def current_energy(user, at=None):
+    """
+    Compute the user's energy at `at` from the stored value and timestamp.
+
+    Returns:
+        EnergyState or None: None when the user's level has no Rules row, in which
+        case taps are not limited by energy.
+    """
+    rule = get_rule(user.level_number)
+    if rule is None:
+        return None
+
+    at = at or now()
+    capacity = rule.number_of_tap
+    if user.energy is None or user.energy_updated_at is None:
+        energy = capacity
+    else:
+        elapsed = max((at - user.energy_updated_at).total_seconds(), 0)
+        refill = rule.point_refill + user.recharging_speed_level
+        energy = min(capacity, user.energy + elapsed * refill)
+    return EnergyState(energy, capacity, rule.per_tap + user.multitap_level, at)
+
+def available_energy(user):
+    """
+    Whole energy units the user has right now, or None when energy is not limited.
+    """
+    state = current_energy(user)
+    return int(state.energy) if state else None
+
+def spend_taps(user, taps, at=None):
+    """
+    Work out how many of the requested taps the user's energy allows.
+
+    Args:
+        user (User): The tapping user.
+        taps (int): Number of taps the client reported.
+        at (datetime, optional): Instant of the flush, defaults to now.
+
+    Returns:
+        tuple: (accepted_taps, points, fields) where `fields` are the energy columns to
+        write in the same UPDATE that credits the points.
+    """
+    state = current_energy(user, at)
+    if state is None:
+        return taps, taps * tap_power(user), {}
+
+    accepted = min(taps, int(state.energy))
+    fields = {"energy": state.energy - accepted, "energy_updated_at": state.at}
+    return accepted, accepted * state.tap_power, fields
+
+def spend_points(user, points, at=None):
+    """
+    Clamp a raw point increment to what the user's energy allows.
+
+    Used by the legacy absolute-balance endpoint which reports points, not taps.
+
+    Returns:
+        tuple: (points, fields) with the allowed points and the energy columns to write.
+    """
+    state = current_energy(user, at)
+    if state is None:
+        return points, {}
+
+    taps = min(-(-points // state.tap_power), int(state.energy))
+    allowed = min(points, taps * state.tap_power)
+    fields = {"energy": state.energy - taps, "energy_updated_at": state.at}
+    return allowed, fields
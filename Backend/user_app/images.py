@@ -0,0 +1,100 @@
+import io
+import posixpath
+from hashlib import sha256
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.views.static import serve as serve_file
+from PIL import Image, ImageOps, features
+
+# Image Variants
+# -----------------------------------------------------------------------------------------
+# Task and card images are uploaded at full size. When one is saved, resized copies are
+# written next to it for every width in IMAGE_VARIANT_WIDTHS, in WebP (and AVIF when this
+# Pillow build supports it). The file names carry a hash of their content, so they never
+# change once written and can be cached by clients and CDNs forever. The names are stored
+# in the row's `image_variants`; catalogs turn them into URLs once, from MEDIA_BASE_URL.
+
+FORMATS = ("webp", "avif")
+QUALITY = 80
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def media_url(name):
+    """
+    URL of a stored file: absolute from MEDIA_BASE_URL if set, else the storage URL.
+    """
+    if settings.MEDIA_BASE_URL:
+        return settings.MEDIA_BASE_URL.rstrip("/") + "/" + name
+    return default_storage.url(name)
+
+def variant_urls(variants):
+    """
+    URLs of the variants recorded by `build_variants`.
+
+    Returns:
+        dict: Format -> {width (str): URL}.
+    """
+    return {
+        fmt: {width: media_url(name) for width, name in names.items()}
+        for fmt, names in variants.items() if fmt in FORMATS
+    }
+
+def build_variants(image):
+    """
+    Write the resized copies of an image.
+
+    Args:
+        image (FieldFile): The uploaded image.
+
+    Returns:
+        dict: {"source": image name, <format>: {width (str): file name}}; only the source
+        when the image cannot be decoded.
+    """
+    variants = {"source": image.name}
+    try:
+        with image.storage.open(image.name, "rb") as handle, Image.open(handle) as original:
+            source = ImageOps.exif_transpose(original)
+            source = source.convert("RGBA" if "A" in source.getbands() or "transparency" in source.info else "RGB")
+    except (OSError, Image.DecompressionBombError):
+        return variants # Not a readable image; the original is served
+
+    folder, filename = posixpath.split(image.name)
+    stem = posixpath.splitext(filename)[0]
+    formats = [fmt for fmt in FORMATS if features.check(fmt)]
+    for width in sorted({min(width, source.width) for width in settings.IMAGE_VARIANT_WIDTHS}):
+        height = max(1, round(source.height * width / source.width))
+        resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+        for fmt in formats:
+            buffer = io.BytesIO()
+            resized.save(buffer, fmt.upper(), quality=QUALITY)
+            data = buffer.getvalue()
+            name = posixpath.join(folder, "variants", f"{stem}-{width}.{sha256(data).hexdigest()[:12]}.{fmt}")
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(data))
+            variants.setdefault(fmt, {})[str(width)] = name
+    return variants
+
+def needs_variants(instance):
+    """
+    Whether the row's variants are missing or were built from another image.
+    """
+    if not instance.image:
+        return bool(instance.image_variants)
+    return instance.image_variants.get("source") != instance.image.name
+
+def update_variants(instance):
+    """
+    Build the variants of the row's image and store them without saving the whole row.
+    """
+    instance.image_variants = build_variants(instance.image) if instance.image else {}
+    type(instance).objects.filter(pk=instance.pk).update(image_variants=instance.image_variants)
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """
+    Development media view: `django.views.static.serve`, marking content-hashed
+    variants as immutable.
+    """
+    response = serve_file(request, path, document_root=document_root, show_indexes=show_indexes)
+    if "/variants/" in f"/{path}":
+        response["Cache-Control"] = IMMUTABLE
+    return response
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from user_app.models import LeaderboardSnapshot
+
+# Leaderboard Snapshots
+# -----------------------------------------------------------------------------------------
+# The leaderboard views serve a stored, pre-serialized top-N instead of ranking the whole
+# user table per request. A snapshot is rebuilt when it is older than
+# LEADERBOARD_SNAPSHOT_SECONDS, or sooner (but at most every LEADERBOARD_SNAPSHOT_MIN_SECONDS)
+# once a wallet update pushes a score to or above the board's last-place score.
+
+SCORES = {"overall": "balance", "referral": "reffered_points"} # Board -> score column
+
+def threshold_key(board):
+    return f"user_app:leaderboard:{board}:threshold"
+
+def stale_key(board):
+    return f"user_app:leaderboard:{board}:stale"
+
+def get_snapshot(board, build):
+    """
+    Return the rows of `board`, rebuilding the snapshot first when it is due.
+
+    Args:
+        board (str): Board name, a key of SCORES.
+        build (callable): Returns the serialized top-N rows, best first.
+
+    Returns:
+        list: The serialized leaderboard rows.
+    """
+    snapshot = LeaderboardSnapshot.objects.filter(board=board).first()
+    if snapshot is None:
+        return refresh(board, build)
+
+    age = (now() - snapshot.refreshed_at).total_seconds()
+    due = age >= settings.LEADERBOARD_SNAPSHOT_SECONDS or (
+        snapshot.stale and age >= settings.LEADERBOARD_SNAPSHOT_MIN_SECONDS
+    )
+    # Only the request that claims the refresh rebuilds; the others keep serving the current rows
+    if due and LeaderboardSnapshot.objects.filter(
+        pk=snapshot.pk, refreshed_at=snapshot.refreshed_at
+    ).update(refreshed_at=now(), stale=False):
+        cache.delete(stale_key(board))
+        return refresh(board, build)
+    return snapshot.payload
+
+def refresh(board, build):
+    """
+    Rebuild and store the snapshot of `board`.
+
+    Returns:
+        list: The serialized leaderboard rows.
+    """
+    rows = list(build())
+    threshold = rows[-1][SCORES[board]] if len(rows) >= settings.LEADERBOARD_SIZE else 0
+    try:
+        with transaction.atomic():
+            LeaderboardSnapshot.objects.update_or_create(
+                board=board, defaults={"payload": rows, "threshold": threshold, "refreshed_at": now()}
+            )
+    except IntegrityError:
+        pass # Another request created the first snapshot concurrently
+    cache.set(threshold_key(board), threshold, None)
+    return rows
+
+def note_scores(row):
+    """
+    Mark boards stale when a freshly written score reaches their last-place score.
+
+    Args:
+        row (dict): Column values read back after a wallet update.
+    """
+    for board, field in SCORES.items():
+        if field not in row:
+            continue
+        threshold = cache.get(threshold_key(board))
+        # cache.add succeeds once per refresh, so a busy top player costs one UPDATE, not one per tap
+        if threshold is not None and row[field] >= threshold and cache.add(stale_key(board), True, None):
+            LeaderboardSnapshot.objects.filter(board=board).update(stale=True)
@@ -0,0 +1,60 @@
+from bisect import bisect_right
+from user_app.catalog import Catalog
+from user_app.models import Rules
+
+# Level Index
+# -----------------------------------------------------------------------------------------
+# The Rules table changes only through the admin, so it is held as a catalog (see
+# catalog.py): every worker keeps it in memory as a sorted array of `lower_points`
+# boundaries and resolves a balance to its level with bisect.
+
+class LevelIndex:
+    """
+    Immutable, sorted view of the Rules table.
+    """
+    def __init__(self, rules):
+        self.by_level = {rule.level_number: rule for rule in rules}
+        self.rules = sorted(rules, key=lambda rule: rule.lower_points)
+        self.bounds = [rule.lower_points for rule in self.rules]
+
+    def resolve(self, balance):
+        """
+        Return the rule whose [lower_points, higher_points] range contains the balance.
+        """
+        position = bisect_right(self.bounds, balance) - 1
+        if position < 0:
+            return None
+        rule = self.rules[position]
+        return rule if balance <= rule.higher_points else None
+
+RULES = Catalog("rules", lambda: LevelIndex(list(Rules.objects.all())))
+
+def get_index():
+    """
+    Return the level index, loading it lazily and reloading it when the version moved.
+    """
+    return RULES.get()
+
+def get_rules():
+    """
+    Return all Rules rows keyed by level_number.
+    """
+    return get_index().by_level
+
+def get_rule(level_number):
+    """
+    Return the Rules row for a level, or None if the level is not configured.
+    """
+    return get_index().by_level.get(level_number)
+
+def resolve_level(balance):
+    """
+    Return the Rules row whose point range contains the balance, or None.
+    """
+    return get_index().resolve(balance)
+
+def invalidate():
+    """
+    Drop the local index and bump the shared version so every worker reloads.
+    """
+    RULES.invalidate()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from user_app import automine
+
+# Command: backfill_automine_rates
+# -----------------------------------------------------------------------------------------
+class Command(BaseCommand):
+    """
+    Recompute the denormalized automine rates from the claimed cards.
+    """
+    help = "Recompute User.automine_rate_per_hour from the claimed cards and their levels."
+
+    def handle(self, *args, **options):
+        updated = automine.backfill_rates()
+        self.stdout.write(f"Backfilled automine rates for {updated} users.")
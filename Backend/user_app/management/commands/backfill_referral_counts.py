@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from user_app import referrals
+
+# Command: backfill_referral_counts
+# -----------------------------------------------------------------------------------------
+class Command(BaseCommand):
+    """
+    Recompute the denormalized referral counts from the referred users.
+    """
+    help = "Recompute User.referral_count from the referred users."
+
+    def handle(self, *args, **options):
+        updated = referrals.backfill_referral_counts()
+        self.stdout.write(f"Backfilled referral counts for {updated} users.")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from user_app import catalog, images
+from user_app.models import Cards, Tasks
+
+# Command: build_image_variants
+# -----------------------------------------------------------------------------------------
+class Command(BaseCommand):
+    """
+    Build the resized copies of task and card images uploaded before the pipeline existed.
+    """
+    help = "Build the resized WebP/AVIF copies of task and card images."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Rebuild images that already have variants.")
+
+    def handle(self, *args, **options):
+        built = 0
+        for model in (Tasks, Cards):
+            for instance in model.objects.exclude(image="").exclude(image__isnull=True).iterator():
+                if options["force"] or images.needs_variants(instance):
+                    images.update_variants(instance)
+                    built += 1
+        catalog.TASKS.invalidate()
+        catalog.CARDS.invalidate()
+        catalog.CARDS_DETAILS.invalidate()
+        self.stdout.write(f"Built image variants for {built} images.")
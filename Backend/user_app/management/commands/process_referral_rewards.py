@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from user_app import downline, referrals
+
+# Command: process_referral_rewards
+# -----------------------------------------------------------------------------------------
+class Command(BaseCommand):
+    """
+    Apply pending referral rewards in batches, once or continuously, and refresh the
+    combined balances of the downline tiers.
+    """
+    help = "Apply pending referral rewards in batches and refresh downline balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Pending rewards applied per transaction.")
+        parser.add_argument("--loop", action="store_true", help="Keep running and poll for new rewards.")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--downline-interval", type=float, default=60.0, help="Seconds between downline balance refreshes.")
+
+    def handle(self, *args, **options):
+        refreshed_at = None
+        while True:
+            if refreshed_at is None or time.monotonic() - refreshed_at >= options["downline_interval"]:
+                downline.refresh_balances()
+                refreshed_at = time.monotonic()
+            try:
+                processed = referrals.process_pending(options["batch_size"])
+            except referrals.ConcurrentBatch:
+                processed = 1 # Another worker got there first; try the next batch right away
+            if processed:
+                self.stdout.write(f"Processed {processed} referral rewards.")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+        downline.refresh_balances() # Include the balances credited by this run
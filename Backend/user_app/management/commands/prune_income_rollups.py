@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from user_app import rollups
+
+# Command: prune_income_rollups
+# -----------------------------------------------------------------------------------------
+class Command(BaseCommand):
+    """
+    Delete the income rollups of old daily and weekly windows.
+    """
+    help = "Delete income rollups of old daily and weekly windows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-days", type=int, default=7, help="Past daily windows to keep.")
+        parser.add_argument("--keep-weeks", type=int, default=8, help="Past weekly windows to keep.")
+
+    def handle(self, *args, **options):
+        deleted = rollups.prune(options["keep_days"], options["keep_weeks"])
+        self.stdout.write(f"Deleted {deleted} income rollups.")
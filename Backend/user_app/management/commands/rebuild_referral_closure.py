@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from user_app import downline
+
+# Command: rebuild_referral_closure
+# -----------------------------------------------------------------------------------------
+class Command(BaseCommand):
+    """
+    Recompute the referral closure table and downline stats from the referrals.
+    """
+    help = "Recompute the referral closure table and downline stats."
+
+    def handle(self, *args, **options):
+        written = downline.rebuild()
+        self.stdout.write(f"Wrote {written} referral closure rows.")
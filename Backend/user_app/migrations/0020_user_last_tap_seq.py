@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0019_alter_tasks_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_tap_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0020_user_last_tap_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='energy',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='energy_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
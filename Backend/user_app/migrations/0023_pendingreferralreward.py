@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0022_balanceflush'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingReferralReward',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refferer_telegram_id', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('referee', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_referral_reward', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_referral_counts(apps, schema_editor):
+    # Same query as referrals.backfill_referral_counts, against the historical models
+    User = apps.get_model("user_app", "User")
+    counts = (
+        User.objects.filter(reffered_by=OuterRef("telegram_id"))
+        .filter(Q(pending_referral_reward__isnull=True) | Q(pending_referral_reward__processed_at__isnull=False))
+        .order_by()
+        .values("reffered_by")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    User.objects.update(referral_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0023_pendingreferralreward'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='referral_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='reffered_by',
+            field=models.PositiveBigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_referral_counts, migrations.RunPython.noop),
+    ]
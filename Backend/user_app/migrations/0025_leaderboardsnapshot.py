@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0024_user_referral_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(max_length=50, unique=True)),
+                ('payload', models.JSONField(default=list)),
+                ('threshold', models.PositiveBigIntegerField(default=0)),
+                ('stale', models.BooleanField(default=False)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user_app', '0026_user_rank_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_overall_rank_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_referral_rank_idx',
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-balance', '-reffered_points', 'date_joined', 'id'], name='user_overall_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-reffered_points', 'id'], name='user_referral_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user_app', '0027_user_rank_indexes_keyset'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['user_religion', '-balance', '-reffered_points', 'date_joined', 'id'], name='user_religion_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0028_user_religion_rank_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncomeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], max_length=10)),
+                ('bucket', models.PositiveIntegerField()),
+                ('points', models.PositiveBigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='income_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket', '-points', 'id'], name='income_rollup_rank_idx')],
+                'unique_together': {('user', 'period', 'bucket')},
+            },
+        ),
+    ]
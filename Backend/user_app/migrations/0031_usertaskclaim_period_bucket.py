@@ -0,0 +1,46 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:55
+
+from django.db import migrations, models
+from django.utils.timezone import localdate
+
+
+def backfill_period_buckets(apps, schema_editor):
+    # Same buckets as UserTaskClaim.period_for; repeated claims of one period keep the first
+    UserTaskClaim = apps.get_model("user_app", "UserTaskClaim")
+    seen, duplicates = set(), []
+    claims = UserTaskClaim.objects.select_related("task").order_by("date_claimed", "id")
+    for claim in claims.iterator(chunk_size=2000):
+        bucket = localdate(claim.date_claimed).toordinal() if claim.task.task_type == "daily" else 0
+        key = (claim.user_id, claim.task_id, bucket)
+        if key in seen:
+            duplicates.append(claim.id)
+            continue
+        seen.add(key)
+        if bucket:
+            UserTaskClaim.objects.filter(id=claim.id).update(period_bucket=bucket)
+    for start in range(0, len(duplicates), 500):
+        UserTaskClaim.objects.filter(id__in=duplicates[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0030_referralclosure_downlinestats'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='usertaskclaim',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='usertaskclaim',
+            name='period_bucket',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_period_buckets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='usertaskclaim',
+            constraint=models.UniqueConstraint(fields=('user', 'task', 'period_bucket'), name='user_task_claim_period_uniq'),
+        ),
+    ]
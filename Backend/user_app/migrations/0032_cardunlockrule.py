@@ -0,0 +1,78 @@
+# Generated by Django 5.1.1 on 2026-10-16 22:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Unlock conditions previously hard-coded in CardsSerializer.get_status:
+# (card_type, card name) -> [user level] or [(required card name, minimum card level)]
+SEED_RULES = {
+    ("eternals", "Eternal Flame"): [2],
+    ("eternals", "Infinity Stone"): [2],
+    ("eternals", "Timeless Spirit"): [2],
+    ("eternals", "Arcane Eternity"): [("Infinity Stone", 0), ("Timeless Spirit", 0)],
+    ("eternals", "Celestial Bond"): [("Infinity Stone", 5)],
+    ("eternals", "Boundless Horizon"): [3],
+    ("eternals", "Endless Resolve"): [("Arcane Eternity", 3)],
+    ("eternals", "Infinite Grace"): [("Celestial Bond", 0)],
+    ("eternals", "Eon's Blessing"): [3],
+    ("eternals", "Perpetual Strength"): [("Eon's Blessing", 0)],
+    ("divine", "Divine Radiance"): [2],
+    ("divine", "Heavenly Beacon"): [2],
+    ("divine", "Seraphim's Grace"): [4],
+    ("divine", "Ascendant Aura"): [4],
+    ("divine", "Sanctified Chalice"): [("Boundless Horizon", 4), ("Seraphim's Grace", 2)],
+    ("divine", "Celestial Crown"): [("Celestial Bond", 3), ("Heavenly Beacon", 2)],
+    ("divine", "Elysian Blessing"): [("Infinity Stone", 5), ("Celestial Crown", 2)],
+    ("divine", "Divine Wrath"): [("Boundless Horizon", 4), ("Seraphim's Grace", 2)],
+    ("divine", "Halo of Eternity"): [("Infinity Stone", 5), ("Celestial Crown", 2)],
+    ("divine", "Transcendent Light"): [("Sanctified Chalice", 3), ("Halo of Eternity", 2)],
+    ("specials", "Time Warp"): [5],
+    ("specials", "Shadow Step"): [("Sanctified Chalice", 3), ("Halo of Eternity", 2)],
+    ("specials", "Elemental Burst"): [4],
+    ("specials", "Magic Shield"): [6],
+    ("specials", "Lucky Charm"): [7],
+}
+
+
+def seed_unlock_rules(apps, schema_editor):
+    # Cards that do not exist in this database are skipped, and a card whose prerequisite
+    # does not exist gets no rules, so it stays locked as the name lookup did before
+    Cards = apps.get_model("user_app", "Cards")
+    CardUnlockRule = apps.get_model("user_app", "CardUnlockRule")
+    by_name = {}
+    for card in Cards.objects.order_by("number"):
+        by_name.setdefault(card.name, card)
+
+    rules = []
+    for card in Cards.objects.all():
+        conditions = SEED_RULES.get((card.card_type, card.name), [])
+        if any(not isinstance(condition, int) and condition[0] not in by_name for condition in conditions):
+            continue # A card without rules stays locked
+        for condition in conditions:
+            if isinstance(condition, int):
+                rules.append(CardUnlockRule(card=card, user_level=condition))
+            else:
+                rules.append(CardUnlockRule(card=card, required_card=by_name[condition[0]], required_card_level=condition[1]))
+    CardUnlockRule.objects.bulk_create(rules)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0031_usertaskclaim_period_bucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardUnlockRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_level', models.PositiveIntegerField(blank=True, null=True)),
+                ('required_card_level', models.PositiveIntegerField(default=0)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unlock_rules', to='user_app.cards')),
+                ('required_card', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='unlocks', to='user_app.cards')),
+            ],
+        ),
+        migrations.RunPython(seed_unlock_rules, migrations.RunPython.noop),
+    ]
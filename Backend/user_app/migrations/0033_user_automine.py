@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-16 23:00
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+
+def backfill_automine_rates(apps, schema_editor):
+    # Same query as automine.backfill_rates, against the historical models
+    User = apps.get_model("user_app", "User")
+    UserCardClaim = apps.get_model("user_app", "UserCardClaim")
+    rates = (
+        UserCardClaim.objects.filter(user=OuterRef("pk"))
+        .order_by()
+        .values("user")
+        .annotate(total=Sum(
+            "card__cards_details__automine_points",
+            filter=Q(card__cards_details__level_number=F("card_level")),
+        ))
+        .values("total")
+    )
+    User.objects.update(automine_synced_at=now(), automine_rate_per_hour=Coalesce(Subquery(rates), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0032_cardunlockrule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='automine_rate_per_hour',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='automine_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_automine_rates, migrations.RunPython.noop),
+    ]
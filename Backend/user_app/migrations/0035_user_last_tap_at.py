@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-16 23:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_app', '0034_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_tap_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,6 @@
 import uuid
 from django.db import models
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from datetime import timedelta
 from .managers import UserManager
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
@@ -22,8 +22,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     username = models.CharField(max_length=100)
     first_name = models.CharField(max_length=100)
     reffer_id = models.PositiveBigIntegerField()
-    reffered_by = models.PositiveBigIntegerField(null=True, blank=True)
+    reffered_by = models.PositiveBigIntegerField(null=True, blank=True, db_index=True)
     reffered_points = models.PositiveBigIntegerField(default=0)
+    referral_count = models.PositiveIntegerField(default=0) # Maintained by the referral worker
 
     balance = models.PositiveBigIntegerField(default=0)
     level_number = models.PositiveIntegerField(default=1)
@@ -33,6 +34,12 @@ class User(AbstractBaseUser, PermissionsMixin):
     multitap_level = models.PositiveIntegerField(default=0)
     recharging_speed_level = models.PositiveIntegerField(default=0)
     autobot_status = models.BooleanField(default=False)
+    last_tap_seq = models.PositiveBigIntegerField(default=0)
+    last_tap_at = models.DateTimeField(null=True, blank=True) # End of the last credited tap window
+    energy = models.FloatField(null=True, blank=True)
+    energy_updated_at = models.DateTimeField(null=True, blank=True)
+    automine_rate_per_hour = models.PositiveBigIntegerField(default=0) # Sum of automine_points of the claimed cards
+    automine_synced_at = models.DateTimeField(null=True, blank=True) # Automine income is paid up to this instant
 
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
@@ -46,17 +53,80 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     objects = UserManager()
 
+    class Meta:
+        indexes = [
+            # Rank lookups and keyset pages (see ranking.py)
+            models.Index(fields=["-balance", "-reffered_points", "date_joined", "id"], name="user_overall_rank_idx"),
+            models.Index(fields=["-reffered_points", "id"], name="user_referral_rank_idx"),
+            models.Index(
+                fields=["user_religion", "-balance", "-reffered_points", "date_joined", "id"], name="user_religion_rank_idx"
+            ),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Column values as loaded from (or last written to) the database
+        self._loaded_values = self._current_values()
+
     def __str__(self) -> str:
         return f"{self.telegram_id} {self.username}"
+
+    def _current_values(self):
+        """
+        Return the loaded (non-deferred) column values keyed by attname.
+        """
+        return {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    def get_dirty_fields(self):
+        """
+        Return the attnames of the columns changed since the row was loaded or saved.
+        """
+        return [
+            name for name, value in self._current_values().items()
+            if name not in self._loaded_values or self._loaded_values[name] != value
+        ]
+
+    def balance_changed(self):
+        """
+        Whether the balance differs from the value last loaded from the database.
+        """
+        return self._loaded_values.get("balance") != self.balance
+
+    def reset_tracking(self, fields=None):
+        """
+        Mark the given columns (or all loaded columns) as in sync with the database.
+        """
+        values = self._current_values()
+        if fields is not None:
+            values = {name: value for name, value in values.items() if name in fields}
+        self._loaded_values.update(values)
+
+    def save(self, *args, **kwargs):
+        """
+        Save only the changed columns of an existing user, or nothing if none changed.
+        """
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            dirty = self.get_dirty_fields()
+            if not dirty:
+                return
+            kwargs["update_fields"] = dirty
+        super().save(*args, **kwargs)
+        self.reset_tracking(kwargs.get("update_fields"))
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.reset_tracking(fields)
     
     def update_user_level(self):
         """
         Update the user level based on the Rules
         """
-        rule = Rules.objects.filter(
-            lower_points__lte=self.balance,
-            higher_points__gte=self.balance
-        ).first()
+        from user_app.levels import resolve_level # Imported here, levels depends on this module
+        rule = resolve_level(self.balance)
         if rule and (rule.level_number > self.level_number):
             self.level_name = rule.level_name
             self.level_number = rule.level_number
@@ -122,6 +192,7 @@ class Tasks(models.Model):
     task_type = models.CharField(max_length=10, choices=TASKS_TYPES_CHOICE)
     points = models.PositiveIntegerField()
     image = models.ImageField(upload_to="tasks")
+    image_variants = models.JSONField(default=dict, blank=True, editable=False) # Resized copies (see images.py)
     url = models.URLField(null=True, blank=True)
     action = models.CharField(max_length=20, choices=ACTION_CHOICES, default="visit")
     is_telegram = models.BooleanField(default=False)
@@ -136,13 +207,34 @@ class UserTaskClaim(models.Model):
     task = models.ForeignKey(Tasks, on_delete=models.CASCADE)
     claimed = models.BooleanField(default=False)
     date_claimed = models.DateTimeField(auto_now_add=True)
+    period_bucket = models.PositiveIntegerField(default=0) # Local day ordinal for daily tasks, 0 otherwise
 
     class Meta:
-        unique_together = ("user", "task", "date_claimed")
+        constraints = [
+            # One claim per task and period: per day for daily tasks, once for the others
+            models.UniqueConstraint(fields=["user", "task", "period_bucket"], name="user_task_claim_period_uniq"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.user.telegram_id} - {self.task.name} - {self.claimed}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.period_bucket:
+            self.period_bucket = self.period_for(self.task, self.date_claimed)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def period_for(task, at=None):
+        """
+        Claim period of `task` containing the moment `at` (default now).
+
+        Returns:
+            int: The local day ordinal for daily tasks, 0 for one-off tasks.
+        """
+        if task.task_type == "daily":
+            return localdate(at).toordinal()
+        return 0
+
 # Table: Cards
 # -----------------------------------------------------------------------------------------------------
 class Cards(models.Model):
@@ -155,6 +247,7 @@ class Cards(models.Model):
     name = models.CharField(max_length=255)
     number = models.PositiveIntegerField(default=1)
     image = models.ImageField(upload_to="cards", null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False) # Resized copies (see images.py)
     description = models.TextField(null=True, blank=True)
     card_type = models.CharField(max_length=20, choices=CARDS_TYPE_CHOICES)
 
@@ -172,6 +265,23 @@ class CardsDetails(models.Model):
     def __str__(self) -> str:
         return f"{self.card.name} - {self.level_number} - {self.burning_points} - {self.automine_points}"
     
+# Table: CardUnlockRule
+# -----------------------------------------------------------------------------------------------------
+class CardUnlockRule(models.Model):
+    """
+    One condition for unlocking a card; a card unlocks when all of its rules hold.
+
+    A rule requires a minimum user level, a claimed prerequisite card at a minimum card
+    level, or both. Cards without rules stay locked.
+    """
+    card = models.ForeignKey(Cards, on_delete=models.CASCADE, related_name="unlock_rules")
+    user_level = models.PositiveIntegerField(null=True, blank=True) # Minimum user level_number
+    required_card = models.ForeignKey(Cards, on_delete=models.CASCADE, null=True, blank=True, related_name="unlocks")
+    required_card_level = models.PositiveIntegerField(default=0) # Minimum level of the claimed required_card
+
+    def __str__(self) -> str:
+        return f"{self.card.name} - {self.user_level} - {self.required_card_id} - {self.required_card_level}"
+
 # Table: UserCardClaim
 # -----------------------------------------------------------------------------------------------------
 class UserCardClaim(models.Model):
@@ -248,4 +358,107 @@ class UserDailyReward(models.Model):
         self.current_day = self.current_day + 1 if self.current_day < 7 else 1
         self.last_claimed_at = now()
         self.save()
-        return True
\ No newline at end of file
+        return True
+# Table: BalanceFlush
+# -----------------------------------------------------------------------------------------------------
+class BalanceFlush(models.Model):
+    """
+    Record of a write-behind batch that has been applied to user balances.
+    Used to make replaying the append log after a crash idempotent.
+    """
+    batch_id = models.CharField(max_length=64, unique=True)
+    flushed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.batch_id} on {self.flushed_at}"
+
+# Table: PendingReferralReward
+# -----------------------------------------------------------------------------------------------------
+class PendingReferralReward(models.Model):
+    """
+    Referral reward waiting to be applied by the referral worker.
+    One row per referee, which makes applying the reward idempotent.
+    """
+    referee = models.OneToOneField(User, on_delete=models.CASCADE, related_name="pending_referral_reward")
+    refferer_telegram_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.refferer_telegram_id} <- {self.referee_id} processed on {self.processed_at}"
+
+# Table: LeaderboardSnapshot
+# -----------------------------------------------------------------------------------------------------
+class LeaderboardSnapshot(models.Model):
+    """
+    Pre-serialized, rank-annotated top rows of a leaderboard (see leaderboards.py).
+    """
+    board = models.CharField(max_length=50, unique=True)
+    payload = models.JSONField(default=list)
+    threshold = models.PositiveBigIntegerField(default=0) # Score of the last row on the board
+    stale = models.BooleanField(default=False) # Set when a score crosses the threshold
+    refreshed_at = models.DateTimeField()
+
+    def __str__(self) -> str:
+        return f"{self.board} refreshed on {self.refreshed_at}"
+
+# Table: IncomeRollup
+# -----------------------------------------------------------------------------------------------------
+class IncomeRollup(models.Model):
+    """
+    Points credited to a user within one day or week (see rollups.py).
+    """
+    PERIOD_CHOICES = [
+        ("day", "Day"),
+        ("week", "Week"),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="income_rollups")
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    bucket = models.PositiveIntegerField() # Date ordinal of the day, or of the Monday of the week
+    points = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("user", "period", "bucket")
+        indexes = [
+            models.Index(fields=["period", "bucket", "-points", "id"], name="income_rollup_rank_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} - {self.period} {self.bucket} - {self.points}"
+
+# Table: ReferralClosure
+# -----------------------------------------------------------------------------------------------------
+class ReferralClosure(models.Model):
+    """
+    Ancestor/descendant pairs of the referral tree, up to downline.MAX_DEPTH levels apart.
+    """
+    ancestor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="downline")
+    descendant = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upline")
+    depth = models.PositiveSmallIntegerField() # 1 for a direct referral
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+        indexes = [
+            models.Index(fields=["ancestor", "depth", "id"], name="referral_downline_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
+# Table: DownlineStats
+# -----------------------------------------------------------------------------------------------------
+class DownlineStats(models.Model):
+    """
+    Size and combined balance of one tier of a user's downline; the size is kept up to date on
+    signup, the balance is refreshed periodically (downline.refresh_balances).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="downline_stats")
+    depth = models.PositiveSmallIntegerField()
+    members = models.PositiveIntegerField(default=0)
+    balance = models.BigIntegerField(default=0) # Combined balance of the members
+
+    class Meta:
+        unique_together = ("user", "depth")
+
+    def __str__(self) -> str:
+        return f"{self.user_id} tier {self.depth}: {self.members} members"
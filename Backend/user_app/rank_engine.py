@@ -0,0 +1,336 @@
+import logging
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from django.conf import settings
+from user_app.models import User
+
+logger = logging.getLogger(__name__)
+
+# Rank Engine
+# -----------------------------------------------------------------------------------------
+# In-process, sorted copy of every user's ranking keys, used when LEADERBOARD_BACKEND is
+# "engine". Wallet updates are applied as events after commit; a background thread reloads
+# the table every LEADERBOARD_ENGINE_RECONCILE_SECONDS (picking up changes made by other
+# workers) and writes a binary snapshot that the next worker start loads instead of the
+# database.
+
+BOARDS = {
+    # Board -> sort key, ascending in leaderboard order
+    "overall": lambda balance, reffered_points, joined: (-balance, -reffered_points, joined),
+    "referral": lambda balance, reffered_points, joined: (-reffered_points,),
+}
+
+MAGIC = b"LBE1"
+HEADER = struct.Struct("<4sQ") # Magic, number of records
+RECORD = struct.Struct("<QQQd") # User id, balance, reffered_points, date_joined timestamp
+
+class SortedKeys:
+    """
+    Blocked sorted array of unique keys with O(log n) positional lookups.
+
+    Keys live in sorted blocks of LOAD to 2 * LOAD items; a Fenwick tree over the block
+    lengths turns "how many keys are before this one" into a prefix sum.
+    """
+    LOAD = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._blocks = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._reindex()
+
+    def __len__(self):
+        return self._len
+
+    def _reindex(self):
+        """
+        Rebuild the block maxima and the Fenwick tree after blocks were split or dropped.
+        """
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = sum(len(block) for block in self._blocks)
+        tree = [0] * (len(self._blocks) + 1)
+        for i, block in enumerate(self._blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _grow(self, block, delta):
+        i = block + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, block):
+        """
+        Number of keys in the blocks before `block`.
+        """
+        total = 0
+        while block > 0:
+            total += self._tree[block]
+            block -= block & -block
+        return total
+
+    def _locate(self, position):
+        """
+        Map a position to (block index, offset in block).
+        """
+        block, step = 0, 1 << len(self._tree).bit_length()
+        while step:
+            candidate = block + step
+            if candidate < len(self._tree) and self._tree[candidate] <= position:
+                block = candidate
+                position -= self._tree[candidate]
+            step >>= 1
+        return block, position
+
+    def add(self, key):
+        if not self._blocks:
+            self._blocks = [[key]]
+            self._reindex()
+            return
+        i = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+        block = self._blocks[i]
+        insort(block, key)
+        self._maxes[i] = block[-1]
+        self._len += 1
+        if len(block) > 2 * self.LOAD:
+            self._blocks[i:i + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            self._reindex()
+        else:
+            self._grow(i, 1)
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        block = self._blocks[i]
+        del block[bisect_left(block, key)]
+        self._len -= 1
+        if block:
+            self._maxes[i] = block[-1]
+            self._grow(i, -1)
+        else:
+            del self._blocks[i]
+            self._reindex()
+
+    def index(self, key):
+        """
+        Number of keys strictly lower than `key`.
+        """
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            return self._len
+        return self._prefix(i) + bisect_left(self._blocks[i], key)
+
+    def slice(self, start, stop):
+        """
+        Keys at positions [start, stop).
+        """
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        i, j = self._locate(start)
+        keys, remaining = [], stop - start
+        while remaining > 0:
+            chunk = self._blocks[i][j:j + remaining]
+            keys.extend(chunk)
+            remaining -= len(chunk)
+            i, j = i + 1, 0
+        return keys
+
+class Board:
+    """
+    One leaderboard: every user's entry in order, plus the distinct keys for dense ranks.
+    """
+    def __init__(self, entries=()):
+        entries = sorted(entries) # (key, user id)
+        self.entries = SortedKeys(entries)
+        self.counts = Counter(key for key, _ in entries)
+        self.distinct = SortedKeys(self.counts)
+
+    def add(self, user_id, key):
+        self.entries.add((key, user_id))
+        self.counts[key] += 1
+        if self.counts[key] == 1:
+            self.distinct.add(key)
+
+    def remove(self, user_id, key):
+        self.entries.remove((key, user_id))
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            del self.counts[key]
+            self.distinct.remove(key)
+
+    def rank(self, key):
+        """
+        Dense rank of `key`: one plus the number of distinct keys ahead of it.
+        """
+        return self.distinct.index(key) + 1
+
+    def range(self, start, stop):
+        """
+        Entries at positions [start, stop) as (user id, dense rank).
+        """
+        rows, rank, previous = [], None, None
+        for key, user_id in self.entries.slice(start, stop):
+            if rank is None:
+                rank = self.rank(key)
+            elif key != previous:
+                rank += 1
+            rows.append((user_id, rank))
+            previous = key
+        return rows
+
+class RankEngine:
+    """
+    Sorted ranking keys of every user, for all BOARDS.
+
+    Args:
+        path (str): Binary snapshot file.
+        reconcile_seconds (int): Reload interval of the background thread; 0 disables it.
+    """
+    def __init__(self, path, reconcile_seconds):
+        self.path = path
+        self.reconcile_seconds = reconcile_seconds
+        self.lock = threading.RLock()
+        self.load({})
+
+    def load(self, users):
+        """
+        Replace the engine contents.
+
+        Args:
+            users (dict): User id -> (balance, reffered_points, date_joined timestamp).
+        """
+        boards = {
+            name: Board((key(*values), user_id) for user_id, values in users.items())
+            for name, key in BOARDS.items()
+        }
+        with self.lock:
+            self.users, self.boards = users, boards
+
+    def reload(self):
+        """
+        Reload every user from the database and write a new snapshot.
+        """
+        rows = User.objects.values_list("id", "balance", "reffered_points", "date_joined")
+        self.load({
+            user_id: (balance, reffered_points, joined.timestamp())
+            for user_id, balance, reffered_points, joined in rows.iterator(chunk_size=10000)
+        })
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        with self.lock:
+            users = list(self.users.items())
+        temporary = f"{self.path}.{os.getpid()}.tmp" # Workers may reload at the same time
+        with open(temporary, "wb") as handle:
+            handle.write(HEADER.pack(MAGIC, len(users)))
+            for user_id, values in users:
+                handle.write(RECORD.pack(user_id, *values))
+        os.replace(temporary, self.path)
+
+    def read_snapshot(self):
+        """
+        Load the snapshot file if there is a valid one.
+
+        Returns:
+            bool: Whether the snapshot was loaded.
+        """
+        try:
+            with open(self.path, "rb") as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return False
+        if len(data) < HEADER.size:
+            return False
+        magic, count = HEADER.unpack_from(data)
+        if magic != MAGIC or len(data) != HEADER.size + count * RECORD.size:
+            return False
+        self.load({
+            user_id: (balance, reffered_points, joined)
+            for user_id, balance, reffered_points, joined in RECORD.iter_unpack(data[HEADER.size:])
+        })
+        return True
+
+    def note(self, user_id, row):
+        """
+        Apply a wallet update to a known user; unknown users arrive with the next reload.
+
+        Args:
+            user_id (int): The updated user.
+            row (dict): Column values read back after the update.
+        """
+        with self.lock:
+            if user_id not in self.users:
+                return
+            old = self.users[user_id]
+            new = (row.get("balance", old[0]), row.get("reffered_points", old[1]), old[2])
+            if new == old:
+                return
+            for name, key in BOARDS.items():
+                board = self.boards[name]
+                board.remove(user_id, key(*old))
+                board.add(user_id, key(*new))
+            self.users[user_id] = new
+
+    def rank(self, board, balance, reffered_points, date_joined):
+        with self.lock:
+            joined = date_joined.timestamp() if date_joined else 0.0
+            return self.boards[board].rank(BOARDS[board](balance, reffered_points, joined))
+
+    def range(self, board, start, stop):
+        with self.lock:
+            return self.boards[board].range(start, stop)
+
+    def start(self, reload_now=False):
+        """
+        Reload in a daemon thread every reconcile_seconds.
+
+        Args:
+            reload_now (bool): Reload right away, e.g. after warming up from an old snapshot.
+        """
+        def run():
+            if not reload_now:
+                time.sleep(self.reconcile_seconds)
+            while True:
+                try:
+                    self.reload()
+                except Exception:
+                    # Keep serving the current contents; the next reload retries
+                    logger.exception("Rank engine reload failed; serving the previous contents.")
+                time.sleep(self.reconcile_seconds)
+
+        threading.Thread(target=run, name="rank-engine", daemon=True).start()
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def is_enabled():
+    return settings.LEADERBOARD_BACKEND == "engine"
+
+def get_engine():
+    """
+    The process-wide engine, warmed from the snapshot file or else from the database.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = RankEngine(settings.LEADERBOARD_ENGINE_PATH, settings.LEADERBOARD_ENGINE_RECONCILE_SECONDS)
+            warm = engine.read_snapshot()
+            if not warm:
+                engine.reload()
+            if engine.reconcile_seconds:
+                engine.start(reload_now=warm)
+            _engine = engine
+        return _engine
+
+def note(user_id, row):
+    """
+    Forward a committed wallet update to the engine, if it is running in this process.
+    """
+    if is_enabled() and _engine is not None:
+        _engine.note(user_id, row)
@@ -0,0 +1,190 @@
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from user_app import rank_engine
+from user_app.models import User
+
+# Ranking
+# -----------------------------------------------------------------------------------------
+# Exact dense ranks for a single user without ranking the whole table: a user's dense rank
+# is one plus the number of distinct ranking keys strictly ahead of theirs. Both lookups are
+# range scans of the composite indexes declared on User. With LEADERBOARD_BACKEND = "engine"
+# the same questions are answered from the in-process rank engine instead. Passing a
+# `religion` scopes a lookup to that community, served by the religion-prefixed index.
+
+def users_in(religion=None):
+    """
+    All users, or the users of one religion.
+    """
+    return User.objects.filter(user_religion=religion) if religion else User.objects.all()
+
+def overall_rank(balance, reffered_points, date_joined, religion=None):
+    """
+    Dense rank by balance desc, reffered_points desc, date_joined asc.
+
+    Args:
+        religion (str, optional): Rank among the users of this religion only.
+
+    Returns:
+        int: Same value as DENSE_RANK() over that ordering (partitioned by religion if given).
+    """
+    if rank_engine.is_enabled() and not religion:
+        return rank_engine.get_engine().rank("overall", balance, reffered_points, date_joined)
+    ahead = users_in(religion).filter(
+        Q(balance__gt=balance)
+        | Q(balance=balance, reffered_points__gt=reffered_points)
+        | Q(balance=balance, reffered_points=reffered_points, date_joined__lt=date_joined)
+    )
+    return ahead.values("balance", "reffered_points", "date_joined").distinct().count() + 1
+
+def referral_rank(reffered_points):
+    """
+    Dense rank by reffered_points desc.
+
+    Returns:
+        int: Same value as DENSE_RANK() over that ordering.
+    """
+    if rank_engine.is_enabled():
+        return rank_engine.get_engine().rank("referral", 0, reffered_points, None)
+    return User.objects.filter(reffered_points__gt=reffered_points).values("reffered_points").distinct().count() + 1
+
+def top_users(board, limit):
+    """
+    The first `limit` users of an engine board, each annotated with its dense `rank`.
+
+    Args:
+        board (str): "overall" or "referral".
+        limit (int): Number of users.
+
+    Returns:
+        list: User instances in leaderboard order.
+    """
+    entries = rank_engine.get_engine().range(board, 0, limit)
+    users = User.objects.in_bulk([user_id for user_id, _ in entries])
+    top = []
+    for user_id, rank in entries:
+        if user_id in users: # Skip users deleted since the last reload
+            users[user_id].rank = rank
+            top.append(users[user_id])
+    return top
+
+# Pages
+# -----------------------------------------------------------------------------------------
+# Keyset pagination over the leaderboard orderings. Each ordering ends with the primary key
+# so it is total; a page is one range scan of the matching index, starting right after the
+# last row of the previous page. Cursors carry that row's key and dense rank, so ranks keep
+# counting across pages without another COUNT.
+
+ORDERINGS = {
+    # Board -> (field, descending); the fields before "id" form the dense ranking key
+    "overall": (("balance", True), ("reffered_points", True), ("date_joined", False), ("id", False)),
+    "referral": (("reffered_points", True), ("id", False)),
+}
+
+def order_by(board, reverse=False):
+    return [f"-{field}" if descending != reverse else field for field, descending in ORDERINGS[board]]
+
+def key_of(board, user):
+    return {field: getattr(user, field) for field, _ in ORDERINGS[board]}
+
+def rank_key(board, key):
+    return tuple(key[field] for field, _ in ORDERINGS[board][:-1])
+
+def beyond(board, key, reverse=False):
+    """
+    Filter for the users after `key` in leaderboard order (before it if `reverse`).
+    """
+    condition, equal = Q(), {}
+    for field, descending in ORDERINGS[board]:
+        lookup = "lt" if descending != reverse else "gt"
+        condition |= Q(**equal, **{f"{field}__{lookup}": key[field]})
+        equal[field] = key[field]
+    return condition
+
+def annotate_ranks(board, users, first_rank):
+    """
+    Set the dense `rank` of consecutive users, starting from the first one's rank.
+    """
+    rank, previous = first_rank, None
+    for user in users:
+        key = rank_key(board, key_of(board, user))
+        if previous is not None and key != previous:
+            rank += 1
+        user.rank, previous = rank, key
+    return users
+
+def encode_cursor(board, user, religion=None):
+    key = key_of(board, user)
+    if "date_joined" in key:
+        key["date_joined"] = key["date_joined"].isoformat()
+    return base64.urlsafe_b64encode(json.dumps({"key": key, "rank": user.rank, "religion": religion}).encode()).decode()
+
+def decode_cursor(board, cursor, religion=None):
+    """
+    Raises:
+        ValueError: If the cursor is malformed or belongs to another board.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key, rank = state["key"], int(state["rank"])
+        if set(key) != {field for field, _ in ORDERINGS[board]} or state.get("religion") != religion:
+            raise ValueError("Cursor does not match the board.")
+        for field in key:
+            key[field] = parse_datetime(key[field]) if field == "date_joined" else int(key[field])
+        if key.get("date_joined", True) is None:
+            raise ValueError("Invalid date in cursor.")
+    except (TypeError, KeyError, AttributeError, json.JSONDecodeError, UnicodeDecodeError) as error:
+        raise ValueError("Invalid cursor.") from error
+    return key, rank
+
+def page(board, cursor=None, limit=50, religion=None):
+    """
+    One page of a leaderboard.
+
+    Args:
+        board (str): "overall" or "referral".
+        cursor (str, optional): `next_cursor` of the previous page; None for the top.
+        limit (int): Page size.
+        religion (str, optional): Only page through the users of this religion.
+
+    Raises:
+        ValueError: If the cursor is invalid.
+
+    Returns:
+        tuple: (users annotated with `rank`, next cursor or None).
+    """
+    queryset = users_in(religion).order_by(*order_by(board))
+    first_rank = 1
+    if cursor:
+        key, rank = decode_cursor(board, cursor, religion)
+        queryset = queryset.filter(beyond(board, key))
+    users = list(queryset[:limit + 1])
+    has_more = len(users) > limit
+    users = users[:limit]
+    if users and cursor:
+        first_rank = rank + (rank_key(board, key_of(board, users[0])) != rank_key(board, key))
+    annotate_ranks(board, users, first_rank)
+    return users, encode_cursor(board, users[-1], religion) if has_more else None
+
+def around(board, user, radius=10, religion=None):
+    """
+    The `radius` users above and below `user`, and `user` itself.
+
+    Args:
+        religion (str, optional): Only consider the users of this religion (normally the user's own).
+
+    Returns:
+        list: Users in leaderboard order, annotated with `rank`.
+    """
+    user = User.objects.get(pk=user.pk) # Rank on the stored values
+    key = key_of(board, user)
+    above = users_in(religion).filter(beyond(board, key, reverse=True)).order_by(*order_by(board, reverse=True))
+    below = users_in(religion).filter(beyond(board, key)).order_by(*order_by(board))
+    users = list(above[:radius])[::-1] + [user] + list(below[:radius])
+    first = users[0]
+    if board == "overall":
+        first_rank = overall_rank(first.balance, first.reffered_points, first.date_joined, religion)
+    else:
+        first_rank = referral_rank(first.reffered_points)
+    return annotate_ranks(board, users, first_rank)
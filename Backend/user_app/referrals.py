@@ -0,0 +1,89 @@
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+from user_app import catalog, downline, wallet
+from user_app.models import PendingReferralReward, User
+
+# Referral Rewards
+# -----------------------------------------------------------------------------------------
+# Signing up with a referral link only inserts a PendingReferralReward row. The worker
+# (`manage.py process_referral_rewards`) applies pending rows in batches, with one F()
+# UPDATE of balance and reffered_points per referrer, so a viral link does not make every
+# signup contend on the referrer's row. The same UPDATE maintains User.referral_count, and
+# the batch is counted in the downline tier sizes of the referees' upline.
+
+class ConcurrentBatch(Exception):
+    """
+    Another worker claimed some of the pending rows of this batch first.
+    """
+
+def process_pending(batch_size=1000):
+    """
+    Apply one batch of pending referral rewards.
+
+    Args:
+        batch_size (int): Maximum number of pending rows to apply.
+
+    Returns:
+        int: Number of pending rows processed.
+    """
+    with transaction.atomic():
+        pending = list(
+            PendingReferralReward.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by("id")
+            .values_list("id", "refferer_telegram_id", "referee_id")[:batch_size]
+        )
+        if not pending:
+            return 0
+
+        # Claim the rows first so a concurrent worker can never apply them a second time
+        ids = [pending_id for pending_id, _, _ in pending]
+        if PendingReferralReward.objects.filter(id__in=ids, processed_at__isnull=True).update(processed_at=now()) != len(ids):
+            raise ConcurrentBatch("Pending referral rewards were claimed by another worker.")
+
+        downline.add_members([referee_id for _, _, referee_id in pending])
+        referrals = Counter(refferer_telegram_id for _, refferer_telegram_id, _ in pending)
+        rewards = catalog.reffer_rewards()
+        refferers = User.objects.filter(telegram_id__in=referrals).only(
+            "id", "telegram_id", "reffered_by", "balance", "level_number", "level_name", "reffered_points", "referral_count"
+        )
+        for refferer in refferers:
+            count = referrals[refferer.telegram_id]
+            # Apply the reward based on the refferer level; levels without a reward get nothing
+            reward = rewards.get(refferer.level_number)
+            if reward:
+                total = reward * count
+                wallet.credit(
+                    refferer, total,
+                    reffered_points=F("reffered_points") + total,
+                    referral_count=F("referral_count") + count,
+                )
+            else:
+                User.objects.filter(pk=refferer.pk).update(referral_count=F("referral_count") + count)
+    return len(pending)
+
+def counted_referrals(users):
+    """
+    Filter referred users down to those already included in referral_count, i.e. users
+    whose reward was processed or who signed up before rewards were deferred.
+    """
+    return users.filter(Q(pending_referral_reward__isnull=True) | Q(pending_referral_reward__processed_at__isnull=False))
+
+def backfill_referral_counts():
+    """
+    Recompute User.referral_count for every user in a single UPDATE.
+
+    Returns:
+        int: Number of users updated.
+    """
+    counts = (
+        counted_referrals(User.objects.filter(reffered_by=OuterRef("telegram_id")))
+        .order_by()
+        .values("reffered_by")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    return User.objects.update(referral_count=Coalesce(Subquery(counts), 0))
@@ -0,0 +1,64 @@
+from django.db import connection
+from django.utils import timezone
+from user_app.models import IncomeRollup
+
+# Income Rollups
+# -----------------------------------------------------------------------------------------
+# Every credit adds its points to the user's row for the current day and week, with one
+# INSERT ... ON CONFLICT DO UPDATE. A new window simply starts new rows (the bucket is the
+# date ordinal of the day or of the week's Monday in TIME_ZONE), so the daily and weekly
+# leaderboards are index range scans over a single bucket.
+
+PERIODS = ("day", "week")
+CHUNK_SIZE = 200 # Rows per INSERT, keeping SQLite below its bound parameter limit
+
+def bucket(period, at=None):
+    """
+    Bucket of `period` containing the moment `at` (default now).
+    """
+    day = timezone.localdate(at)
+    if period == "week":
+        return day.toordinal() - day.weekday()
+    return day.toordinal()
+
+def record(user_id, amount, at=None):
+    """
+    Add a credit of `amount` to the user's current rollups.
+    """
+    record_many({user_id: amount}, at)
+
+def record_many(amounts, at=None):
+    """
+    Add credits to the current rollups of several users.
+
+    Args:
+        amounts (dict): Points keyed by user id.
+        at (datetime, optional): Time of the credits; defaults to now.
+    """
+    buckets = {period: bucket(period, at) for period in PERIODS}
+    rows = [
+        (user_id, period, buckets[period], amount)
+        for user_id, amount in amounts.items() if amount > 0
+        for period in PERIODS
+    ]
+    table = connection.ops.quote_name(IncomeRollup._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), CHUNK_SIZE):
+            chunk = rows[start:start + CHUNK_SIZE]
+            cursor.execute(
+                f"INSERT INTO {table} (user_id, period, bucket, points) VALUES "
+                + ", ".join(["(%s, %s, %s, %s)"] * len(chunk))
+                + f" ON CONFLICT (user_id, period, bucket) DO UPDATE SET points = {table}.points + excluded.points",
+                [value for row in chunk for value in row],
+            )
+
+def prune(keep_days=7, keep_weeks=8):
+    """
+    Delete rollups of windows that ended more than `keep_days` days / `keep_weeks` weeks ago.
+
+    Returns:
+        int: Number of rows deleted.
+    """
+    deleted, _ = IncomeRollup.objects.filter(period="day", bucket__lt=bucket("day") - keep_days).delete()
+    old_weeks, _ = IncomeRollup.objects.filter(period="week", bucket__lt=bucket("week") - 7 * keep_weeks).delete()
+    return deleted + old_weeks
@@ -1,5 +1,8 @@
 from django.utils import timezone
-from user_app.models import BoosterClaim, DailyReward, User, Earnings, Tasks, UserDailyReward, UserTaskClaim, Cards, UserCardClaim, CardsDetails
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Q, Value, When
+from user_app import automine, card_state, catalog, energy, images, task_claims, wallet, write_behind
+from user_app.models import BoosterClaim, DailyReward, DownlineStats, IncomeRollup, ReferralClosure, User, Earnings, Tasks, UserDailyReward, UserTaskClaim, Cards, UserCardClaim, CardsDetails
 from rest_framework import serializers
 from datetime import timedelta
 from django.utils.timezone import now
@@ -25,13 +28,14 @@ class UpdateBalanceSerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
         """
-        Ensure that the new balance (amount) is greater than the user's current balance.
+        Ensure that the new balance (amount) is greater than the user's current balance,
+        including the credits still queued for write-behind that the client was shown.
         
         Raises:
             ValidationError: If the new balance is not greater than the current balance.
         """
         # Ensure that the updated amount is greater than the current balance
-        if self.instance.balance >= attrs.get("amount"):
+        if self.instance.balance + write_behind.pending_for(self.instance) >= attrs.get("amount"):
             raise serializers.ValidationError("Updated amount should be greater than the current balance.")
         
         return attrs
@@ -39,6 +43,10 @@ class UpdateBalanceSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         """
         Update the user's balance.
+
+        The increment is clamped to what the user's energy allows, so the returned
+        balance may be lower than the requested amount. A request racing another one that
+        already spent the same energy credits nothing and returns the stored balance.
         
         Args:
             instance: The user instance being updated.
@@ -47,9 +55,150 @@ class UpdateBalanceSerializer(serializers.ModelSerializer):
         Returns:
             Updated user instance with the new balance.
         """
-        instance.balance = validated_data["amount"]
-        instance.save()
-        return instance    
+        pending = write_behind.pending_for(instance)
+        points, energy_fields = energy.spend_points(instance, validated_data["amount"] - instance.balance - pending)
+        try:
+            # Compare-and-set on the energy stamp so parallel requests cannot spend the
+            # same energy twice
+            result = wallet.credit(
+                instance, points, conditions={"energy_updated_at": instance.energy_updated_at}, **energy_fields
+            )
+        except wallet.WalletError:
+            instance.refresh_from_db(fields=["balance", "level_number", "level_name", "energy", "energy_updated_at"])
+            self.context["balance"] = instance.balance + write_behind.pending_for(instance)
+            return instance
+        self.context["balance"] = result.balance # Includes credits still queued for write-behind
+        return instance
+
+    def to_representation(self, instance):
+        """
+        Return the balance the update produced; the instance itself is left at the stored
+        balance so a later save() cannot write queued credits.
+        """
+        data = super().to_representation(instance)
+        data["balance"] = self.context.get("balance", data["balance"])
+        return data
+
+# Serializer: TapEvent
+# -----------------------------------------------------------------------------------------
+class TapEventSerializer(serializers.Serializer):
+    """
+    A single tap delta reported by the client.
+
+    Fields:
+        - seq: Client sequence number, strictly increasing per user.
+        - count: Number of taps made during the window.
+        - started_at: Start of the tap window.
+        - ended_at: End of the tap window.
+    """
+    seq = serializers.IntegerField(min_value=1)
+    count = serializers.IntegerField(min_value=0)
+    started_at = serializers.DateTimeField()
+    ended_at = serializers.DateTimeField()
+
+    def validate(self, attrs):
+        """
+        Ensure the window is well formed and the tap count is humanly possible.
+        """
+        if attrs["ended_at"] < attrs["started_at"]:
+            raise serializers.ValidationError("ended_at must not be before started_at.")
+        if attrs["ended_at"] > now() + TapBatchSerializer.CLOCK_SKEW:
+            raise serializers.ValidationError("Tap window lies in the future.")
+
+        seconds = (attrs["ended_at"] - attrs["started_at"]).total_seconds()
+        if attrs["count"] > (seconds + 1) * TapBatchSerializer.MAX_TAPS_PER_SECOND:
+            raise serializers.ValidationError("Too many taps for the reported window.")
+        return attrs
+
+# Serializer: TapBatch
+# -----------------------------------------------------------------------------------------
+class TapBatchSerializer(serializers.Serializer):
+    """
+    Serializer for ingesting a batch of tap deltas in one round trip.
+
+    Events already applied (seq <= user's last_tap_seq) are ignored, so the client can
+    safely retry a flush. All fresh events are applied with one conditional UPDATE.
+    Tap windows may not overlap, within a batch or with earlier flushes, so a count is
+    never justified by reused time. Fresh windows that started more than MAX_WINDOW_AGE
+    ago are skipped: the sequence moves past them but their taps are not credited.
+    """
+    MAX_EVENTS = 100
+    MAX_TAPS_PER_SECOND = 20
+    CLOCK_SKEW = timedelta(seconds=30)
+    MAX_WINDOW_AGE = timedelta(minutes=5)
+
+    events = TapEventSerializer(many=True, allow_empty=False, max_length=MAX_EVENTS, write_only=True)
+
+    def validate_events(self, events):
+        """
+        Ensure the sequence numbers within the batch are strictly increasing and each
+        window starts no earlier than the previous one ended.
+        """
+        seqs = [event["seq"] for event in events]
+        if any(later <= earlier for earlier, later in zip(seqs, seqs[1:])):
+            raise serializers.ValidationError("Event sequence numbers must be strictly increasing.")
+        if any(later["started_at"] < earlier["ended_at"] for earlier, later in zip(events, events[1:])):
+            raise serializers.ValidationError("Tap windows must not overlap.")
+        return events
+
+    def validate(self, attrs):
+        """
+        Ensure the fresh events start after the last credited window.
+        """
+        user = self.context["request"].user
+        fresh = [event for event in attrs["events"] if event["seq"] > user.last_tap_seq]
+        if fresh and user.last_tap_at and fresh[0]["started_at"] < user.last_tap_at:
+            raise serializers.ValidationError("Tap window overlaps an already credited one.")
+        return attrs
+
+    def save(self, **kwargs):
+        """
+        Apply all fresh tap events to the user's balance in a single UPDATE.
+
+        Taps of stale windows and taps beyond the user's current energy are dropped; the
+        energy left after the flush is written in the same statement.
+        """
+        user = self.context["request"].user
+        fresh = [event for event in self.validated_data["events"] if event["seq"] > user.last_tap_seq]
+        cutoff = now() - self.MAX_WINDOW_AGE
+        self.context["accepted_taps"] = 0
+        self.context["balance"] = user.balance + write_behind.pending_for(user)
+
+        if fresh:
+            recent = sum(event["count"] for event in fresh if event["started_at"] >= cutoff)
+            taps, points, energy_fields = energy.spend_taps(user, recent)
+            try:
+                # Compare-and-set on last_tap_seq and the energy stamp so a concurrent retry
+                # of the same flush is a no-op
+                result = wallet.credit(
+                    user,
+                    points,
+                    conditions={"last_tap_seq": user.last_tap_seq, "energy_updated_at": user.energy_updated_at},
+                    last_tap_seq=fresh[-1]["seq"],
+                    last_tap_at=fresh[-1]["ended_at"],
+                    **energy_fields
+                )
+                self.context["accepted_taps"] = taps
+                self.context["balance"] = result.balance # Includes credits still queued for write-behind
+            except wallet.WalletError:
+                user.refresh_from_db(fields=["balance", "level_number", "level_name", "last_tap_seq", "last_tap_at", "energy", "energy_updated_at"])
+                self.context["balance"] = user.balance + write_behind.pending_for(user)
+
+        self.instance = user
+        return user
+
+    def to_representation(self, instance):
+        """
+        Return the authoritative balance and level after the flush.
+        """
+        return {
+            "balance": self.context.get("balance", instance.balance),
+            "level_number": instance.level_number,
+            "level_name": instance.level_name,
+            "last_seq": instance.last_tap_seq,
+            "accepted_taps": self.context.get("accepted_taps", 0),
+            "energy": energy.available_energy(instance),
+        }
 
 # Serializer: UserEarning
 # ----------------------------------------------------------------------------------------------
@@ -67,6 +216,8 @@ class UserEarningsSerializer(serializers.ModelSerializer):
         """
         # get the current user
         user = self.context["request"].user
+        if attrs["transaction_type"] == "DEBIT":
+            wallet.settle_pending(user)
         if attrs["transaction_type"] == "DEBIT" and user.balance < attrs["amount"]:
             raise serializers.ValidationError("Insufficient Funds")
         return attrs
@@ -83,6 +234,31 @@ class UserRefferalLeaderboardSerializer(serializers.ModelSerializer):
         model = User
         fields = ["telegram_id", "username", "first_name", "balance", "rank"]
 
+# Serializer: Downline
+# ----------------------------------------------------------------------------------------------
+class DownlineSerializer(serializers.ModelSerializer):
+    """
+    Serializer for one member of a user's downline.
+    """
+    telegram_id = serializers.IntegerField(source="descendant.telegram_id")
+    username = serializers.CharField(source="descendant.username")
+    first_name = serializers.CharField(source="descendant.first_name")
+    balance = serializers.IntegerField(source="descendant.balance")
+
+    class Meta:
+        model = ReferralClosure
+        fields = ["telegram_id", "username", "first_name", "balance", "depth"]
+
+# Serializer: DownlineStats
+# ----------------------------------------------------------------------------------------------
+class DownlineStatsSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the size and combined balance of one downline tier.
+    """
+    class Meta:
+        model = DownlineStats
+        fields = ["depth", "members", "balance"]
+
 # Serializer: OverallLeaderboard
 # ----------------------------------------------------------------------------------------------
 class OverallLeaderboardSerializer(serializers.ModelSerializer):
@@ -102,19 +278,56 @@ class RefferalLeaderboardSerializer(serializers.ModelSerializer):
     Serializer for referral leaderboard. Includes additional field to count referrals.
     """
     rank = serializers.IntegerField()
-    refferal_counts = serializers.SerializerMethodField()
+    refferal_counts = serializers.IntegerField(source="referral_count") # Denormalized count of referred users
 
     class Meta:
         model = User
         fields = ["telegram_id", "username", "first_name", "reffered_points", "rank", "refferal_counts"]
 
-    def get_refferal_counts(self, obj):
-        """
-        Count the number of users referred by the current user.
-        """
-        return User.objects.filter(reffered_by=obj.telegram_id).count()
 
+# Serializer: WindowedLeaderboard
+# ----------------------------------------------------------------------------------------------
+class WindowedLeaderboardSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the daily and weekly leaderboards, read from income rollups.
+    """
+    telegram_id = serializers.IntegerField(source="user.telegram_id")
+    username = serializers.CharField(source="user.username")
+    first_name = serializers.CharField(source="user.first_name")
+    rank = serializers.IntegerField()
+
+    class Meta:
+        model = IncomeRollup
+        fields = ["telegram_id", "username", "first_name", "points", "rank"]
     
+def build_media_url(context, url, https=True):
+    """
+    Absolute URL of a media file; the site prefix is built once per serializer context.
+
+    Args:
+        context (dict): Serializer context holding the request.
+        url (str): Media URL from the storage, or None.
+        https (bool): Whether to force the https scheme.
+    """
+    if url is None:
+        return None
+    if not url.startswith("/"):
+        return url.replace("http://", "https://") if https else url # Already absolute (external storage)
+    key = "media_base_https" if https else "media_base"
+    if key not in context:
+        base = context["request"].build_absolute_uri("/")[:-1]
+        context[key] = base.replace("http://", "https://") if https else base
+    return context[key] + url
+
+def build_variant_urls(context, variants, https=True):
+    """
+    Absolute URLs of the image variants of a catalog entry (see images.variant_urls).
+    """
+    return {
+        fmt: {width: build_media_url(context, url, https) for width, url in urls.items()}
+        for fmt, urls in variants.items()
+    }
+
 # Serializer: Tasks
 # -----------------------------------------------------------------------------------------------
 class TasksSerializer(serializers.ModelSerializer):
@@ -123,34 +336,46 @@ class TasksSerializer(serializers.ModelSerializer):
     """
     claim = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Tasks
-        fields = ["id", "name", "description", "task_type", "points", "claim", "image", "url", "action", "is_telegram"]
+        fields = ["id", "name", "description", "task_type", "points", "claim", "image", "image_variants", "url", "action", "is_telegram"]
 
     def get_claim(self, obj):
         """
         Check if the user has already claimed this task.
         """
-        user = self.context['request'].user
-        current_time = now()
-        start_time = current_time - timedelta(hours=24)
-
-        if obj.task_type == 'daily':
-            return UserTaskClaim.objects.filter(user=user, task=obj, date_claimed__gte=start_time).exists()
-        elif obj.task_type in ["social", "partner"]:
-            return UserTaskClaim.objects.filter(user=user, task=obj).exists()
-        
-        return False
+        # Loaded once per list: the context is shared by every row
+        if "task_claims" not in self.context:
+            self.context["task_claims"] = task_claims.latest_claims(self.context['request'].user)
+            self.context["claims_checked_at"] = now()
+        return task_claims.is_claimed(obj, self.context["task_claims"], self.context["claims_checked_at"])
     
     def get_image(self, obj):
         """
         Provide the task image URL, ensuring it's served over HTTPS.
         """
-        request = self.context.get('request')
-        if obj.image:
-            return request.build_absolute_uri(obj.image.url).replace("http://", "https://")
-        return None
+        return build_media_url(self.context, catalog.image_url(obj.image))
+
+    def get_image_variants(self, obj):
+        """
+        Provide the URLs of the resized task images, by format and width.
+        """
+        return build_variant_urls(self.context, images.variant_urls(obj.image_variants))
+
+    def to_representation(self, obj):
+        """
+        Merge the user's claim state into the pre-serialized catalog entry of the task.
+        """
+        static = catalog.tasks().serialized.get(obj.pk)
+        if static is None:
+            return super().to_representation(obj) # Not a catalog instance
+        data = dict(static)
+        data["claim"] = self.get_claim(obj)
+        data["image"] = build_media_url(self.context, static["image"])
+        data["image_variants"] = build_variant_urls(self.context, static["image_variants"])
+        return {field: data[field] for field in self.Meta.fields}
     
 # Serializer: UserTaskClaim
 # -----------------------------------------------------------------------------------------------
@@ -164,48 +389,40 @@ class UserTaskClaimSerializer(serializers.Serializer):
         """
         Validate that the task ID exists.
         """
-        try:
-            task = Tasks.objects.get(id=value)
-        except Tasks.DoesNotExist:
+        task = catalog.tasks().by_id.get(value)
+        if task is None:
             raise serializers.ValidationError("Not a Valid Task ID")
         
         # Add the task in context
         self.context["task"] = task
         return value
     
-    def validate(self, attrs):
-        """
-        Ensure the task can be claimed based on its type and user's claim history.
-        """
-        user = self.context["request"].user
-        task = self.context["task"]
-        today = timezone.now().date()
-
-        if task.task_type == "daily":
-            if UserTaskClaim.objects.filter(user=user, task=task, date_claimed__date=today).exists():
-                raise serializers.ValidationError("Task already claimed today.")
-        elif task.task_type in ["social", "partner"]:
-            if UserTaskClaim.objects.filter(user=user, task=task).exists():
-                raise serializers.ValidationError(f"Task already claimed for type: {task.task_type}.")
-
-        return attrs
-    
     def save(self, **kwargs):
         """
         Save the task claim and update user's balance.
+
+        The claim is inserted first; the (user, task, period_bucket) constraint rejects a
+        second claim of the same period, even from concurrent requests, so no prior check
+        is needed.
+
+        Raises:
+            ValidationError: If the task was already claimed for the current period.
         """
         user = self.context["request"].user
         task = self.context["task"]
-        # create the UserTaskClaim
-        claim = UserTaskClaim.objects.create(
-            user=user,
-            task=task,
-            claimed=True
-        )
-
-        # update the user balance
-        user.balance += task.points
-        user.save()
+        claim = UserTaskClaim(user=user, task=task, claimed=True, period_bucket=UserTaskClaim.period_for(task))
+        try:
+            with transaction.atomic():
+                claim.save(force_insert=True)
+
+                # update the user balance
+                wallet.credit(user, task.points)
+        except IntegrityError:
+            if task.task_type == "daily":
+                message = "Task already claimed today."
+            else:
+                message = f"Task already claimed for type: {task.task_type}."
+            raise serializers.ValidationError({"non_field_errors": [message]})
         return claim
     
     def to_representation(self, obj):
@@ -213,13 +430,13 @@ class UserTaskClaimSerializer(serializers.Serializer):
         Customize the response to include detailed task information.
         """
         representation = super().to_representation(obj)
-        instance = Tasks.objects.get(id=obj.get("id"))
+        instance = self.context["task"]
         representation["name"] = instance.name
         representation["description"] = instance.description
         representation["task_type"] = instance.task_type
         representation["points"] = instance.points
         representation["claim"] = True
-        representation["image"] = self.context.get("request").build_absolute_uri('/')[:-1].replace("http://", "https://") + instance.image.url if instance.image else None
+        representation["image"] = build_media_url(self.context, catalog.image_url(instance.image))
         representation["url"] = instance.url
         representation["action"] = instance.action
         representation["is_telegram"] = instance.is_telegram
@@ -237,36 +454,23 @@ class CardsSerializer(serializers.ModelSerializer):
     status = serializers.SerializerMethodField()
     burning_points = serializers.SerializerMethodField()
     automine_points = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Cards
-        fields = ["id", "name", "number", "image", "description", "card_type", "claim", "level", "status", "burning_points", "automine_points"]
+        fields = [
+            "id", "name", "number", "image", "image_variants", "description", "card_type",
+            "claim", "level", "status", "burning_points", "automine_points",
+        ]
 
     def __init__(self, *args, **kwargs):
         """
-        Custom initialization to precompute and cache user-related data
+        Custom initialization to precompute the user's card state once
         for efficient lookup during serialization.
         """
         super().__init__(*args, **kwargs)
-        user = self.context["request"].user
-
-        # Precompute and store user claims and card levels in context
-        self.context["user_card_claims"] = {
-            claim.card_id: claim for claim in UserCardClaim.objects.filter(user=user)
-        }
-        # Precompute claimed card names and levels for quick access in conditions
-        self.context["claimed_card_names"] = {
-            claim.card.name for claim in self.context["user_card_claims"].values()
-        }
-        self.context["claimed_card_levels"] = {
-            claim.card.name: claim.card_level for claim in self.context["user_card_claims"].values()
-        }
-
-        # Fetch all necessary card details and store by (card, level) keys
-        self.context["cards_details"] = {
-            (detail.card_id, detail.level_number): detail
-            for detail in CardsDetails.objects.all()
-        }
+        if "card_state" not in self.context:
+            self.context["card_state"] = card_state.build(self.context["request"].user)
 
     def get_image(self, obj):
         """
@@ -284,6 +488,25 @@ class CardsSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.image.url).replace("http://", "https://")
         return None
 
+    def to_representation(self, obj):
+        """
+        Merge the user's claim, level and status into the pre-serialized catalog entry of the card.
+        """
+        static = catalog.cards().serialized.get(obj.pk)
+        if static is None:
+            return super().to_representation(obj) # Not a catalog instance
+        data = dict(static)
+        data["image"] = build_media_url(self.context, static["image"], https=False)
+        data["image_variants"] = build_variant_urls(self.context, static["image_variants"], https=False)
+        data.update(self.context["card_state"][obj.pk])
+        return {field: data[field] for field in self.Meta.fields}
+
+    def get_image_variants(self, obj):
+        """
+        Get the URLs of the resized card images, by format and width.
+        """
+        return build_variant_urls(self.context, images.variant_urls(obj.image_variants), https=False)
+
     def get_claim(self, obj):
         """
         Check if the user has claimed this card.
@@ -294,7 +517,7 @@ class CardsSerializer(serializers.ModelSerializer):
         Returns:
             bool: True if the card is claimed, False otherwise.
         """
-        return obj.id in self.context["user_card_claims"]
+        return self.context["card_state"][obj.id]["claim"]
 
     def get_level(self, obj):
         """
@@ -306,8 +529,7 @@ class CardsSerializer(serializers.ModelSerializer):
         Returns:
             int: Card level or 0 if unclaimed.
         """
-        card_claim = self.context["user_card_claims"].get(obj.id)
-        return card_claim.card_level if card_claim else 0
+        return self.context["card_state"][obj.id]["level"]
 
     def get_status(self, obj):
         """
@@ -319,69 +541,8 @@ class CardsSerializer(serializers.ModelSerializer):
         Returns:
             str: "claimed", "unlocked", or "locked".
         """
-        if self.get_claim(obj):
-            return "claimed"
-
-        user_level_number = self.context["request"].user.level_number
-        claimed_card_names = self.context["claimed_card_names"]
-        claimed_card_levels = self.context["claimed_card_levels"]
-
-        # Conditions for each card based on type and name
-        conditions = {
-            "eternals": {
-                "Eternal Flame": user_level_number >= 2,
-                "Infinity Stone": user_level_number >= 2,
-                "Timeless Spirit": user_level_number >= 2,
-                "Arcane Eternity": "Infinity Stone" in claimed_card_names and "Timeless Spirit" in claimed_card_names,
-                "Celestial Bond": claimed_card_levels.get("Infinity Stone", 0) >= 5,
-                "Boundless Horizon": user_level_number >= 3,
-                "Endless Resolve": claimed_card_levels.get("Arcane Eternity", 0) >= 3,
-                "Infinite Grace": "Celestial Bond" in claimed_card_names,
-                "Eon's Blessing": user_level_number >= 3,
-                "Perpetual Strength": "Eon's Blessing" in claimed_card_names,
-            },
-            "divine": {
-                "Divine Radiance": user_level_number >= 2,
-                "Heavenly Beacon": user_level_number >= 2,
-                "Seraphim's Grace": user_level_number >= 4,
-                "Ascendant Aura": user_level_number >= 4,
-                "Sanctified Chalice": (
-                    claimed_card_levels.get("Boundless Horizon", 0) >= 4 
-                    and claimed_card_levels.get("Seraphim's Grace", 0) >= 2
-                ),
-                "Celestial Crown": (
-                    claimed_card_levels.get("Celestial Bond", 0) >= 3 
-                    and claimed_card_levels.get("Heavenly Beacon", 0) >= 2
-                ),
-                "Elysian Blessing": (
-                    claimed_card_levels.get("Infinity Stone", 0) >= 5 
-                    and claimed_card_levels.get("Celestial Crown", 0) >= 2
-                ),
-                "Divine Wrath": (
-                    claimed_card_levels.get("Boundless Horizon", 0) >= 4 
-                    and claimed_card_levels.get("Seraphim's Grace", 0) >= 2
-                ),
-                "Halo of Eternity": (
-                    claimed_card_levels.get("Infinity Stone", 0) >= 5 
-                    and claimed_card_levels.get("Celestial Crown", 0) >= 2
-                ),
-                "Transcendent Light": (
-                    claimed_card_levels.get("Sanctified Chalice", 0) >= 3 
-                    and claimed_card_levels.get("Halo of Eternity", 0) >= 2
-                ),
-            },
-            "specials": {
-                "Time Warp": user_level_number >= 5,
-                "Shadow Step": (
-                    claimed_card_levels.get("Sanctified Chalice", 0) >= 3 
-                    and claimed_card_levels.get("Halo of Eternity", 0) >= 2
-                ),
-                "Elemental Burst": user_level_number >= 4,
-                "Magic Shield": user_level_number >= 6,
-                "Lucky Charm": user_level_number >= 7,
-            }
-        }
-        return "unlocked" if conditions.get(obj.card_type, {}).get(obj.name, False) else "locked"
+        # Unlock conditions are CardUnlockRule rows (see unlocks.py)
+        return self.context["card_state"][obj.id]["status"]
 
     def get_burning_points(self, obj):
         """
@@ -393,10 +554,7 @@ class CardsSerializer(serializers.ModelSerializer):
         Returns:
             int or None: Burning points for the card's current level.
         """
-        card_claim = self.context["user_card_claims"].get(obj.id)
-        level = card_claim.card_level if card_claim else 0  # Use claimed level or default to level 0
-        card_detail = self.context["cards_details"].get((obj.id, level))
-        return card_detail.burning_points if card_detail else None
+        return self.context["card_state"][obj.id]["burning_points"]
 
     def get_automine_points(self, obj):
         """
@@ -408,10 +566,7 @@ class CardsSerializer(serializers.ModelSerializer):
         Returns:
             int or None: Automine points for the card's current level.
         """
-        card_claim = self.context["user_card_claims"].get(obj.id)
-        level = card_claim.card_level if card_claim else 0  # Use claimed level or default to level 0
-        card_detail = self.context["cards_details"].get((obj.id, level))
-        return card_detail.automine_points if card_detail else None
+        return self.context["card_state"][obj.id]["automine_points"]
     
 # Serializer: UserCardClaim
 # ----------------------------------------------------------------------------------------------
@@ -419,9 +574,10 @@ class UserCardClaimSerializer(serializers.Serializer):
     """
     Serializer for creating a claim on a card by the user.
     It validates card ID, user's balance, and ensures the card is not already claimed.
+    The price is the level 0 burning_points of the card; a price sent by the client is ignored.
     """
     id = serializers.UUIDField() # Card ID
-    burning_points = serializers.IntegerField()
+    burning_points = serializers.IntegerField(required=False) # Ignored, kept for older clients
 
     def validate_id(self, value):
         """
@@ -436,9 +592,8 @@ class UserCardClaimSerializer(serializers.Serializer):
         Returns:
             UUID: Validated card ID.
         """
-        try:
-            card = Cards.objects.get(id=value)
-        except Cards.DoesNotExist:
+        card = catalog.cards().by_id.get(value)
+        if card is None:
             raise serializers.ValidationError("Not a valid Card ID.")
         self.context["card"] = card
         return value
@@ -446,9 +601,12 @@ class UserCardClaimSerializer(serializers.Serializer):
     def validate(self, attrs):
         """
         Validate user-specific conditions:
-        - Ensure the card is not already claimed by the user.
+        - Look the price up in the level curve.
         - Verify the user has sufficient balance.
 
+        Whether the card is already claimed is left to the (user, card) unique constraint
+        in `save`.
+
         Args:
             attrs (dict): Validated data from the request.
 
@@ -457,11 +615,13 @@ class UserCardClaimSerializer(serializers.Serializer):
         """
         user = self.context["request"].user
         card = self.context["card"]
-        burning_points = attrs.get("burning_points")
-        if UserCardClaim.objects.filter(user=user, card=card).exists():
-            raise serializers.ValidationError("Already Claimed.")
-        if user.balance < burning_points:
+        points = card_state.level_points(card.id, 0)
+        if points is None:
+            raise serializers.ValidationError("This card cannot be claimed yet.")
+        wallet.settle_pending(user)
+        if user.balance < points[0]:
             raise serializers.ValidationError("Insufficients Funds.")
+        self.context["points"] = points
         return attrs
     
     def save(self, **kwargs):
@@ -471,21 +631,27 @@ class UserCardClaimSerializer(serializers.Serializer):
         Args:
             **kwargs: Additional arguments for the save method.
 
+        Raises:
+            ValidationError: If the card is already claimed or the balance does not cover it.
+
         Returns:
             UserCardClaim: Newly created claim instance.
         """
         user = self.context["request"].user
         card = self.context["card"]
-        burning_points = self.validated_data["burning_points"]
-        # create UserCardClaim instance
-        claim = UserCardClaim.objects.create(
-            user=user,
-            card=card,
-            claimed=True
-        )
-        # update the user balance
-        user.balance -= burning_points
-        user.save()
+        burning_points, automine_points = self.context["points"]
+        claim = UserCardClaim(user=user, card=card, claimed=True)
+        try:
+            with transaction.atomic():
+                # create UserCardClaim instance
+                claim.save(force_insert=True)
+                # pay the automine income so far, then update the user balance and income rate
+                automine.settle(user)
+                wallet.debit(user, burning_points, **automine.rate_change(user, automine_points))
+        except IntegrityError:
+            raise serializers.ValidationError({"non_field_errors": ["Already Claimed."]})
+        except wallet.InsufficientFunds:
+            raise serializers.ValidationError({"non_field_errors": ["Insufficients Funds."]})
         self.context["claim"] = claim
         return claim
     
@@ -501,17 +667,17 @@ class UserCardClaimSerializer(serializers.Serializer):
         """
         representation = super().to_representation(instance)
         claim = self.context["claim"]
-        card = CardsDetails.objects.get(card=claim.card, level_number=claim.card_level)
+        burning_points, automine_points = self.context["points"]
         representation["name"] = claim.card.name
         representation["number"] = claim.card.number
         representation["card_type"] = claim.card.card_type
-        representation["image"] = self.context.get("request").build_absolute_uri('/')[:-1].replace("http://", "https://") + claim.card.image.url if claim.card.image else None
+        representation["image"] = build_media_url(self.context, catalog.image_url(claim.card.image))
         representation["description"] = claim.card.description
         representation["claim"] = True
         representation["level"] = claim.card_level
         representation["status"] = "claimed"
-        representation["burning_points"] = card.burning_points
-        representation["automine_points"] = card.automine_points
+        representation["burning_points"] = burning_points
+        representation["automine_points"] = automine_points
         return representation
 
 # Serializer: UpdateUserCardLevel
@@ -520,9 +686,10 @@ class UpdateUserCardLevelSerializer(serializers.Serializer):
     """
     Serializer for updating a claimed card's level for a user.
     Validates user balance and card eligibility before updating.
+    The price is the burning_points of the next level; a price sent by the client is ignored.
     """
     id = serializers.UUIDField()
-    points = serializers.IntegerField()
+    points = serializers.IntegerField(required=False) # Ignored, kept for older clients
 
     def get_card_details(self, value):
         """
@@ -537,14 +704,15 @@ class UpdateUserCardLevelSerializer(serializers.Serializer):
         Returns:
             UserCardClaim: User's claimed card details.
         """
+        user = self.context["request"].user
+        card = catalog.cards().by_id.get(value)
+        if card is None:
+            raise serializers.ValidationError("Invalid Card ID.")
         try:
-            user = self.context["request"].user
-            card = Cards.objects.get(id=value)
             card_details = UserCardClaim.objects.get(user=user, card=card)
-        except Cards.DoesNotExist:
-            raise serializers.ValidationError("Invalid Card ID.")
         except UserCardClaim.DoesNotExist:
             raise serializers.ValidationError("You haven't claimed this card yet.")
+        card_details.card = card # Reuse the catalog instance instead of loading it again
         return card_details
 
     def validate(self, attrs):
@@ -559,15 +727,17 @@ class UpdateUserCardLevelSerializer(serializers.Serializer):
         """
         user = self.context["request"].user
         card_details = self.get_card_details(attrs.get("id"))
-        points = attrs.get("points")
+        points = card_state.level_points(card_details.card_id, card_details.card_level + 1)
 
-        if user.balance < points:
-            raise serializers.ValidationError("Insufficient funds to claim this card.")
-
-        if card_details.card_level >= 11:
+        if card_details.card_level >= card_state.MAX_LEVEL or points is None:
             raise serializers.ValidationError("Card level has already reached the maximum limit.")
+
+        wallet.settle_pending(user)
+        if user.balance < points[0]:
+            raise serializers.ValidationError("Insufficient funds to claim this card.")
         
         self.context["card_details"] = card_details
+        self.context["points"] = points
         return attrs
 
     def create(self, validated_data):
@@ -582,15 +752,25 @@ class UpdateUserCardLevelSerializer(serializers.Serializer):
         """
         user = self.context["request"].user
         card_details = self.context["card_details"]
-        points = validated_data.get("points")
-
-        # Update the card level (increment by 1)
-        card_details.card_level += 1
-        card_details.save()
+        burning_points, automine_points = self.context["points"]
+        level = card_details.card_level
+        current = card_state.level_points(card_details.card_id, level)
+        rate_delta = automine_points - (current[1] if current else 0)
 
-        # Subtract points from user's balance
-        user.balance -= points
-        user.save()
+        try:
+            with transaction.atomic():
+                # Pay the automine income so far, then subtract points from user's balance
+                # and move the income rate to the new level
+                automine.settle(user)
+                wallet.debit(user, burning_points, **automine.rate_change(user, rate_delta))
+
+                # Update the card level (increment by 1) if no other request upgraded it meanwhile
+                upgraded = UserCardClaim.objects.filter(pk=card_details.pk, card_level=level).update(card_level=level + 1)
+                if not upgraded:
+                    raise serializers.ValidationError({"non_field_errors": ["Card level has changed, please try again."]})
+        except wallet.InsufficientFunds:
+            raise serializers.ValidationError({"non_field_errors": ["Insufficient funds to claim this card."]})
+        card_details.card_level = level + 1
         return validated_data
     
     def to_representation(self, instance):
@@ -605,19 +785,147 @@ class UpdateUserCardLevelSerializer(serializers.Serializer):
         """
         representation = super().to_representation(instance)
         card = self.context["card_details"]
-        card_details = CardsDetails.objects.get(card=card.card, level_number=card.card_level)
+        burning_points, automine_points = self.context["points"]
+        representation["points"] = burning_points # The price that was charged
         representation["name"] = card.card.name
         representation["number"] = card.card.number
         representation["card_type"] = card.card.card_type
-        representation["image"] = self.context.get("request").build_absolute_uri('/')[:-1].replace("http://", "https://") + card.card.image.url if card.card.image else None
+        representation["image"] = build_media_url(self.context, catalog.image_url(card.card.image))
         representation["description"] = card.card.description
         representation["claim"] = True
         representation["level"] = card.card_level
         representation["status"] = "claimed"
-        representation["burning_points"] = card_details.burning_points
-        representation["automine_points"] = card_details.automine_points
+        representation["burning_points"] = burning_points
+        representation["automine_points"] = automine_points
         return representation
     
+# Serializer: CardPurchase
+# ----------------------------------------------------------------------------------------------
+class CardPurchaseSerializer(serializers.Serializer):
+    """
+    One card of a bulk purchase.
+
+    Fields:
+        - id: Card ID.
+        - levels: Number of purchases for the card; the claim of an unclaimed card counts as one.
+    """
+    id = serializers.UUIDField()
+    levels = serializers.IntegerField(min_value=1, default=1)
+
+# Serializer: BulkCardPurchase
+# ----------------------------------------------------------------------------------------------
+class BulkCardPurchaseSerializer(serializers.Serializer):
+    """
+    Serializer for claiming and upgrading several cards, several levels each, at once.
+
+    Prices come from the cached level curve: a claim costs the level 0 burning_points and
+    each upgrade the burning_points of the level it reaches. The whole batch is one
+    transaction: an insert of the new claims, one UPDATE for all upgraded levels and a
+    single debit of the combined cost.
+    """
+    MAX_CARDS = 50
+
+    cards = CardPurchaseSerializer(many=True, allow_empty=False, max_length=MAX_CARDS, write_only=True)
+
+    def validate(self, attrs):
+        """
+        Price every purchase against the user's current card levels and check the balance once.
+        """
+        user = self.context["request"].user
+        requested = {}
+        for item in attrs["cards"]:
+            requested[item["id"]] = requested.get(item["id"], 0) + item["levels"] # Repeated cards add up
+        cards = catalog.cards().by_id
+        unknown = [str(card_id) for card_id in requested if card_id not in cards]
+        if unknown:
+            raise serializers.ValidationError(f"Not a valid Card ID: {', '.join(unknown)}.")
+
+        claims = {claim.card_id: claim for claim in UserCardClaim.objects.filter(user=user, card_id__in=requested)}
+        purchases, total, rate_delta = [], 0, 0
+        for card_id, count in requested.items():
+            claim = claims.get(card_id)
+            start = claim.card_level if claim else None
+            target = (start if claim else -1) + count
+            if target > card_state.MAX_LEVEL:
+                raise serializers.ValidationError(f"{cards[card_id].name}: card level would exceed the maximum limit.")
+            for level in range(target - count + 1, target + 1):
+                points = card_state.level_points(card_id, level)
+                if points is None:
+                    raise serializers.ValidationError(f"{cards[card_id].name}: level {level} is not available.")
+                total += points[0]
+            current = card_state.level_points(card_id, start) if claim else None
+            rate_delta += card_state.level_points(card_id, target)[1] - (current[1] if current else 0)
+            purchases.append((cards[card_id], claim, start, target))
+
+        wallet.settle_pending(user)
+        if user.balance < total:
+            raise serializers.ValidationError("Insufficient funds for these cards.")
+        self.context["purchases"] = purchases
+        self.context["total"] = total
+        self.context["rate_delta"] = rate_delta
+        return attrs
+
+    def save(self, **kwargs):
+        """
+        Apply every claim and upgrade and debit the combined cost in one transaction.
+
+        Raises:
+            ValidationError: If a card was claimed or upgraded concurrently, or the balance no
+                longer covers the cost; nothing is applied then.
+        """
+        user = self.context["request"].user
+        purchases = self.context["purchases"]
+        new_claims = [
+            UserCardClaim(user=user, card=card, card_level=target, claimed=True)
+            for card, claim, _, target in purchases if claim is None
+        ]
+        upgrades = [(claim, start, target) for _, claim, start, target in purchases if claim is not None]
+        try:
+            with transaction.atomic():
+                if new_claims:
+                    UserCardClaim.objects.bulk_create(new_claims)
+                if upgrades:
+                    # Each row moves only from the level it was priced at
+                    unchanged = Q()
+                    for claim, start, _ in upgrades:
+                        unchanged |= Q(pk=claim.pk, card_level=start)
+                    updated = UserCardClaim.objects.filter(unchanged).update(card_level=Case(
+                        *(When(pk=claim.pk, then=Value(target)) for claim, _, target in upgrades)
+                    ))
+                    if updated != len(upgrades):
+                        raise serializers.ValidationError({"non_field_errors": ["Card levels have changed, please try again."]})
+                automine.settle(user)
+                wallet.debit(user, self.context["total"], **automine.rate_change(user, self.context["rate_delta"]))
+        except IntegrityError:
+            raise serializers.ValidationError({"non_field_errors": ["Already Claimed."]})
+        except wallet.InsufficientFunds:
+            raise serializers.ValidationError({"non_field_errors": ["Insufficient funds for these cards."]})
+        self.instance = user
+        return user
+
+    def to_representation(self, instance):
+        """
+        Return the balance, the automine rate and the new state of every purchased card.
+        """
+        cards = []
+        for card, _, _, target in self.context.get("purchases", []):
+            burning_points, automine_points = card_state.level_points(card.id, target)
+            data = dict(catalog.cards().serialized[card.id])
+            data["image"] = build_media_url(self.context, data["image"], https=False)
+            data["image_variants"] = build_variant_urls(self.context, data["image_variants"], https=False)
+            data.update(
+                claim=True, level=target, status="claimed",
+                burning_points=burning_points, automine_points=automine_points,
+            )
+            cards.append(data)
+        return {
+            "balance": instance.balance,
+            "level_number": instance.level_number,
+            "level_name": instance.level_name,
+            "automine_rate_per_hour": instance.automine_rate_per_hour,
+            "cards": cards,
+        }
+
 # Serializer: CardDetails
 # ----------------------------------------------------------------------------------------------
 class CardDetailsSerializer(serializers.ModelSerializer):
@@ -709,7 +1017,7 @@ class ClaimRewardSerializer(serializers.ModelSerializer):
         If the current reward day exists, it returns the corresponding points; 
         otherwise, it returns None.
         """
-        current_reward = DailyReward.objects.filter(day=obj.current_day).first()
+        current_reward = catalog.daily_rewards().by_day.get(obj.current_day)
         return current_reward.points if current_reward else None
 
     def validate(self, attrs):
@@ -736,16 +1044,15 @@ class ClaimRewardSerializer(serializers.ModelSerializer):
         user_reward = self.instance
 
         # Fetch the current reward points
-        current_reward = DailyReward.objects.filter(day=user_reward.current_day).first()
+        current_reward = catalog.daily_rewards().by_day.get(user_reward.current_day)
         if not current_reward:
             raise serializers.ValidationError("Invalid reward configuration.")
 
-        # Update the user's reward progress
-        user_reward.update_reward()
+        with transaction.atomic():
+            # Update the user's reward progress
+            user_reward.update_reward()
 
-        # Update user's balance or points (assuming a `balance` or similar field on User model)
-        user = user_reward.user
-        user.balance += current_reward.points
-        user.save()
+            # Update user's balance or points (assuming a `balance` or similar field on User model)
+            wallet.credit(user_reward.user, current_reward.points)
 
         return user_reward
\ No newline at end of file
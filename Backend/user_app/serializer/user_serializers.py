@@ -1,4 +1,6 @@
-from user_app.models import User, UserCardClaim, CardsDetails
+from django.db import transaction
+from user_app import catalog, downline, energy
+from user_app.models import User, UserCardClaim
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 
@@ -56,13 +58,16 @@ class LoginSerializer(serializers.Serializer):
         first_name = validated_data.get("first_name", "") # Use empty string if first name is not provided
 
         # Create a new user with the provided data
-        user = User.objects.create(
-            telegram_id=validated_data["telegram_id"],
-            username=username,
-            first_name=first_name,
-            reffer_id=validated_data["telegram_id"], # The user’s own ID is used as reffered_by during creation
-            reffered_by=reffered_by, # Assign the referring user’s ID, if available
-        )
+        with transaction.atomic():
+            user = User.objects.create(
+                telegram_id=validated_data["telegram_id"],
+                username=username,
+                first_name=first_name,
+                reffer_id=validated_data["telegram_id"], # The user’s own ID is used as reffered_by during creation
+                reffered_by=reffered_by, # Assign the referring user’s ID, if available
+            )
+            if reffered_by:
+                downline.link(user) # Add the user to their referrer's downline tiers
         self.context["user"] = user # Store the newly created user in the context
         return user
     
@@ -94,7 +99,7 @@ class UserCardDetailsSerializer(serializers.ModelSerializer):
             int: The automine points for the card at the given level.
         """
         # Try to get the CardsDetails entry for the card and level
-        card_details = CardsDetails.objects.filter(card=obj.card, level_number=obj.card_level).first()
+        card_details = catalog.cards_details().by_key.get((obj.card_id, obj.card_level))
         
         # If no matching CardsDetails found, return None
         if card_details is None:
@@ -113,9 +118,26 @@ class UserDetailsSerializer(serializers.ModelSerializer):
         user_cards (list): A list of user card details.
     """
     user_cards = UserCardDetailsSerializer(many=True) # Nested serializer for user cards
+    energy = serializers.SerializerMethodField() # Energy computed lazily from the last stored value
+    automine_earned = serializers.SerializerMethodField() # Offline card income credited by this request
     class Meta:
         model = User
-        fields = ["balance", "level_number", "level_name", "welcome_bonus", "multitap_level", "recharging_speed_level", "autobot_status", "user_cards", "user_religion"]
+        fields = [
+            "balance", "level_number", "level_name", "welcome_bonus", "multitap_level", "recharging_speed_level",
+            "autobot_status", "user_cards", "user_religion", "energy", "automine_rate_per_hour", "automine_earned",
+        ]
+
+    def get_energy(self, obj):
+        """
+        Get the user's current energy, or None when the level has no energy limit.
+        """
+        return energy.available_energy(obj)
+
+    def get_automine_earned(self, obj):
+        """
+        Get the automine income the view credited before serializing, if any.
+        """
+        return self.context.get("automine_earned", 0)
 
 # Serializer: WelcomeBonus
 # -----------------------------------------------------------------------------------
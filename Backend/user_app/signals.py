@@ -1,25 +1,17 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from .models import User, RefferReward, Earnings
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from .models import (
+    User, Earnings, PendingReferralReward, Rules, UserTaskClaim,
+    Tasks, Cards, CardsDetails, CardUnlockRule, DailyReward, RefferReward,
+)
+from . import catalog, images, levels, task_claims, unlocks, wallet
 
 @receiver(post_save, sender=User)
 def handle_rewards(sender, instance, created, **kwargs):
     if created and instance.reffered_by:
-        # Process referral reward if the user was referred by another user
-        try:
-            refferer = User.objects.get(telegram_id=instance.reffered_by)
-
-            # Apply the reward based on the user level
-            try:
-                reward = RefferReward.objects.get(level_number=refferer.level_number).reward_amount
-                refferer.reffered_points += reward
-                refferer.balance += reward
-                refferer.save()
-            except RefferReward.DoesNotExist:
-                pass  # Handle case where reward does not exist for that level
-
-        except User.DoesNotExist:
-            pass  # Handle case where refferer is not found
+        # Queue the referral reward; the referral worker applies it (see referrals.py)
+        PendingReferralReward.objects.create(referee=instance, refferer_telegram_id=instance.reffered_by)
 
 @receiver(post_save, sender=Earnings)
 def update_user_balance(sender, instance, created, **kwargs):
@@ -27,35 +19,90 @@ def update_user_balance(sender, instance, created, **kwargs):
     if created:
         # get the user
         user = instance.user
-        # check the transaction type
+        # check the transaction type; each branch is a single conditional UPDATE and
+        # wallet.InsufficientFunds propagates so the caller can roll the earning back
         match instance.transaction_type:
             case "CREDIT":
-                user.balance += instance.amount
+                wallet.credit(user, instance.amount)
             case "DEBIT":
                 if instance.reason == "Mutitap Increase" and user.multitap_level <= 12:
-                    user.balance -= instance.amount
-                    user.multitap_level += 1
+                    wallet.debit(user, instance.amount, conditions={"multitap_level__lte": 12}, multitap_level=F("multitap_level") + 1)
                 elif instance.reason == "Recharging Speed Increase" and user.recharging_speed_level <= 12:
-                    user.balance -= instance.amount
-                    user.recharging_speed_level += 1
+                    wallet.debit(user, instance.amount, conditions={"recharging_speed_level__lte": 12}, recharging_speed_level=F("recharging_speed_level") + 1)
                 elif instance.reason == "Auto Pray" and not user.autobot_status:
-                    user.balance -= instance.amount
-                    user.autobot_status = True
-        # Save the user details
-        user.save()
-        # Update the user level
-        user.update_user_level()
+                    wallet.debit(user, instance.amount, conditions={"autobot_status": False}, autobot_status=True)
 
 @receiver(post_save, sender=User)
-def update_user_level(sender, instance, **kwargs):
+def update_user_level(sender, instance, created, **kwargs):
     """
     Signal handler to update user level after user save.
+    Only runs when the user was created or its balance actually changed.
     """
     update_fields = kwargs.get('update_fields', None)
 
     # If update_fields is specified and includes 'level_number', skip the signal logic
     if update_fields and 'level_number' in update_fields:
         return
-    
-    if instance.update_user_level():
-        instance.save(update_fields=['level_name', 'level_number'])
\ No newline at end of file
+
+    if created or instance.balance_changed():
+        instance.update_user_level()
+
+@receiver(post_save, sender=Rules)
+@receiver(post_delete, sender=Rules)
+def invalidate_rules_cache(sender, **kwargs):
+    """
+    Drop the cached Rules whenever a level definition changes.
+    """
+    levels.invalidate()
+
+@receiver(post_save, sender=UserTaskClaim)
+@receiver(post_delete, sender=UserTaskClaim)
+def invalidate_task_claims_cache(sender, instance, **kwargs):
+    """
+    Drop the user's cached task claims whenever one of their claims changes.
+    """
+    task_claims.invalidate(instance.user_id)
+
+@receiver(post_save, sender=Tasks)
+@receiver(post_save, sender=Cards)
+def build_image_variants(sender, instance, **kwargs):
+    """
+    Build the resized copies of a new or replaced image. Registered before the catalog
+    handlers below, so the reloaded catalog sees the variants.
+    """
+    if images.needs_variants(instance):
+        images.update_variants(instance)
+
+@receiver(post_save, sender=Tasks)
+@receiver(post_delete, sender=Tasks)
+def invalidate_tasks_catalog(sender, **kwargs):
+    catalog.TASKS.invalidate()
+
+@receiver(post_save, sender=Cards)
+@receiver(post_delete, sender=Cards)
+def invalidate_cards_catalog(sender, **kwargs):
+    """
+    Card details hold their card, so both catalogs are reloaded.
+    """
+    catalog.CARDS.invalidate()
+    catalog.CARDS_DETAILS.invalidate()
+
+@receiver(post_save, sender=CardsDetails)
+@receiver(post_delete, sender=CardsDetails)
+def invalidate_cards_details_catalog(sender, **kwargs):
+    catalog.CARDS_DETAILS.invalidate()
+
+@receiver(post_save, sender=CardUnlockRule)
+@receiver(post_delete, sender=CardUnlockRule)
+def invalidate_card_unlocks(sender, **kwargs):
+    unlocks.invalidate()
+
+@receiver(post_save, sender=DailyReward)
+@receiver(post_delete, sender=DailyReward)
+def invalidate_daily_rewards_catalog(sender, **kwargs):
+    catalog.DAILY_REWARDS.invalidate()
+
+@receiver(post_save, sender=RefferReward)
+@receiver(post_delete, sender=RefferReward)
+def invalidate_reffer_rewards_catalog(sender, **kwargs):
+    catalog.REFFER_REWARDS.invalidate()
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from user_app.models import UserTaskClaim
+
+# Task Claims
+# -----------------------------------------------------------------------------------------
+# The tasks list needs the claim state of every task for one user. `latest_claims` loads the
+# user's most recent claim per task with one grouped query and caches it; the state of each
+# task is then computed in memory (daily tasks look at the current day, social and partner
+# tasks at any claim). Claims invalidate the cache through signals.
+
+def cache_key(user_id):
+    return f"user_app:task_claims:{user_id}"
+
+def latest_claims(user):
+    """
+    Time of the user's most recent claim of each task.
+
+    Returns:
+        dict: Task id (str) -> datetime of the last claim.
+    """
+    key = cache_key(user.pk)
+    claims = cache.get(key)
+    if claims is None:
+        rows = UserTaskClaim.objects.filter(user=user).values("task_id").annotate(last=Max("date_claimed"))
+        claims = {str(row["task_id"]): row["last"] for row in rows}
+        cache.set(key, claims, settings.TASK_CLAIMS_CACHE_SECONDS)
+    return claims
+
+def is_claimed(task, claims, at=None):
+    """
+    Whether a task counts as claimed, given the user's `latest_claims`.
+    """
+    last = claims.get(str(task.id))
+    if last is None:
+        return False
+    if task.task_type == "daily":
+        return UserTaskClaim.period_for(task, last) == UserTaskClaim.period_for(task, at)
+    return task.task_type in ["social", "partner"]
+
+def invalidate(user_id):
+    cache.delete(cache_key(user_id))
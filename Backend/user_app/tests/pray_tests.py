@@ -1,11 +1,27 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
 from uuid import uuid4
 from rest_framework.test import APITestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
 from rest_framework import status
 from django.urls import reverse
 from unittest import mock
 from django.utils import timezone
+from datetime import timedelta
+from PIL import Image
+from user_app.serializer import pray_serializers
+from user_app import catalog, downline, images, levels, rank_engine, ranking, referrals, rollups, unlocks, wallet
 from user_app.models import (
-    Rules, User, Tasks, UserTaskClaim, Cards, CardsDetails, UserCardClaim
+    Rules, User, Tasks, UserTaskClaim, Cards, CardsDetails, CardUnlockRule, UserCardClaim, LeaderboardSnapshot, IncomeRollup,
+    DownlineStats, ReferralClosure
 )
 
 # Test: UpdateBalance
@@ -111,6 +127,28 @@ class UpdateBalanceAPITest(APITestCase):
         # Check if the response status is 401 Unauthorized
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_parallel_update_spends_energy_once(self):
+        """
+        Ensure a request whose energy was already spent by a parallel one credits nothing.
+        """
+        self.user.energy = 5
+        self.user.energy_updated_at = timezone.now()
+        self.user.save()
+        first = User.objects.get(pk=self.user.pk)
+        second = User.objects.get(pk=self.user.pk) # Loaded before the first request writes
+
+        serializer = pray_serializers.UpdateBalanceSerializer(first, data={"amount": 150}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        credited = User.objects.get(pk=self.user.pk).balance
+        self.assertGreater(credited, 100)
+
+        serializer = pray_serializers.UpdateBalanceSerializer(second, data={"amount": 150}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, credited)
+        self.assertEqual(serializer.data["balance"], credited)
+
     def test_update_balance_invalid_data(self):
         """
         Ensure that the API handles invalid data gracefully.
@@ -149,6 +187,362 @@ class UpdateBalanceAPITest(APITestCase):
             # Ensure that level update was called during balance update
             mock_update_level.assert_called_once()
 
+# Test: LevelIndex
+# ------------------------------------------------------------------------------------------------------------------------
+class LevelIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Create two levels with a gap between them.
+        """
+        Rules.objects.create(
+            level_number=1, level_name="Seeker of Truth", lower_points=0, higher_points=100,
+            per_tap=1, point_refill=1, number_of_tap=100
+        )
+        cls.rule_level_2 = Rules.objects.create(
+            level_number=2, level_name="Knowledge Seeker", lower_points=200, higher_points=300,
+            per_tap=2, point_refill=2, number_of_tap=200
+        )
+
+    def setUp(self):
+        """
+        Start every test from an empty index.
+        """
+        levels.invalidate()
+
+    def test_resolve_level_boundaries(self):
+        """
+        Ensure balances resolve to the level whose range contains them, inclusive.
+        """
+        self.assertEqual(levels.resolve_level(0).level_number, 1)
+        self.assertEqual(levels.resolve_level(100).level_number, 1)
+        self.assertIsNone(levels.resolve_level(150))
+        self.assertEqual(levels.resolve_level(200).level_number, 2)
+        self.assertIsNone(levels.resolve_level(301))
+
+    def test_resolve_level_without_queries(self):
+        """
+        Ensure the index is loaded once and then resolves levels from memory.
+        """
+        levels.resolve_level(0)
+        with self.assertNumQueries(0):
+            levels.resolve_level(250)
+
+    def test_rules_change_invalidates_index(self):
+        """
+        Ensure saving a Rules row is picked up by the next lookup.
+        """
+        self.assertIsNone(levels.resolve_level(400))
+        self.rule_level_2.higher_points = 500
+        self.rule_level_2.save()
+        self.assertEqual(levels.resolve_level(400).level_number, 2)
+
+# Test: Catalog
+# ------------------------------------------------------------------------------------------------------------------------
+class CatalogTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Create a card with two levels.
+        """
+        cls.card = Cards.objects.create(name="Card", number=1, description="A card", card_type="eternals")
+        for level in (0, 1):
+            CardsDetails.objects.create(card=cls.card, level_number=level, burning_points=10 * (level + 1), automine_points=level)
+
+    def setUp(self):
+        """
+        Start every test from empty catalogs.
+        """
+        catalog.CARDS.invalidate()
+        catalog.CARDS_DETAILS.invalidate()
+
+    def test_lookups_without_queries(self):
+        """
+        Ensure catalogs are loaded once and then served from memory.
+        """
+        catalog.cards()
+        catalog.cards_details()
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.cards().by_id[self.card.id].name, "Card")
+            self.assertEqual(catalog.cards().serialized[self.card.id]["id"], str(self.card.id))
+            self.assertEqual(catalog.cards_details().by_key[(self.card.id, 1)].burning_points, 20)
+            self.assertEqual(len(catalog.cards_details().by_card[self.card.id]), 2)
+
+    def test_save_invalidates_catalog(self):
+        """
+        Ensure saving a card or a card level is picked up by the next lookup.
+        """
+        catalog.cards_details()
+        detail = CardsDetails.objects.get(card=self.card, level_number=1)
+        detail.burning_points = 99
+        detail.save()
+        self.assertEqual(catalog.cards_details().by_key[(self.card.id, 1)].burning_points, 99)
+
+        self.card.name = "Renamed"
+        self.card.save()
+        self.assertEqual(catalog.cards().by_id[self.card.id].name, "Renamed")
+        self.assertEqual(catalog.cards_details().by_key[(self.card.id, 0)].card.name, "Renamed")
+
+    @override_settings(CATALOG_CHECK_SECONDS=0)
+    def test_version_change_reloads_catalog(self):
+        """
+        Ensure a version bumped by another worker makes this one reload.
+        """
+        catalog.cards()
+        Cards.objects.filter(pk=self.card.pk).update(name="Elsewhere") # No signal, like another worker's write
+        self.assertEqual(catalog.cards().by_id[self.card.id].name, "Card")
+
+        cache.set(catalog.CARDS.version_key, "bumped", None)
+        self.assertEqual(catalog.cards().by_id[self.card.id].name, "Elsewhere")
+
+    @override_settings(CATALOG_CHECK_SECONDS=0, CATALOG_MAX_AGE_SECONDS=30)
+    def test_max_age_reloads_catalog(self):
+        """
+        Ensure a catalog is reloaded once it is too old, even if no version stamp arrived.
+        """
+        catalog.cards()
+        Cards.objects.filter(pk=self.card.pk).update(name="Elsewhere") # Another worker's write, stamp not shared
+        self.assertEqual(catalog.cards().by_id[self.card.id].name, "Card")
+
+        with mock.patch("user_app.catalog.time.monotonic", return_value=time.monotonic() + 31):
+            self.assertEqual(catalog.cards().by_id[self.card.id].name, "Elsewhere")
+
+    def test_version_bumped_after_commit(self):
+        """
+        Ensure other workers are told to reload only once the edit is committed, and that a
+        copy reloaded before the commit is dropped.
+        """
+        catalog.cards_details()
+        version = cache.get(catalog.CARDS_DETAILS.version_key)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                CardsDetails.objects.filter(card=self.card, level_number=1).update(burning_points=77)
+                catalog.CARDS_DETAILS.invalidate()
+                catalog.cards_details() # Reloaded before the commit
+                self.assertEqual(cache.get(catalog.CARDS_DETAILS.version_key), version)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(cache.get(catalog.CARDS_DETAILS.version_key), version)
+        self.assertIsNone(catalog.CARDS_DETAILS._entry)
+
+# Test: ImageVariants
+# ------------------------------------------------------------------------------------------------------------------------
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        """
+        Store uploads in a temporary media root.
+        """
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root, IMAGE_VARIANT_WIDTHS=[64, 128, 1024])
+        media.enable()
+        self.addCleanup(media.disable)
+        catalog.CARDS.invalidate()
+
+    def upload(self, name="card.png", size=(400, 200)):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_variants_built_on_upload(self):
+        """
+        Ensure resized, content-hashed WebP copies are written when an image is saved.
+        """
+        card = Cards.objects.create(name="Card", card_type="eternals", image=self.upload())
+        card.refresh_from_db()
+
+        self.assertEqual(card.image_variants["source"], card.image.name)
+        self.assertEqual(set(card.image_variants["webp"]), {"64", "128", "400"})  # Never wider than the original
+        name = card.image_variants["webp"]["64"]
+        self.assertRegex(name, r"^cards/variants/card-64\.[0-9a-f]{12}\.webp$")
+        with Image.open(os.path.join(self.media_root, name)) as variant:
+            self.assertEqual((variant.format, variant.size), ("WEBP", (64, 32)))
+
+        card.name = "Renamed"
+        card.save()
+        card.refresh_from_db()
+        self.assertEqual(card.image_variants["webp"]["64"], name)  # Same image, same files
+
+    @override_settings(MEDIA_BASE_URL="https://cdn.example.com/media/")
+    def test_catalog_urls_from_media_base(self):
+        """
+        Ensure catalog entries carry URLs built from MEDIA_BASE_URL.
+        """
+        card = Cards.objects.create(name="Card", card_type="eternals", image=self.upload())
+        entry = catalog.cards().serialized[card.id]
+
+        self.assertTrue(entry["image"].startswith("https://cdn.example.com/media/cards/card"))
+        self.assertTrue(entry["image_variants"]["webp"]["128"].startswith("https://cdn.example.com/media/cards/variants/"))
+
+    def test_variants_served_immutable(self):
+        """
+        Ensure hashed variants are served with an immutable Cache-Control header.
+        """
+        card = Cards.objects.create(name="Card", card_type="eternals", image=self.upload())
+        card.refresh_from_db()
+        request = RequestFactory().get("/media/")
+
+        response = images.serve(request, card.image_variants["webp"]["64"], document_root=self.media_root)
+        self.assertEqual(response["Cache-Control"], images.IMMUTABLE)
+        response = images.serve(request, card.image.name, document_root=self.media_root)
+        self.assertNotIn("Cache-Control", response)
+
+# Test: TapBatch
+# ------------------------------------------------------------------------------------------------------------------------
+class TapBatchAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up a user and the level rule that defines the points per tap.
+        """
+        cls.user = User.objects.create_user(
+            telegram_id=123456789,
+            username="testuser",
+            first_name="Test",
+            balance=100
+        )
+        Rules.objects.create(
+            level_number=1,
+            level_name="Seeker of Truth",
+            lower_points=0,
+            higher_points=10000,
+            per_tap=2,
+            point_refill=0,
+            number_of_tap=500
+        )
+        cls.url = reverse("tap-batch")
+
+    def setUp(self):
+        """
+        Authenticate the user before each test.
+        """
+        self.client.force_authenticate(user=self.user)
+
+    def make_event(self, seq, count, seconds=5, ago=0):
+        """
+        Build a tap event ending `ago` seconds before now and spanning the given number of seconds.
+        """
+        ended_at = timezone.now() - timedelta(seconds=ago)
+        return {
+            "seq": seq,
+            "count": count,
+            "started_at": (ended_at - timedelta(seconds=seconds)).isoformat(),
+            "ended_at": ended_at.isoformat(),
+        }
+
+    def test_tap_batch_success(self):
+        """
+        Ensure all events in the batch are credited in one flush.
+        """
+        data = {"events": [self.make_event(1, 10, ago=10), self.make_event(2, 15)]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 150)  # 100 + 25 taps * 2 points
+        self.assertEqual(self.user.last_tap_seq, 2)
+        self.assertEqual(response.data["balance"], 150)
+        self.assertEqual(response.data["accepted_taps"], 25)
+
+    def test_tap_batch_retry_is_idempotent(self):
+        """
+        Ensure replaying an already applied flush does not credit the taps twice.
+        """
+        data = {"events": [self.make_event(1, 10)]}
+        self.client.post(self.url, data, format="json")
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["accepted_taps"], 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 120)
+
+    def test_tap_batch_limited_by_energy(self):
+        """
+        Ensure taps beyond the user's remaining energy are not credited.
+        """
+        self.user.energy = 5
+        self.user.energy_updated_at = timezone.now()
+        self.user.save()
+
+        data = {"events": [self.make_event(1, 10)]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["accepted_taps"], 5)
+        self.assertEqual(response.data["energy"], 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 110)  # 100 + 5 taps * 2 points
+
+    def test_tap_batch_unordered_sequence(self):
+        """
+        Ensure a batch with non increasing sequence numbers is rejected.
+        """
+        data = {"events": [self.make_event(2, 10), self.make_event(1, 10)]}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tap_batch_too_many_taps(self):
+        """
+        Ensure a tap count that is impossible for the window is rejected.
+        """
+        data = {"events": [self.make_event(1, 10000, seconds=1)]}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tap_batch_overlapping_windows(self):
+        """
+        Ensure windows overlapping each other in a batch are rejected.
+        """
+        data = {"events": [self.make_event(1, 10), self.make_event(2, 10)]}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Tap windows must not overlap.", response.data["events"])
+
+    def test_tap_batch_overlaps_earlier_flush(self):
+        """
+        Ensure a window reusing time already credited by an earlier flush is rejected.
+        """
+        self.client.post(self.url, {"events": [self.make_event(1, 10)]}, format="json")
+        response = self.client.post(self.url, {"events": [self.make_event(2, 10)]}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 120)
+
+    def test_tap_batch_window_too_old(self):
+        """
+        Ensure a window from long ago is skipped without crediting it, and the recent
+        events of the batch are still credited.
+        """
+        data = {"events": [self.make_event(1, 10000, seconds=3600, ago=600), self.make_event(2, 10)]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["accepted_taps"], 10)
+        self.assertEqual(response.data["last_seq"], 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 120)
+
+    def test_tap_batch_only_stale_windows(self):
+        """
+        Ensure a batch of stale windows moves the sequence on, so the client stops retrying it.
+        """
+        data = {"events": [self.make_event(1, 10, ago=600)]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["accepted_taps"], 0)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.balance, self.user.last_tap_seq), (100, 1))
+
+    def test_tap_batch_unauthenticated(self):
+        """
+        Ensure that an unauthenticated request is denied.
+        """
+        self.client.logout()
+        response = self.client.post(self.url, {"events": [self.make_event(1, 10)]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
 # Test: UserEarnings
 # ------------------------------------------------------------------------------------------------------------------------
 class UserEarningsAPITest(APITestCase):
@@ -373,6 +767,92 @@ class UserRefferalLeaderboardAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertIn("detail", response.data)
 
+# Test: Downline
+# ------------------------------------------------------------------------------------------------------------------------
+class DownlineAPITest(APITestCase):
+    """
+    Test suite for the referral closure table and the downline API.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # A referral chain of five users created through the login API: 6000 <- 6001 <- ... <- 6004
+        login_url = reverse("login")
+        for i in range(5):
+            data = {"telegram_id": 6000 + i, "username": f"chain_{i}", "first_name": "Chain"}
+            if i:
+                data["reffered_by"] = 6000 + i - 1
+            cls.client_class().post(login_url, data)
+        cls.signup_stats = DownlineStats.objects.count()
+        referrals.process_pending()
+        cls.users = list(User.objects.filter(telegram_id__gte=6000, telegram_id__lt=6005).order_by("telegram_id"))
+        cls.url = reverse("downline")
+
+    def tiers(self, user):
+        return list(DownlineStats.objects.filter(user=user).order_by("depth").values_list("depth", "members", "balance"))
+
+    def test_signup_fills_three_tiers(self):
+        """
+        Ensure a signup is linked to at most three levels of upline.
+        """
+        self.assertEqual(self.tiers(self.users[0]), [(1, 1, 0), (2, 1, 0), (3, 1, 0)])
+        self.assertFalse(ReferralClosure.objects.filter(ancestor=self.users[0], descendant=self.users[4]).exists())
+
+    def test_members_counted_by_referral_worker(self):
+        """
+        Ensure signups leave the tier sizes to the referral worker, which counts them once.
+        """
+        self.assertEqual(self.signup_stats, 0)
+        self.assertEqual(referrals.process_pending(), 0)
+        self.assertEqual(self.tiers(self.users[1]), [(1, 1, 0), (2, 1, 0), (3, 1, 0)])
+
+    def test_balance_changes_reach_the_upline(self):
+        """
+        Ensure credits and debits of a member leave the upline's stats alone until the
+        balances are refreshed.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            wallet.credit(self.users[3], 100)
+        self.assertFalse([query for query in queries if "downlinestats" in query["sql"].lower()])
+        wallet.debit(self.users[3], 30)
+        self.assertEqual(self.tiers(self.users[0]), [(1, 1, 0), (2, 1, 0), (3, 1, 0)])
+
+        self.assertEqual(downline.refresh_balances(), 9)
+        self.assertEqual(self.tiers(self.users[0]), [(1, 1, 0), (2, 1, 0), (3, 1, 70)])
+        self.assertEqual(self.tiers(self.users[2]), [(1, 1, 70), (2, 1, 0)])
+
+    def test_rebuild_matches_incremental_stats(self):
+        """
+        Ensure rebuilding from reffered_by gives the same closure and stats.
+        """
+        wallet.credit(self.users[2], 40)
+        downline.refresh_balances()
+        before = list(DownlineStats.objects.order_by("user", "depth").values_list("user", "depth", "members", "balance"))
+
+        self.assertEqual(downline.rebuild(), 9)
+        after = list(DownlineStats.objects.order_by("user", "depth").values_list("user", "depth", "members", "balance"))
+        self.assertEqual(after, before)
+
+    def test_downline_tier_page(self):
+        """
+        Ensure the downline API lists one tier with the stats of every tier.
+        """
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.get(self.url, {"depth": 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["telegram_id"] for row in response.data["results"]], [6002])
+        self.assertIsNone(response.data["next"])
+        self.assertEqual([tier["depth"] for tier in response.data["tiers"]], [1, 2, 3])
+
+    def test_downline_invalid_depth(self):
+        """
+        Ensure tiers beyond the closure depth are rejected.
+        """
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.get(self.url, {"depth": 4})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 # Test: OverallLeaderboard
 # ------------------------------------------------------------------------------------------------------------------------
 class OverallLeaderboardAPITest(APITestCase):
@@ -456,6 +936,35 @@ class OverallLeaderboardAPITest(APITestCase):
             User.objects.filter(balance__gt=low_rank_user.balance).count() + 1
         )
 
+    def test_leaderboard_pages(self):
+        """
+        Ensure the leaderboard can be read page by page with a cursor.
+        """
+        response = self.client.get(self.url, {"limit": 20})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user["rank"] for user in response.data["leaderboard"]], list(range(1, 21)))
+
+        response = self.client.get(self.url, {"limit": 20, "cursor": response.data["next_cursor"]})
+        self.assertEqual([user["rank"] for user in response.data["leaderboard"]], list(range(21, 41)))
+        self.assertEqual(response.data["leaderboard"][0]["balance"], 1980)
+
+    def test_leaderboard_around_me(self):
+        """
+        Ensure around=me returns the caller with their neighbours.
+        """
+        response = self.client.get(self.url, {"around": "me", "radius": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        leaderboard = response.data["leaderboard"]
+        self.assertEqual([user["rank"] for user in leaderboard], [499, 500, 501, 502, 503])
+        self.assertEqual(leaderboard[2]["telegram_id"], self.auth_user.telegram_id)
+
+    def test_leaderboard_invalid_cursor(self):
+        """
+        Ensure a malformed cursor is rejected.
+        """
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_unauthenticated_access(self):
         """
         Ensure unauthenticated users cannot access the leaderboard.
@@ -467,6 +976,303 @@ class OverallLeaderboardAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertIn("detail", response.data)
 
+# Test: Ranking
+# ------------------------------------------------------------------------------------------------------------------------
+class RankingTest(TestCase):
+    """
+    Test suite for the single-user rank lookups.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Ties on balance and on referral points exercise every part of the ranking key
+        for i, (balance, points) in enumerate([(300, 0), (300, 5), (200, 5), (200, 5), (200, 1), (100, 0), (0, 0)]):
+            User.objects.create_user(
+                telegram_id=7000 + i, username=f"rank_{i}", first_name="Rank", balance=balance, reffered_points=points
+            )
+        User.objects.filter(telegram_id=7003).update(date_joined=User.objects.get(telegram_id=7002).date_joined)
+
+    def dense_ranks(self, order_by):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT telegram_id, DENSE_RANK() OVER (ORDER BY {order_by}) FROM user_app_user")
+            return dict(cursor.fetchall())
+
+    def test_overall_rank_matches_dense_rank(self):
+        """
+        Ensure the overall rank equals DENSE_RANK() over balance, referral points and join date.
+        """
+        expected = self.dense_ranks("balance DESC, reffered_points DESC, date_joined ASC")
+        for user in User.objects.all():
+            self.assertEqual(ranking.overall_rank(user.balance, user.reffered_points, user.date_joined), expected[user.telegram_id])
+
+    def test_referral_rank_matches_dense_rank(self):
+        """
+        Ensure the referral rank equals DENSE_RANK() over referral points.
+        """
+        expected = self.dense_ranks("reffered_points DESC")
+        for user in User.objects.all():
+            self.assertEqual(ranking.referral_rank(user.reffered_points), expected[user.telegram_id])
+
+    def test_pages_continue_dense_ranks(self):
+        """
+        Ensure keyset pages cover every user once and keep the dense ranks across pages.
+        """
+        for board, order in (("overall", "balance DESC, reffered_points DESC, date_joined ASC"), ("referral", "reffered_points DESC")):
+            expected, ranks, cursor = self.dense_ranks(order), {}, None
+            while True:
+                users, cursor = ranking.page(board, cursor, limit=2)
+                ranks.update((user.telegram_id, user.rank) for user in users)
+                if cursor is None:
+                    break
+            self.assertEqual(ranks, expected)
+
+    def test_around_matches_dense_rank(self):
+        """
+        Ensure the window around a user carries the same ranks.
+        """
+        expected = self.dense_ranks("balance DESC, reffered_points DESC, date_joined ASC")
+        users = ranking.around("overall", User.objects.get(telegram_id=7003), radius=2)
+        self.assertEqual(len(users), 5)
+        self.assertEqual(users[2].telegram_id, 7003)
+        for user in users:
+            self.assertEqual(user.rank, expected[user.telegram_id])
+
+# Test: RankEngine
+# ------------------------------------------------------------------------------------------------------------------------
+class RankEngineTest(RankingTest):
+    """
+    Runs the ranking tests against the in-process rank engine.
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(
+            LEADERBOARD_BACKEND="engine",
+            LEADERBOARD_ENGINE_PATH=os.path.join(directory, "leaderboard.bin"),
+            LEADERBOARD_ENGINE_RECONCILE_SECONDS=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        rank_engine._engine = None
+        self.addCleanup(setattr, rank_engine, "_engine", None)
+
+    def test_sorted_keys_match_a_sorted_list(self):
+        """
+        Ensure the blocked array agrees with a plain sorted list through inserts and removals.
+        """
+        rng = random.Random(7)
+        rank_engine.SortedKeys.LOAD, load = 4, rank_engine.SortedKeys.LOAD
+        self.addCleanup(setattr, rank_engine.SortedKeys, "LOAD", load)
+        keys, expected = rank_engine.SortedKeys(), []
+        for _ in range(500):
+            key = rng.randrange(200)
+            if key in expected:
+                keys.remove(key)
+                expected.remove(key)
+            else:
+                keys.add(key)
+                expected.append(key)
+                expected.sort()
+            probe = rng.randrange(200)
+            self.assertEqual(keys.index(probe), sum(1 for k in expected if k < probe))
+        self.assertEqual(keys.slice(0, len(expected)), expected)
+        self.assertEqual(keys.slice(10, 20), expected[10:20])
+
+    def test_wallet_updates_reach_the_engine(self):
+        """
+        Ensure a committed credit moves the user on the engine boards.
+        """
+        user = User.objects.get(telegram_id=7006)
+        rank_engine.get_engine()
+        with self.captureOnCommitCallbacks(execute=True):
+            wallet.credit(user, 1000)
+        self.assertEqual(ranking.top_users("overall", 1)[0].telegram_id, 7006)
+        self.assertEqual(ranking.overall_rank(user.balance, user.reffered_points, user.date_joined), 1)
+
+    def test_snapshot_warms_a_new_engine(self):
+        """
+        Ensure a new engine loads the snapshot instead of the database.
+        """
+        engine = rank_engine.get_engine()
+        engine.note(User.objects.get(telegram_id=7006).pk, {"balance": 1000})
+        engine.save_snapshot()
+
+        rank_engine._engine = None
+        self.assertEqual(rank_engine.get_engine().range("overall", 0, 1), [(User.objects.get(telegram_id=7006).pk, 1)])
+
+# Test: LeaderboardSnapshot
+# ------------------------------------------------------------------------------------------------------------------------
+@override_settings(LEADERBOARD_SIZE=3, LEADERBOARD_SNAPSHOT_MIN_SECONDS=0)
+class LeaderboardSnapshotTest(APITestCase):
+    """
+    Test suite for the stored leaderboard snapshots.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(telegram_id=5000 + i, username=f"board_{i}", first_name="Board", balance=500 - i * 100)
+            for i in range(5)
+        ]
+        cls.url = reverse("overall-leaderboard")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.users[0])
+
+    def board(self):
+        return [row["telegram_id"] for row in self.client.get(self.url).data["leaderboard"]]
+
+    def test_snapshot_is_served_until_due(self):
+        """
+        Ensure changes outside the wallet do not show until the snapshot is refreshed.
+        """
+        self.assertEqual(self.board(), [5000, 5001, 5002])
+        self.assertEqual(LeaderboardSnapshot.objects.get(board="overall").threshold, 300)
+
+        User.objects.filter(pk=self.users[4].pk).update(balance=1000)
+        self.assertEqual(self.board(), [5000, 5001, 5002])
+
+    def test_crossing_the_threshold_refreshes(self):
+        """
+        Ensure a credit that reaches the last-place score marks the board stale.
+        """
+        self.board()
+        wallet.credit(self.users[4], 1000)
+        self.assertTrue(LeaderboardSnapshot.objects.get(board="overall").stale)
+
+        self.assertEqual(self.board(), [5004, 5000, 5001])
+        self.assertFalse(LeaderboardSnapshot.objects.get(board="overall").stale)
+
+    def test_credit_below_threshold_keeps_snapshot(self):
+        """
+        Ensure a credit that stays below the last place does not touch the snapshot.
+        """
+        self.board()
+        wallet.credit(self.users[4], 10)
+        self.assertFalse(LeaderboardSnapshot.objects.get(board="overall").stale)
+
+# Test: ReligionLeaderboard
+# ------------------------------------------------------------------------------------------------------------------------
+class ReligionLeaderboardAPITest(APITestCase):
+    """
+    Test suite for the religion-scoped leaderboard.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Alternate religions so every religion board skips the other one's users
+        cls.users = [
+            User.objects.create_user(
+                telegram_id=8000 + i,
+                username=f"faith_{i}",
+                first_name="Faith",
+                balance=1000 - i * 10,
+                user_religion="Buddhism" if i % 2 else "Hindu",
+            )
+            for i in range(20)
+        ]
+        cls.url = reverse("religion-leaderboard")
+
+    def test_leaderboard_for_own_religion(self):
+        """
+        Ensure the caller's religion is ranked on its own.
+        """
+        user = self.users[5]  # Buddhism, third of its religion
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.url, {"limit": 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["religion"], "Buddhism")
+        self.assertEqual([row["telegram_id"] for row in response.data["leaderboard"]], [8001, 8003, 8005])
+        self.assertEqual([row["rank"] for row in response.data["leaderboard"]], [1, 2, 3])
+        self.assertEqual(response.data["user_details"]["rank"], 3)
+
+    def test_leaderboard_around_me_in_religion(self):
+        """
+        Ensure around=me only returns neighbours of the same religion.
+        """
+        self.client.force_authenticate(user=self.users[10])  # Hindu, sixth of its religion
+        response = self.client.get(self.url, {"around": "me", "radius": 1})
+
+        self.assertEqual([row["telegram_id"] for row in response.data["leaderboard"]], [8008, 8010, 8012])
+        self.assertEqual([row["rank"] for row in response.data["leaderboard"]], [5, 6, 7])
+
+    def test_other_religion_is_not_ranked(self):
+        """
+        Ensure a caller browsing another religion gets no rank in it.
+        """
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.get(self.url, {"religion": "Buddhism"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["user_details"]["rank"])
+
+    def test_user_without_religion(self):
+        """
+        Ensure a caller without a religion has to pick one.
+        """
+        user = User.objects.create_user(telegram_id=8999, username="none", first_name="None")
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+# Test: WindowedLeaderboard
+# ------------------------------------------------------------------------------------------------------------------------
+class WindowedLeaderboardAPITest(APITestCase):
+    """
+    Test suite for the daily and weekly leaderboards.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(telegram_id=9000 + i, username=f"window_{i}", first_name="Window", balance=10 ** 6)
+            for i in range(4)
+        ]
+        cls.url = reverse("windowed-leaderboard")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.users[2])
+
+    def test_credits_rank_the_current_window(self):
+        """
+        Ensure credits of the current window rank users, regardless of lifetime balance.
+        """
+        for user, amount in zip(self.users, (50, 300, 50)):
+            wallet.credit(user, amount)
+        wallet.credit(self.users[0], 25)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["period"], "day")
+        leaderboard = response.data["leaderboard"]
+        self.assertEqual([(row["telegram_id"], row["points"], row["rank"]) for row in leaderboard], [
+            (9001, 300, 1), (9000, 75, 2), (9002, 50, 3),
+        ])
+        self.assertEqual(response.data["user_details"]["rank"], 3)
+
+    def test_previous_window_is_ignored(self):
+        """
+        Ensure points from a past window do not count.
+        """
+        IncomeRollup.objects.create(user=self.users[3], period="week", bucket=rollups.bucket("week") - 7, points=900)
+        wallet.credit(self.users[1], 10)
+
+        response = self.client.get(self.url, {"period": "week"})
+        self.assertEqual([row["telegram_id"] for row in response.data["leaderboard"]], [9001])
+        self.assertEqual(response.data["user_details"], {
+            "username": "window_2", "first_name": "Window", "points": 0, "rank": None
+        })
+
+    def test_invalid_period(self):
+        """
+        Ensure an unknown period is rejected.
+        """
+        response = self.client.get(self.url, {"period": "season"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 # Test: RefferalLeaderboard
 # ------------------------------------------------------------------------------------------------------------------------
 class RefferalLeaderboardAPITestCase(APITestCase):
@@ -487,6 +1293,10 @@ class RefferalLeaderboardAPITestCase(APITestCase):
         for i in range(5):
             cls.users[10 + i].reffered_by = cls.users[0].telegram_id
             cls.users[10 + i].save()
+
+        # Existing referrals are counted by the backfill
+        referrals.backfill_referral_counts()
+        cls.users[0].refresh_from_db()
         
         cls.url = reverse("refferal-leaderboard")
 
@@ -575,9 +1385,37 @@ class TasksAPITestCase(APITestCase):
 
         cls.url = reverse("tasks")
 
+    def setUp(self):
+        cache.clear()  # Cached claims are keyed by user id, which other tests reuse
+
     def authenticate_user(self, user):
         self.client.force_authenticate(user=user)
 
+    def test_claim_state_is_loaded_once(self):
+        """
+        Test that the tasks list does not query claims per task, and caches them.
+        """
+        for i in range(10):
+            Tasks.objects.create(name=f"Extra {i}", description="Extra", task_type="social", points=1)
+        self.authenticate_user(self.user)
+
+        with self.assertNumQueries(2):  # Tasks catalog, then the user's claims
+            self.client.get(self.url)
+        with self.assertNumQueries(0):  # Both come from the cache
+            self.client.get(self.url)
+
+    def test_claim_invalidates_cached_state(self):
+        """
+        Test that a new claim shows up in the tasks list right away.
+        """
+        self.authenticate_user(self.user)
+        self.client.get(self.url)
+        UserTaskClaim.objects.create(user=self.user, task=self.social_task)
+
+        response = self.client.get(self.url)
+        social_task = next(task for task in response.data if task["name"] == "Social Task 1")
+        self.assertTrue(social_task["claim"])
+
     def test_get_tasks_list_success(self):
         """
         Test fetching tasks list for an authenticated user.
@@ -677,6 +1515,9 @@ class UserTaskClaimAPITestCase(APITestCase):
         )
         
         cls.url = reverse("claim-task")
+
+    def setUp(self):
+        catalog.TASKS.invalidate() # Tests edit the task in place; rollbacks do not reach the catalog
     
     def authenticate_user(self, user):
         self.client.force_authenticate(user=user)
@@ -734,6 +1575,38 @@ class UserTaskClaimAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data["non_field_errors"][0], "Task Already Claimed.")
 
+    def test_claim_daily_task_again_next_day(self):
+        """
+        Test that a daily task claimed on a previous day can be claimed again.
+        """
+        self.authenticate_user(self.user)
+        yesterday = timezone.now() - timedelta(days=1)
+        UserTaskClaim.objects.create(
+            user=self.user, task=self.task, claimed=True, period_bucket=UserTaskClaim.period_for(self.task, yesterday)
+        )
+
+        response = self.client.post(self.url, {"id": str(self.task.id)}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(UserTaskClaim.objects.filter(user=self.user, task=self.task).count(), 2)
+
+    def test_duplicate_claim_is_rejected_by_the_database(self):
+        """
+        Test that the period constraint rejects a second claim even without the API checks,
+        and that the rejected request leaves the balance untouched.
+        """
+        self.authenticate_user(self.user)
+        response = self.client.post(self.url, {"id": str(self.task.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserTaskClaim.objects.create(user=self.user, task=self.task, claimed=True)
+
+        response = self.client.post(self.url, {"id": str(self.task.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1100)
+
     def test_claim_task_nonexistent(self):
         """
         Test claiming a task with a non-existent ID.
@@ -789,6 +1662,7 @@ class CardsAPIViewTest(APITestCase):
     def setUp(self):
         # Authenticate the user using force_authenticate
         self.client.force_authenticate(user=self.user)
+        unlocks.invalidate() # Rules created by other tests were rolled back
     
     def test_cards_api_view(self):        
         # Making a GET request to the cards API
@@ -823,6 +1697,37 @@ class CardsAPIViewTest(APITestCase):
         self.assertTrue("burning_points" in response_data[0])
         self.assertTrue("automine_points" in response_data[0])
 
+    def test_constant_queries(self):
+        """
+        Test that the cards page costs one query once the catalogs are loaded, whatever the claims.
+        """
+        CardsDetails.objects.create(card=self.card1, level_number=2, burning_points=50, automine_points=5)
+        UserCardClaim.objects.create(user=self.user, card=self.card1, card_level=2, claimed=True)
+        UserCardClaim.objects.create(user=self.user, card=self.card2, claimed=True)
+        self.client.get(self.url)
+
+        with self.assertNumQueries(1):  # The user's claims
+            response = self.client.get(self.url)
+        card = next(card for card in response.data if card["name"] == "Eternal Flame")
+        self.assertEqual((card["claim"], card["level"], card["status"]), (True, 2, "claimed"))
+        self.assertEqual((card["burning_points"], card["automine_points"]), (50, 5))
+
+    def test_status_follows_unlock_rules(self):
+        """
+        Test that card statuses come from the CardUnlockRule rows.
+        """
+        CardUnlockRule.objects.create(card=self.card1, user_level=2)
+        CardUnlockRule.objects.create(card=self.card2, required_card=self.card1, required_card_level=1)
+
+        response = self.client.get(self.url)
+        statuses = {card["name"]: card["status"] for card in response.data}
+        self.assertEqual(statuses, {"Eternal Flame": "unlocked", "Divine Radiance": "locked"})
+
+        UserCardClaim.objects.create(user=self.user, card=self.card1, card_level=1, claimed=True)
+        response = self.client.get(self.url)
+        statuses = {card["name"]: card["status"] for card in response.data}
+        self.assertEqual(statuses, {"Eternal Flame": "claimed", "Divine Radiance": "unlocked"})
+
     def test_unauthenticated_access(self):
         # Try to access the cards API without authentication
         self.client.logout()  # Log out the authenticated user
@@ -833,6 +1738,60 @@ class CardsAPIViewTest(APITestCase):
         # Assert that the status code is 401 Unauthorized
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+# Test: CardUnlocks
+# ------------------------------------------------------------------------------------------------------------------------
+class CardUnlocksTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Create a chain of cards: a needs level 2, b needs a at level 3, c needs a and b.
+        """
+        cls.a, cls.b, cls.c, cls.d = (
+            Cards.objects.create(name=name, number=number, card_type="eternals")
+            for number, name in enumerate("abcd", 1)
+        )
+        CardUnlockRule.objects.create(card=cls.a, user_level=2)
+        CardUnlockRule.objects.create(card=cls.b, required_card=cls.a, required_card_level=3)
+        CardUnlockRule.objects.create(card=cls.c, required_card=cls.a)
+        CardUnlockRule.objects.create(card=cls.c, required_card=cls.b, user_level=4)
+
+    def setUp(self):
+        unlocks.invalidate()
+
+    def test_compiled_in_dependency_order(self):
+        """
+        Ensure prerequisites come first and multiple rules of a card are folded together.
+        """
+        order = unlocks.get_graph().order
+        self.assertEqual([entry[0] for entry in order], [self.a.id, self.b.id, self.c.id])
+        self.assertEqual(order[2], (self.c.id, 4, ((self.a.id, 0), (self.b.id, 0))))
+
+    def test_evaluate(self):
+        """
+        Ensure statuses follow the user's level and claims, and cards without rules are locked.
+        """
+        graph = unlocks.get_graph()
+        with self.assertNumQueries(0):
+            self.assertEqual(graph.evaluate(1, {}), {self.a.id: "locked", self.b.id: "locked", self.c.id: "locked"})
+            self.assertEqual(
+                graph.evaluate(4, {self.a.id: 3}),
+                {self.a.id: "claimed", self.b.id: "unlocked", self.c.id: "locked"},
+            )
+            self.assertEqual(
+                graph.evaluate(4, {self.a.id: 3, self.b.id: 0}),
+                {self.a.id: "claimed", self.b.id: "claimed", self.c.id: "unlocked"},
+            )
+            self.assertNotIn(self.d.id, graph.evaluate(4, {}))
+
+    def test_cycle_stays_locked(self):
+        """
+        Ensure cards in a prerequisite cycle are never unlocked, and new rules are picked up.
+        """
+        CardUnlockRule.objects.create(card=self.a, required_card=self.c)
+        graph = unlocks.get_graph()
+        self.assertEqual(graph.order, [])
+        self.assertEqual(graph.evaluate(10, {self.b.id: 5}), {self.b.id: "claimed"})
+
 # Test: UserCardClaim
 # ------------------------------------------------------------------------------------------------------------------------
 class UserCardClaimAPITestCase(APITestCase):
@@ -889,6 +1848,22 @@ class UserCardClaimAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("Insufficients Funds", response.data["non_field_errors"][0])
 
+    def test_claim_card_balance_spent_concurrently(self):
+        """
+        Test that the debit is checked against the stored balance, not the loaded one,
+        and that the claim is rolled back when it no longer fits.
+        """
+        User.objects.filter(pk=self.user.pk).update(balance=100)  # Spent by another request
+        data = {
+            "id": str(self.card.id),
+            "burning_points": 200
+        }
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UserCardClaim.objects.filter(user=self.user, card=self.card).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 100)
+
     def test_claim_card_already_claimed(self):
         """
         Test that a user cannot claim a card that they have already claimed.
@@ -903,6 +1878,20 @@ class UserCardClaimAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("Already Claimed", response.data["non_field_errors"][0])
 
+    def test_claim_card_price_comes_from_the_server(self):
+        """
+        Test that the claim is charged the level 0 price, whatever price the client sends.
+        """
+        response = self.client.post(self.url, {"id": str(self.card.id), "burning_points": 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 800)
+        self.assertEqual((response.data["burning_points"], response.data["automine_points"]), (200, 10))
+        self.assertEqual(self.user.automine_rate_per_hour, 10)  # The claimed card now earns
+
+        response = self.client.post(reverse("update-card-level"), {"id": str(self.card.id)}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST) # No level 1 in the curve
+
     def test_claim_invalid_card_id(self):
         """
         Test that a user cannot claim a card with an invalid card ID.
@@ -996,6 +1985,23 @@ class UpdateUserCardLevelAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("Insufficient funds to claim this card.", response.data["non_field_errors"])
 
+    def test_update_card_level_price_comes_from_the_server(self):
+        """
+        Test that an upgrade is charged the next level's price without a client price,
+        with one write each for the debit and the level.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {"id": str(self.card.id)}, format="json")
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        self.assertEqual(
+            [statement for statement in statements if statement not in ("SAVEPOINT", "RELEASE")],
+            ["SELECT", "UPDATE", "SELECT", "UPDATE"],  # Claim, debit and its read-back, level
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 800)
+        self.assertEqual((response.data["level"], response.data["points"]), (2, 200))
+
     def test_update_card_level_max_limit_reached(self):
         """
         Test that a user cannot update the card level if the card has reached the maximum level limit.
@@ -1048,6 +2054,143 @@ class UpdateUserCardLevelAPITestCase(APITestCase):
         response = self.client.post(self.url, data, format="json")
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+# Test: BulkCardPurchase
+# ------------------------------------------------------------------------------------------------------------------------
+class BulkCardPurchaseAPITestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Create two cards with levels 0 to 3 costing (level + 1) * 100, one of them claimed at level 1.
+        """
+        cls.user = User.objects.create_user(telegram_id=123456789, username="testuser", first_name="Test", balance=1000)
+        cls.claimed = Cards.objects.create(name="Claimed Card", number=1, card_type="eternals")
+        cls.unclaimed = Cards.objects.create(name="New Card", number=2, card_type="divine")
+        for card in (cls.claimed, cls.unclaimed):
+            for level in range(4):
+                CardsDetails.objects.create(
+                    card=card, level_number=level, burning_points=(level + 1) * 100, automine_points=(level + 1) * 10
+                )
+        cls.claim = UserCardClaim.objects.create(user=cls.user, card=cls.claimed, card_level=1, claimed=True)
+        cls.url = reverse("bulk-card-purchase")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_purchase(self):
+        """
+        Test that claims and multi-level upgrades are priced by the server and debited once.
+        """
+        data = {"cards": [{"id": str(self.claimed.id), "levels": 2}, {"id": str(self.unclaimed.id), "levels": 2}]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Claimed card: levels 2 and 3 (300 + 400); new card: claim and level 1 (100 + 200)
+        self.assertEqual(response.data["balance"], 0)
+        self.assertEqual({card["name"]: card["level"] for card in response.data["cards"]}, {"Claimed Card": 3, "New Card": 1})
+        self.assertEqual(response.data["cards"][0]["automine_points"], 40)
+        self.claim.refresh_from_db()
+        self.assertEqual(self.claim.card_level, 3)
+        self.assertEqual(UserCardClaim.objects.get(user=self.user, card=self.unclaimed).card_level, 1)
+        self.assertEqual(response.data["automine_rate_per_hour"], 40 - 20 + 20)
+
+    def test_bulk_purchase_is_all_or_nothing(self):
+        """
+        Test that a batch the balance does not cover changes nothing.
+        """
+        data = {"cards": [{"id": str(self.claimed.id), "levels": 2}, {"id": str(self.unclaimed.id), "levels": 3}]}
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Insufficient funds for these cards.", response.data["non_field_errors"])
+        self.claim.refresh_from_db()
+        self.assertEqual(self.claim.card_level, 1)
+        self.assertFalse(UserCardClaim.objects.filter(user=self.user, card=self.unclaimed).exists())
+
+    def test_bulk_purchase_past_the_curve(self):
+        """
+        Test that upgrades beyond the last configured level are rejected.
+        """
+        data = {"cards": [{"id": str(self.claimed.id), "levels": 1}, {"id": str(self.claimed.id), "levels": 2}]}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Claimed Card: level 4 is not available.", response.data["non_field_errors"])
+
+    def test_bulk_purchase_statements(self):
+        """
+        Test that the writes do not grow with the number of cards.
+        """
+        data = {"cards": [{"id": str(self.claimed.id), "levels": 2}, {"id": str(self.unclaimed.id), "levels": 1}]}
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, data, format="json")
+        writes = [query["sql"].split()[0] for query in queries.captured_queries]
+        self.assertEqual([sql for sql in writes if sql in ("INSERT", "UPDATE")], ["INSERT", "UPDATE", "UPDATE"])
+
+# Test: CardCurves
+# ------------------------------------------------------------------------------------------------------------------------
+class CardCurvesAPITestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(telegram_id=123456789, username="testuser", first_name="Test")
+        cls.card = Cards.objects.create(name="Test Card", number=1, card_type="eternals")
+        cls.other_card = Cards.objects.create(name="Other Card", number=2, card_type="eternals")
+        for card in (cls.card, cls.other_card):
+            for level in range(0, 4):
+                CardsDetails.objects.create(
+                    card=card, level_number=level, burning_points=level * 100, automine_points=level * 10
+                )
+        cls.url = reverse("card-curves")
+
+    def setUp(self):
+        catalog.CARDS_DETAILS.invalidate()
+        self.client.force_authenticate(user=self.user)
+
+    def test_all_curves(self):
+        """Every card comes back with all of its levels in order."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({curve["id"] for curve in response.data}, {str(self.card.id), str(self.other_card.id)})
+        for curve in response.data:
+            self.assertEqual([level["level_number"] for level in curve["levels"]], [0, 1, 2, 3])
+        self.assertTrue(response["ETag"])
+
+    def test_single_curve(self):
+        """`card_id` narrows the response to one card."""
+        response = self.client.get(self.url, {"card_id": str(self.card.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], str(self.card.id))
+        self.assertEqual(
+            response.data["levels"][2], {"level_number": 2, "burning_points": 200, "automine_points": 20}
+        )
+
+    def test_unknown_card(self):
+        """An unknown or malformed card_id is a 404."""
+        self.assertEqual(self.client.get(self.url, {"card_id": str(uuid4())}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"card_id": "nope"}).status_code, 404)
+
+    def test_not_modified(self):
+        """A matching If-None-Match gets an empty 304 without touching the database."""
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse(response.content)
+
+    def test_etag_changes_with_curve(self):
+        """Editing a level changes the ETag of the card and of the full list, not of other cards."""
+        full = self.client.get(self.url)["ETag"]
+        single = self.client.get(self.url, {"card_id": str(self.card.id)})["ETag"]
+        other = self.client.get(self.url, {"card_id": str(self.other_card.id)})["ETag"]
+        detail = CardsDetails.objects.get(card=self.card, level_number=3)
+        detail.burning_points = 999
+        detail.save()
+
+        response = self.client.get(self.url, {"card_id": str(self.card.id)}, HTTP_IF_NONE_MATCH=single)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["levels"][3]["burning_points"], 999)
+        self.assertNotEqual(self.client.get(self.url)["ETag"], full)
+        self.assertEqual(self.client.get(self.url, {"card_id": str(self.other_card.id)})["ETag"], other)
+
 # Test: CardDetails
 # ------------------------------------------------------------------------------------------------------------------------
 class CardDetailsAPITestCase(APITestCase):
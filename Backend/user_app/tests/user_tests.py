@@ -1,8 +1,17 @@
-from rest_framework.test import APITestCase
+import os
+import shutil
+import tempfile
+from unittest import mock
+from rest_framework.test import APITestCase, APITransactionTestCase
+from django.db import transaction
+from django.test import override_settings
+from datetime import timedelta
+from django.utils import timezone
+from user_app import automine, referrals, wallet, write_behind
 from rest_framework import status
 from django.urls import reverse
 from user_app.models import (
-    User, RefferReward, Cards, CardsDetails, UserCardClaim
+    User, RefferReward, Rules, Cards, CardsDetails, UserCardClaim
 )
 
 # Test: Login
@@ -70,11 +79,44 @@ class LoginAPITestCase(APITestCase):
         # Verify that the new user is created
         self.assertTrue(User.objects.filter(telegram_id=654321).exists())
 
+        # The reward is deferred until the referral worker runs
+        self.referrer.refresh_from_db()
+        self.assertEqual(self.referrer.balance, 0)
+        self.assertEqual(referrals.process_pending(), 1)
+
         # Verify referral bonus for referrer
         self.referrer.refresh_from_db()
         self.assertEqual(self.referrer.reffered_points, 100)  # Level 1 reward
         self.assertEqual(self.referrer.balance, 100)          # Level 1 reward
 
+    def test_referral_rewards_aggregated_and_applied_once(self):
+        """
+        Test that several referrals are applied in one batch and never twice.
+        """
+        for telegram_id in (654322, 654323, 654324):
+            self.client.post(self.login_url, {'telegram_id': telegram_id, 'reffered_by': self.referrer.telegram_id})
+
+        self.assertEqual(referrals.process_pending(), 3)
+        self.assertEqual(referrals.process_pending(), 0)  # Nothing left to apply
+
+        self.referrer.refresh_from_db()
+        self.assertEqual(self.referrer.reffered_points, 300)
+        self.assertEqual(self.referrer.balance, 300)
+        self.assertEqual(self.referrer.referral_count, 3)
+
+    def test_backfill_referral_counts(self):
+        """
+        Test that the backfill only counts referrals whose reward was processed.
+        """
+        self.client.post(self.login_url, {'telegram_id': 654325, 'reffered_by': self.referrer.telegram_id})
+        referrals.process_pending()
+        self.client.post(self.login_url, {'telegram_id': 654326, 'reffered_by': self.referrer.telegram_id})
+        User.objects.update(referral_count=0)
+
+        referrals.backfill_referral_counts()
+        self.referrer.refresh_from_db()
+        self.assertEqual(self.referrer.referral_count, 1)  # The pending one is counted by the worker
+
     def test_create_user_without_referral(self):
         """
         Test creating a new user without a referrer.
@@ -113,6 +155,7 @@ class LoginAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Ensure no reward is given to the referrer
+        referrals.process_pending()
         no_reward_user.refresh_from_db()
         self.assertEqual(no_reward_user.reffered_points, 0)
         self.assertEqual(no_reward_user.balance, 0)
@@ -201,6 +244,59 @@ class UserDetailsAPITestCase(APITestCase):
         self.assertEqual(response.data['user_cards'][0]['automine_points'], 50)
         self.assertEqual(response.data['user_cards'][1]['automine_points'], 80)
 
+    def test_automine_rates_backfilled_from_claimed_cards(self):
+        """
+        Test that the backfill sums the automine points of the claimed card levels.
+        """
+        automine.backfill_rates()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.automine_rate_per_hour, 130)
+        self.assertIsNotNone(self.user.automine_synced_at)
+
+    def test_automine_income_credited_on_visit(self):
+        """
+        Test that opening the user details credits the income since the last visit once.
+        """
+        User.objects.filter(pk=self.user.pk).update(
+            automine_rate_per_hour=130, automine_synced_at=timezone.now() - timedelta(hours=2)
+        )
+        self.user.refresh_from_db()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["automine_earned"], 260)
+        self.assertEqual(response.data["balance"], 760)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["automine_earned"], 0)
+        self.assertEqual(response.data["balance"], 760)
+
+    @override_settings(AUTOMINE_CAP_HOURS=3, AUTOMINE_AUTOBOT_CAP_HOURS=12)
+    def test_automine_income_capped(self):
+        """
+        Test that offline income stops after the cap, which the auto-pray bot extends.
+        """
+        User.objects.filter(pk=self.user.pk).update(
+            automine_rate_per_hour=100, automine_synced_at=timezone.now() - timedelta(hours=20)
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(automine.pending(self.user).points, 1200)
+
+        self.user.autobot_status = False
+        self.assertEqual(automine.pending(self.user).points, 300)
+
+    def test_automine_concurrent_settle_pays_once(self):
+        """
+        Test that two settles from the same stale state credit the income once.
+        """
+        User.objects.filter(pk=self.user.pk).update(
+            automine_rate_per_hour=100, automine_synced_at=timezone.now() - timedelta(hours=1)
+        )
+        first, second = User.objects.get(pk=self.user.pk), User.objects.get(pk=self.user.pk)
+        self.assertEqual(automine.settle(first), 100)
+        self.assertEqual(automine.settle(second), 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 600)
+
     def test_user_details_unauthenticated(self):
         """
         Test retrieving user details without authentication.
@@ -372,4 +468,224 @@ class WelcomeBonusAPIViewTests(APITestCase):
         # Ensure the balance has been updated and the bonus status is True
         invalid_user.refresh_from_db()
         self.assertTrue(invalid_user.welcome_bonus)
-        self.assertEqual(invalid_user.balance, 10000)
\ No newline at end of file
+        self.assertEqual(invalid_user.balance, 10000)
+# Test: UpdateReligion
+# ------------------------------------------------------------------------------------------------------------------------
+class UpdateReligionAPITestCase(APITestCase):
+    """
+    Test case for the UpdateReligion API, including dirty-field tracking on User.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up a user whose religion is updated.
+        """
+        cls.user = User.objects.create_user(
+            telegram_id=123456, username='testuser', first_name='Test', balance=500
+        )
+        cls.url = reverse('update-religion')
+
+    def setUp(self):
+        """
+        Authenticate the user for each test.
+        """
+        self.client.force_authenticate(user=self.user)
+
+    def test_update_religion_success(self):
+        """
+        Test that the religion is saved without recomputing the user level.
+        """
+        with mock.patch.object(User, 'update_user_level') as mock_update_level:
+            response = self.client.patch(self.url, {'user_religion': 'Hindu'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_update_level.assert_not_called()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.user_religion, 'Hindu')
+
+    def test_save_writes_only_changed_columns(self):
+        """
+        Test that saving a user writes only the changed columns and skips unchanged saves.
+        """
+        user = User.objects.get(pk=self.user.pk)
+        User.objects.filter(pk=user.pk).update(balance=900)  # Changed by another request
+
+        with self.assertNumQueries(0):
+            user.save()
+
+        user.user_religion = 'Buddhism'
+        user.save()
+        user.refresh_from_db()
+        self.assertEqual(user.balance, 900)  # Not overwritten with the stale loaded value
+        self.assertEqual(user.user_religion, 'Buddhism')
+
+    def test_update_religion_invalid_choice(self):
+        """
+        Test that an unknown religion is rejected.
+        """
+        response = self.client.patch(self.url, {'user_religion': 'Unknown'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+# Test: WriteBehindBalances
+# ------------------------------------------------------------------------------------------------------------------------
+class WriteBehindBalanceTests(APITestCase):
+    """
+    Test case for the optional write-behind balance mode.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up a user that claims the welcome bonus.
+        """
+        cls.user = User.objects.create_user(
+            telegram_id=123456789,
+            username='testuser',
+            first_name='Test User',
+            balance=0
+        )
+        cls.url = reverse('welcome-bonus')
+
+    def setUp(self):
+        """
+        Enable write-behind with a private log directory and no background flusher.
+        """
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir, ignore_errors=True)
+        settings_override = override_settings(
+            WRITE_BEHIND_BALANCES=True, WRITE_BEHIND_LOG_DIR=self.log_dir, WRITE_BEHIND_FLUSH_MS=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        write_behind._accumulator = None
+        self.addCleanup(setattr, write_behind, "_accumulator", None)
+        self.client.force_authenticate(user=self.user)
+
+    def test_credit_is_applied_on_flush(self):
+        """
+        Test that a credit is only written to the user row when the accumulator flushes.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 0)
+        self.assertTrue(self.user.welcome_bonus)
+        self.assertEqual(write_behind.pending_for(self.user), 10000)
+
+        self.assertEqual(write_behind.flush(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10000)
+        self.assertEqual(os.listdir(self.log_dir), [f"active-{os.getpid()}.log"])
+
+        # The flush also counts towards the daily and weekly rollups
+        self.assertEqual(sorted(self.user.income_rollups.values_list("period", "points")), [("day", 10000), ("week", 10000)])
+
+    def test_leftover_batch_is_replayed_once(self):
+        """
+        Test that a batch file left by a crash is applied exactly once.
+        """
+        with open(os.path.join(self.log_dir, "batch-crashed.log"), "w") as log:
+            log.write(f"{self.user.telegram_id} 250\n{self.user.telegram_id} 50\n")
+        write_behind.apply_batch("crashed", {self.user.telegram_id: 300}) # Applied before the crash
+
+        write_behind.get_accumulator() # Replays leftover logs
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 300)
+        self.assertNotIn("batch-crashed.log", os.listdir(self.log_dir))
+
+    def test_batch_of_live_process_is_not_replayed(self):
+        """
+        Test that a flush another live process is running is left to that process.
+        """
+        name = f"batch-{os.getppid()}-inflight.log"
+        with open(os.path.join(self.log_dir, name), "w") as log:
+            log.write(f"{self.user.telegram_id} 250\n")
+
+        write_behind.get_accumulator()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 0)
+        self.assertIn(name, os.listdir(self.log_dir))
+
+# Test: WriteBehindPending
+# ------------------------------------------------------------------------------------------------------------------------
+class WriteBehindPendingTests(APITransactionTestCase):
+    """
+    Test case for requests made while credits are still queued by write-behind.
+    Transactions are real here, since credits are queued on commit and only flushed
+    outside of a transaction.
+    """
+
+    def setUp(self):
+        """
+        Enable write-behind and queue the welcome bonus of a new user.
+        """
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir, ignore_errors=True)
+        settings_override = override_settings(
+            WRITE_BEHIND_BALANCES=True, WRITE_BEHIND_LOG_DIR=self.log_dir, WRITE_BEHIND_FLUSH_MS=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        write_behind._accumulator = None
+        self.addCleanup(setattr, write_behind, "_accumulator", None)
+
+        Rules.objects.create(
+            level_number=1, level_name='Seeker of Truth', lower_points=0, higher_points=10**9,
+            per_tap=2, point_refill=0, number_of_tap=500
+        )
+        self.user = User.objects.create_user(telegram_id=123456789, username='testuser', first_name='Test User', balance=0)
+        self.client.force_authenticate(user=self.user)
+        self.client.put(reverse('welcome-bonus'))
+        self.assertEqual(write_behind.pending_for(self.user), 10000)
+
+    def test_debit_spends_pending_credit(self):
+        """
+        Test that points shown to the user can be spent before the next flush.
+        """
+        response = self.client.post(
+            reverse('user-earnings'), {'amount': 4000, 'transaction_type': 'DEBIT', 'reason': 'Auto Pray'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 6000)
+        self.assertTrue(self.user.autobot_status)
+        self.assertEqual(write_behind.pending_for(self.user), 0)
+
+    def test_absolute_balance_counts_pending_credit(self):
+        """
+        Test that the absolute balance update starts from the balance the client was shown.
+        """
+        url = reverse('update-balance')
+        self.assertEqual(self.client.patch(url, {'amount': 10020}, format='json').data['balance'], 10020)
+        self.assertEqual(self.client.patch(url, {'amount': 10050}, format='json').data['balance'], 10050)
+
+        write_behind.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10050)
+
+    def test_tap_batch_reports_pending_credit(self):
+        """
+        Test that the tap batch response includes the taps it just queued.
+        """
+        ended_at = timezone.now()
+        event = {'seq': 1, 'count': 10, 'started_at': (ended_at - timedelta(seconds=5)).isoformat(), 'ended_at': ended_at.isoformat()}
+        response = self.client.post(reverse('tap-batch'), {'events': [event]}, format='json')
+        self.assertEqual(response.data['balance'], 10020)
+
+    def test_rolled_back_credit_is_not_queued(self):
+        """
+        Test that a credit made in a transaction that rolls back is neither queued nor
+        leaves its extra columns behind.
+        """
+        with self.assertRaises(wallet.InsufficientFunds):
+            with transaction.atomic():
+                wallet.credit(self.user, 200, automine_synced_at=timezone.now())
+                raise wallet.InsufficientFunds("Insufficient Funds")
+
+        self.assertEqual(write_behind.pending_for(self.user), 10000)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.automine_synced_at)
@@ -0,0 +1,79 @@
+from collections import deque
+from user_app.catalog import Catalog
+from user_app.models import CardUnlockRule
+
+# Card Unlocks
+# -----------------------------------------------------------------------------------------
+# Unlock conditions are data (CardUnlockRule). They are compiled once per catalog version
+# into a dependency graph: the rules of each card are folded into one minimum user level
+# plus the (prerequisite card, minimum card level) pairs, and the cards are put in
+# dependency order. A cards page then resolves the status of every card in one pass over
+# the user's claims.
+
+class UnlockGraph:
+    """
+    Compiled unlock rules of every card.
+
+    Cards caught in a prerequisite cycle (or depending on one) are left out of `order`, so
+    they stay locked.
+
+    Attributes:
+        order (list): (card id, minimum user level, requirements) with prerequisites first.
+    """
+    def __init__(self, rules):
+        compiled = {}
+        for rule in rules:
+            user_level, requirements = compiled.get(rule.card_id, (0, ()))
+            if rule.user_level is not None:
+                user_level = max(user_level, rule.user_level)
+            if rule.required_card_id is not None:
+                requirements += ((rule.required_card_id, rule.required_card_level),)
+            compiled[rule.card_id] = (user_level, requirements)
+
+        # Kahn's algorithm over "prerequisite -> card" edges between cards that have rules
+        waiting = {
+            card_id: {required for required, _ in requirements if required in compiled}
+            for card_id, (_, requirements) in compiled.items()
+        }
+        dependents = {}
+        for card_id, required in waiting.items():
+            for prerequisite in required:
+                dependents.setdefault(prerequisite, []).append(card_id)
+        ready = deque(card_id for card_id, required in waiting.items() if not required)
+        self.order = []
+        while ready:
+            card_id = ready.popleft()
+            self.order.append((card_id, *compiled[card_id]))
+            for dependent in dependents.get(card_id, []):
+                waiting[dependent].discard(card_id)
+                if not waiting[dependent]:
+                    ready.append(dependent)
+
+    def evaluate(self, user_level, claimed_levels):
+        """
+        Status of every card for one user.
+
+        Args:
+            user_level (int): The user's level_number.
+            claimed_levels (dict): Card id -> level of the user's claim.
+
+        Returns:
+            dict: Card id -> "claimed", "unlocked" or "locked"; cards missing from it are locked.
+        """
+        statuses = dict.fromkeys(claimed_levels, "claimed")
+        for card_id, min_user_level, requirements in self.order:
+            if card_id in statuses:
+                continue
+            unlocked = user_level >= min_user_level and all(
+                claimed_levels.get(required, -1) >= min_level for required, min_level in requirements
+            )
+            statuses[card_id] = "unlocked" if unlocked else "locked"
+        return statuses
+
+UNLOCKS = Catalog("card_unlocks", lambda: UnlockGraph(list(CardUnlockRule.objects.all())))
+
+def get_graph():
+    return UNLOCKS.get()
+
+def invalidate():
+    UNLOCKS.invalidate()
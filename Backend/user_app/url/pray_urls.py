@@ -5,15 +5,27 @@ urlpatterns = [
     # UpdateBalance
     # ---------------------------------------------------------------------
     path("tma_masterverses/update-pray-points/", UpdateBalanceAPIView.as_view(), name="update-balance"),
+    # TapBatch
+    # ---------------------------------------------------------------------
+    path("tma_masterverses/tap-batch/", TapBatchAPIView.as_view(), name="tap-batch"),
     # UserEarnings
     # ---------------------------------------------------------------------
     path("earning/", UserEarningsAPIView.as_view(), name="user-earnings"),
     # UserRefferalLeaderboard
     # ---------------------------------------------------------------------
     path("my-refferal-leaderboard/", UserRefferalLeaderboardAPIView.as_view(), name="user-refferal-leaderboard"),
+    # Downline
+    # ---------------------------------------------------------------------
+    path("downline/", DownlineAPIView.as_view(), name="downline"),
     # OverallLeaderboard
     # ---------------------------------------------------------------------
     path("overall-leaderboard/", OverallLeaderboardAPIView.as_view(), name="overall-leaderboard"),
+    # ReligionLeaderboard
+    # ---------------------------------------------------------------------
+    path("religion-leaderboard/", ReligionLeaderboardAPIView.as_view(), name="religion-leaderboard"),
+    # WindowedLeaderboard
+    # ---------------------------------------------------------------------
+    path("windowed-leaderboard/", WindowedLeaderboardAPIView.as_view(), name="windowed-leaderboard"),
     # RefferalLeaderboard
     # ---------------------------------------------------------------------
     path("refferal-leaderboard/", RefferalLeaderboardAPIView.as_view(), name="refferal-leaderboard"),
@@ -32,6 +44,12 @@ urlpatterns = [
     # UpdateUserCardLevel
     # ---------------------------------------------------------------------
     path("update-card-level/", UpdateUserCardLevelAPIView.as_view(), name="update-card-level"),
+    # BulkCardPurchase
+    # ---------------------------------------------------------------------
+    path("bulk-card-purchase/", BulkCardPurchaseAPIView.as_view(), name="bulk-card-purchase"),
+    # CardCurves
+    # ---------------------------------------------------------------------
+    path("card-curves/", CardCurvesAPIView.as_view(), name="card-curves"),
     # CardDetails
     # ---------------------------------------------------------------------
     path("card-details/", CardDetailsAPIView.as_view(), name="card-details"),
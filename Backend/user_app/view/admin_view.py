@@ -1,3 +1,4 @@
+from user_app import wallet
 from user_app.models import User
 from rest_framework import status
 from user_app.utils import Util
@@ -83,12 +84,8 @@ class AdminUpdatePrayPointsAPIView(UpdateAPIView):
         user = self.get_object()
         points = serializer.validated_data['points']
         
-        # Update the pray points and user balance
-        user.balance += points
-        user.save()
-
-        # Update the level based on new points
-        user.update_user_level()
+        # Update the pray points and user balance; the wallet also raises the level
+        wallet.credit(user, points)
 
 
     def update(self, request, *args, **kwargs):
@@ -1,4 +1,7 @@
-from django.db import connection
+import uuid
+from django.conf import settings
+from django.db import transaction
+from user_app import catalog, downline, leaderboards, rank_engine, ranking, rollups, wallet
 from rest_framework import status, generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -7,10 +10,11 @@ from datetime import timedelta
 from datetime import timedelta
 from django.utils import timezone
 from user_app.models import UserDailyReward
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from user_app.serializer.pray_serializers import *
 from django.db.models import Window, F, functions, Count, Q, OuterRef,Subquery
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.pagination import CursorPagination
 from rest_framework.generics import UpdateAPIView, ListAPIView, CreateAPIView
 
 # API: UpdateBalance
@@ -64,6 +68,18 @@ class UpdateBalanceAPIView(generics.UpdateAPIView):
     def patch(self, request, *args, **kwargs):
         return super().patch(request, *args, **kwargs)
     
+# API: TapBatch
+# -----------------------------------------------------------------------------------------
+class TapBatchAPIView(CreateAPIView):
+    """
+    API endpoint for flushing a batch of tap deltas for the authenticated user.
+
+    The client buffers taps locally and reports them every few seconds instead of
+    PATCHing an absolute balance after every tap.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = TapBatchSerializer
+
 # API: UserEarnings
 # ------------------------------------------------------------------------------------------
 class UserEarningsAPIView(CreateAPIView):
@@ -79,9 +95,16 @@ class UserEarningsAPIView(CreateAPIView):
     def perform_create(self, serializer):
         """
         Save the earning record for the current user.
+
+        The balance change runs in the same transaction, so a debit that no longer fits
+        the balance rolls the earning back.
         """
-        # Associate the earnings entry with the current user
-        return serializer.save(user=self.request.user)
+        try:
+            with transaction.atomic():
+                # Associate the earnings entry with the current user
+                return serializer.save(user=self.request.user)
+        except wallet.InsufficientFunds:
+            raise ValidationError("Insufficient Funds")
     
 # API: UserRefferalLeaderboard
 # ------------------------------------------------------------------------------------------
@@ -118,9 +141,103 @@ class UserRefferalLeaderboardAPIView(ListAPIView):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
+# Leaderboard Pages
+# ------------------------------------------------------------------------------------------
+class LeaderboardPagesMixin:
+    """
+    Optional paged modes for the leaderboards:
+
+    - `?limit=n&cursor=c`: keyset pages; pass back `next_cursor` to get the next page.
+    - `?around=me&radius=k`: the k users above and below the caller.
+
+    Without these parameters the views return the full top list as before.
+    """
+    board = None
+    religion = None # Scope set by religion-specific views
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 100
+    RADIUS = 10
+    MAX_RADIUS = 50
+
+    def is_paged(self):
+        return any(param in self.request.query_params for param in ("limit", "cursor", "around"))
+
+    def get_int_param(self, name, default, maximum):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError({name: "Must be an integer."})
+        if not 1 <= value <= maximum:
+            raise ValidationError({name: f"Must be between 1 and {maximum}."})
+        return value
+
+    def paged_response(self, request):
+        """
+        Return a keyset page or the window around the caller, with the caller's rank.
+        """
+        around = request.query_params.get("around")
+        data = {}
+        if around is not None:
+            if around != "me":
+                raise ValidationError({"around": "Only 'me' is supported."})
+            radius = self.get_int_param("radius", self.RADIUS, self.MAX_RADIUS)
+            users = ranking.around(self.board, request.user, radius, self.religion)
+        else:
+            limit = self.get_int_param("limit", self.PAGE_SIZE, self.MAX_PAGE_SIZE)
+            try:
+                users, data["next_cursor"] = ranking.page(
+                    self.board, request.query_params.get("cursor"), limit, self.religion
+                )
+            except ValueError:
+                raise ValidationError({"cursor": "Invalid cursor."})
+        data["leaderboard"] = self.get_serializer(users, many=True).data
+        data["user_details"] = self.get_user_rank(request.user)
+        return Response(data, status=status.HTTP_200_OK)
+
+# API: Downline
+# ------------------------------------------------------------------------------------------
+class DownlinePagination(CursorPagination):
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "limit"
+    max_page_size = 100
+
+class DownlineAPIView(ListAPIView):
+    """
+    API View for the authenticated user's downline.
+
+    Lists the members of one tier (`?depth=1..3`, default 1) a page at a time, with the
+    size and combined balance of every tier.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = DownlineSerializer
+    pagination_class = DownlinePagination
+
+    def get_queryset(self):
+        """
+        Get the members of the requested tier from the referral closure table.
+        """
+        depth = self.request.query_params.get("depth", "1")
+        if depth not in [str(tier) for tier in range(1, downline.MAX_DEPTH + 1)]:
+            raise ValidationError({"depth": f"Must be between 1 and {downline.MAX_DEPTH}."})
+        return ReferralClosure.objects.filter(ancestor=self.request.user, depth=int(depth)).select_related("descendant")
+
+    def list(self, request, *args, **kwargs):
+        """
+        Return a page of the downline tier and the stats of every tier.
+        """
+        page = self.paginate_queryset(self.get_queryset())
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        stats = DownlineStats.objects.filter(user=request.user).order_by("depth")
+        response.data["tiers"] = DownlineStatsSerializer(stats, many=True).data
+        return response
+
 # API: OverallLeaderboard
 # ------------------------------------------------------------------------------------------
-class OverallLeaderboardAPIView(ListAPIView):
+class OverallLeaderboardAPIView(LeaderboardPagesMixin, ListAPIView):
     """
     API View for displaying the overall leaderboard.
 
@@ -128,11 +245,14 @@ class OverallLeaderboardAPIView(ListAPIView):
     """
     permission_classes = [IsAuthenticated]
     serializer_class = OverallLeaderboardSerializer
+    board = "overall"
 
     def get_leaderboard(self):
         """
         Get the top 1000 users ranked by balance.
         """
+        if rank_engine.is_enabled():
+            return ranking.top_users("overall", settings.LEADERBOARD_SIZE)
         # Retrieve the top 1000 users ranked by balance
         return User.objects.annotate(
             rank=Window(
@@ -143,38 +263,20 @@ class OverallLeaderboardAPIView(ListAPIView):
                     F('date_joined').asc()
                 ]
             )
-        ).order_by('rank')[:1000]
+        ).order_by('rank')[:settings.LEADERBOARD_SIZE]
     
     def get_user_rank(self, user):
         """
         Get the rank, balance, and first name details for the authenticated user.
         """
-        query = '''
-            WITH ranked_users AS (
-                SELECT u.telegram_id,
-                    u.username AS username,
-                    u.first_name AS first_name,
-                    u.balance AS balance,
-                    u.reffered_points AS referral_count,
-                    u.date_joined AS date_joined,
-                    DENSE_RANK() OVER (
-                        ORDER BY u.balance DESC, 
-                                    u.reffered_points DESC, 
-                                    u.date_joined ASC
-                    ) AS rank
-                FROM user_app_user u
-            )
-            SELECT username, first_name, balance, rank FROM ranked_users 
-            WHERE telegram_id = %s
-        '''
-        with connection.cursor() as cursor:
-            cursor.execute(query, [user.telegram_id])
-            result = cursor.fetchone()
+        row = User.objects.values(
+            "username", "first_name", "balance", "reffered_points", "date_joined"
+        ).get(telegram_id=user.telegram_id)
         return {
-            "username": result[0],
-            "first_name": result[1],
-            "balance": result[2],
-            "rank": result[3]
+            "username": row["username"],
+            "first_name": row["first_name"],
+            "balance": row["balance"],
+            "rank": ranking.overall_rank(row["balance"], row["reffered_points"], row["date_joined"])
         }
 
 
@@ -183,57 +285,157 @@ class OverallLeaderboardAPIView(ListAPIView):
         """
         Return the leaderboard and the current user's rank.
         """
-        leaderboard = self.get_leaderboard()
+        if self.is_paged():
+            return self.paged_response(request)
+        leaderboard = leaderboards.get_snapshot(
+            "overall", lambda: self.get_serializer(self.get_leaderboard(), many=True).data
+        )
         user_rank = self.get_user_rank(request.user)
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response({"leaderboard": serializer.data, "user_details": user_rank}, status=status.HTTP_200_OK)
+        return Response({"leaderboard": leaderboard, "user_details": user_rank}, status=status.HTTP_200_OK)
     
+# API: ReligionLeaderboard
+# ------------------------------------------------------------------------------------------
+class ReligionLeaderboardAPIView(LeaderboardPagesMixin, ListAPIView):
+    """
+    API View for the overall leaderboard within one religion.
+
+    Uses the caller's religion unless `?religion=` names another one, and supports the same
+    `limit`/`cursor` and `around=me` parameters as the global leaderboards.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = OverallLeaderboardSerializer
+    board = "overall"
+
+    def get_user_rank(self, user):
+        """
+        Get the rank of the authenticated user within the religion.
+        """
+        row = User.objects.values(
+            "username", "first_name", "balance", "reffered_points", "date_joined", "user_religion"
+        ).get(telegram_id=user.telegram_id)
+        in_religion = row["user_religion"] == self.religion
+        return {
+            "username": row["username"],
+            "first_name": row["first_name"],
+            "balance": row["balance"],
+            "rank": ranking.overall_rank(
+                row["balance"], row["reffered_points"], row["date_joined"], self.religion
+            ) if in_religion else None # Users of other religions are not ranked here
+        }
+
+    def list(self, request, *args, **kwargs):
+        """
+        Return a page of the religion leaderboard and the current user's rank in it.
+        """
+        self.religion = request.query_params.get("religion") or request.user.user_religion
+        if self.religion not in dict(User.RELIGION_CHOICES):
+            raise ValidationError({"religion": "Choose a religion first."})
+        if request.query_params.get("around") is not None and request.user.user_religion != self.religion:
+            raise ValidationError({"around": "You are not part of this religion."})
+        response = self.paged_response(request)
+        response.data["religion"] = self.religion
+        return response
+
+# API: WindowedLeaderboard
+# ------------------------------------------------------------------------------------------
+class WindowedLeaderboardAPIView(ListAPIView):
+    """
+    API View for the daily and weekly leaderboards.
+
+    Ranks users by the points credited in the current window (`?period=day|week`, default
+    day) and provides the current user's points and rank in it.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = WindowedLeaderboardSerializer
+    LIMIT = 100
+
+    def get_period(self):
+        period = self.request.query_params.get("period", "day")
+        if period not in rollups.PERIODS:
+            raise ValidationError({"period": f"Must be one of: {', '.join(rollups.PERIODS)}."})
+        return period
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get("limit", self.LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "Must be an integer."})
+        if not 1 <= limit <= settings.LEADERBOARD_SIZE:
+            raise ValidationError({"limit": f"Must be between 1 and {settings.LEADERBOARD_SIZE}."})
+        return limit
+
+    def get_user_rank(self, user, window):
+        """
+        Get the points and dense rank of the authenticated user in the window.
+        """
+        points = window.filter(user=user).values_list("points", flat=True).first()
+        rank = None
+        if points:
+            rank = window.filter(points__gt=points).values("points").distinct().count() + 1
+        return {
+            "username": user.username,
+            "first_name": user.first_name,
+            "points": points or 0,
+            "rank": rank
+        }
+
+    def list(self, request, *args, **kwargs):
+        """
+        Return the leaderboard of the current window and the current user's rank.
+        """
+        period = self.get_period()
+        window = IncomeRollup.objects.filter(period=period, bucket=rollups.bucket(period))
+        rows = list(window.select_related("user").order_by("-points", "id")[:self.get_limit()])
+
+        # Dense ranks by points
+        rank, previous = 0, None
+        for row in rows:
+            if row.points != previous:
+                rank, previous = rank + 1, row.points
+            row.rank = rank
+
+        serializer = self.get_serializer(rows, many=True)
+        return Response({
+            "period": period,
+            "leaderboard": serializer.data,
+            "user_details": self.get_user_rank(request.user, window)
+        }, status=status.HTTP_200_OK)
+
 # API: RefferalLeaderboard
 # --------------------------------------------------------------------------------------------
-class RefferalLeaderboardAPIView(ListAPIView):
+class RefferalLeaderboardAPIView(LeaderboardPagesMixin, ListAPIView):
     """
     API View for displaying the referral points leaderboard.
     Shows the top 1000 users ranked by referral points and provides the current user's rank.
     """
     permission_classes = [IsAuthenticated]
     serializer_class = RefferalLeaderboardSerializer
+    board = "referral"
 
     def get_leaderboard(self):
         """
         Get the top 1000 users ranked by referral points.
         """
+        if rank_engine.is_enabled():
+            return ranking.top_users("referral", settings.LEADERBOARD_SIZE)
         # Top 1000 users by referred points
         return User.objects.annotate(
             rank=Window(
                 expression=functions.DenseRank(),
                 order_by=F('reffered_points').desc()
             )
-        ).order_by('rank')[:1000]
+        ).order_by('rank')[:settings.LEADERBOARD_SIZE]
 
     def get_user_rank(self, user):
         """
         Get the rank and referral points details for the authenticated user.
         """
-        # Custom SQL query to get the rank and referred count
-        query = '''
-                WITH ranked_users AS (
-                    SELECT telegram_id, reffered_points, 
-                        DENSE_RANK() OVER (ORDER BY reffered_points DESC) AS rank
-                    FROM user_app_user
-                )
-                SELECT rank FROM ranked_users 
-                WHERE telegram_id = %s
-            '''
-        with connection.cursor() as cursor:
-            cursor.execute(query, [user.telegram_id])
-            result = cursor.fetchone()
-        refferal_count = User.objects.filter(reffered_by=user.telegram_id).count()
         return {
             "username": user.username,
             "first_name": user.first_name,
             "reffered_points": user.reffered_points,
-            "rank": result[0],
-            "refferal_count": refferal_count
+            "rank": ranking.referral_rank(user.reffered_points),
+            "refferal_count": user.referral_count
         }
 
 
@@ -241,10 +443,13 @@ class RefferalLeaderboardAPIView(ListAPIView):
         """
         Return the referral leaderboard and the current user's rank.
         """
-        leaderboard = self.get_leaderboard()
+        if self.is_paged():
+            return self.paged_response(request)
+        leaderboard = leaderboards.get_snapshot(
+            "referral", lambda: self.get_serializer(self.get_leaderboard(), many=True).data
+        )
         user_rank = self.get_user_rank(request.user)
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response({"leaderboard": serializer.data, "user_details": user_rank}, status=status.HTTP_200_OK)
+        return Response({"leaderboard": leaderboard, "user_details": user_rank}, status=status.HTTP_200_OK)
 
 
 
@@ -256,9 +461,11 @@ class TasksAPIView(ListAPIView):
     API View for listing available tasks for users.
     """
     permission_classes = [IsAuthenticated]
-    queryset = Tasks.objects.all()
     serializer_class = TasksSerializer
 
+    def get_queryset(self):
+        return catalog.tasks().rows
+
 # API: UserTaskClaim
 # --------------------------------------------------------------------------------------------
 class UserTaskClaimAPIView(CreateAPIView):
@@ -275,9 +482,11 @@ class CardsAPIView(ListAPIView):
     API View for listing available cards for users.
     """
     permission_classes = [IsAuthenticated]
-    queryset = Cards.objects.all()
     serializer_class = CardsSerializer
 
+    def get_queryset(self):
+        return catalog.cards().rows
+
 # API: UserCardClaim
 # ---------------------------------------------------------------------------------------------
 class UserCardClaimAPIView(CreateAPIView):
@@ -296,6 +505,50 @@ class UpdateUserCardLevelAPIView(CreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = UpdateUserCardLevelSerializer
 
+# API: BulkCardPurchase
+# ---------------------------------------------------------------------------------------------
+class BulkCardPurchaseAPIView(CreateAPIView):
+    """
+    API View for claiming and upgrading several cards in one request.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = BulkCardPurchaseSerializer
+
+# API: CardCurves
+# ---------------------------------------------------------------------------------------------
+class CardCurvesAPIView(APIView):
+    """
+    API View returning the complete level curve (burning and automine points of every level)
+    of one card, with `card_id`, or of all cards.
+
+    The curves come from the card details catalog and carry an ETag; a request whose
+    If-None-Match matches gets an empty 304.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        details = catalog.cards_details()
+        card_id = request.query_params.get("card_id")
+        if card_id:
+            try:
+                card_id = uuid.UUID(card_id)
+            except ValueError:
+                raise NotFound("Card curve not found.")
+            if card_id not in details.curves:
+                raise NotFound("Card curve not found.")
+            payload, etag = details.curves[card_id], details.curve_etags[card_id]
+        else:
+            payload, etag = list(details.curves.values()), details.curves_etag
+
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(payload)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache" # Always revalidate, cheaply
+        return response
+
 # API: CardDetails
 # ---------------------------------------------------------------------------------------------
 class CardDetailsAPIView(ListAPIView):
@@ -324,13 +577,18 @@ class CardDetailsAPIView(ListAPIView):
         except ValueError:
             raise NotFound("Invalid level_number.")
 
-        # Filter cards by ID and level
-        queryset = CardsDetails.objects.filter(card__id=card_id, level_number=level_number)
+        try:
+            card_id = uuid.UUID(card_id)
+        except ValueError:
+            raise NotFound("Card details not found.")
+
+        # Look the card level up in the catalog
+        card_details = catalog.cards_details().by_key.get((card_id, level_number))
 
-        if not queryset.exists():
+        if card_details is None:
             raise NotFound("Card details not found.")
 
-        return queryset
+        return [card_details]
     
 class BoosterClaimView(APIView):
     permission_classes = [IsAuthenticated]
@@ -378,10 +636,12 @@ class DailyRewardAPIView(generics.ListAPIView):
     Returns a list of daily rewards with their points and claim status. The claim status 
     is personalized based on the user's current progress in the reward system.
     """
-    queryset = DailyReward.objects.all().order_by('day')
     serializer_class = DailyRewardSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return catalog.daily_rewards().rows
+
     def get_serializer_context(self):
         """
         Adds the user's daily reward status to the serializer context.
@@ -1,3 +1,4 @@
+from user_app import automine, wallet
 from user_app.utils import Util
 from user_app.models import User
 from rest_framework import status
@@ -47,6 +48,8 @@ class LoginAPIView(CreateAPIView):
         # If user does not exist in the system, create a new user
         if not user:
             user = serializer.save()
+        else:
+            automine.settle(user) # Credit the card income earned since the last visit
 
         # Generate JWT tokens for the existing or newly created user
         tokens = Util.get_tokens_for_user(user)
@@ -78,7 +81,8 @@ class UserDetailsAPIView(ListAPIView):
         Returns:
             Response: A response containing the serialized user data.
         """
-        serializer = self.get_serializer(request.user) # Serialize the data for the authenticated user
+        earned = automine.settle(request.user) # Credit the card income earned since the last visit
+        serializer = self.get_serializer(request.user, context={**self.get_serializer_context(), "automine_earned": earned})
         return Response(serializer.data, status=status.HTTP_200_OK) # Return the serialized data
     
 # API: WelcomeBonus
@@ -126,10 +130,12 @@ class WelcomeBonusAPIView(UpdateAPIView):
         serializer = self.get_serializer(instance)
         serializer.validate(instance)  # Validate the instance
 
-        # Apply the welcome bonus update
-        instance.welcome_bonus = True # Mark the welcome bonus as received
-        instance.balance += 10000 # Add 10000 points to the user's balance
-        instance.save() # Save the changes to the user instance
+        # Mark the welcome bonus as received and add 10000 points in one conditional update,
+        # so two concurrent requests cannot both claim it
+        try:
+            wallet.credit(instance, 10000, conditions={"welcome_bonus": False}, welcome_bonus=True)
+        except wallet.WalletError:
+            raise ValidationError("Welcome Bonus already claimed.")
 
         # Return a success response
         return Response({"msg": "Pray Welcome Bonus updated successfully"}, status=status.HTTP_200_OK)
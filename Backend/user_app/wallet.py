@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models import F
+from user_app import leaderboards, levels, rank_engine, rollups, write_behind
+from user_app.models import User
+
+# Wallet
+# -----------------------------------------------------------------------------------------
+# Every balance change goes through `credit` or `debit`. Each one is a single conditional
+# UPDATE (`balance = balance +/- x WHERE id = ? [AND balance >= x]`) followed by a read of
+# the new balance, so concurrent requests can neither lose updates nor spend twice.
+
+class WalletError(Exception):
+    """
+    The conditional balance update matched no row.
+    """
+
+class InsufficientFunds(WalletError):
+    """
+    The user's balance (or a guard condition) did not allow the debit.
+    """
+
+class WalletResult:
+    """
+    Outcome of a wallet operation.
+
+    Attributes:
+        balance (int): Balance after the operation.
+        level_number (int): Level after the operation.
+        level_name (str): Level name after the operation.
+        level_changed (bool): Whether the operation raised the user's level.
+    """
+    def __init__(self, balance, level_number, level_name, level_changed=False):
+        self.balance = balance
+        self.level_number = level_number
+        self.level_name = level_name
+        self.level_changed = level_changed
+
+def credit(user, amount, conditions=None, **updates):
+    """
+    Add `amount` to the user's balance.
+
+    Args:
+        user (User): The user to credit; its balance and level are refreshed in place.
+        amount (int): Points to add.
+        conditions (dict, optional): Extra filters the row must match, e.g. {"welcome_bonus": False}.
+        **updates: Extra columns to write in the same UPDATE.
+
+    Raises:
+        WalletError: If `conditions` did not match.
+
+    Returns:
+        WalletResult: The new balance and level.
+    """
+    if write_behind.is_enabled():
+        # The extra columns are written in the caller's transaction; the credit is queued
+        # when it commits
+        if updates and not User.objects.filter(pk=user.pk, **(conditions or {})).update(**updates):
+            raise WalletError("Conditional update did not match.")
+        pending = write_behind.pending_for(user)
+        if amount:
+            write_behind.credit(user, amount)
+        refresh(user, updates)
+        return WalletResult(user.balance + pending + amount, user.level_number, user.level_name)
+
+    with transaction.atomic():
+        result = apply(user, F("balance") + amount, conditions or {}, updates)
+        if result is None:
+            raise WalletError("Conditional update did not match.")
+        rollups.record(user.pk, amount)
+    return result
+
+def debit(user, amount, conditions=None, **updates):
+    """
+    Subtract `amount` from the user's balance if the balance covers it.
+
+    Args:
+        user (User): The user to debit; its balance is refreshed in place.
+        amount (int): Points to subtract.
+        conditions (dict, optional): Extra filters the row must match, e.g. {"multitap_level__lte": 12}.
+        **updates: Extra columns to write in the same UPDATE.
+
+    Raises:
+        InsufficientFunds: If the balance is lower than `amount` or `conditions` did not match.
+
+    Returns:
+        WalletResult: The new balance and level.
+    """
+    settle_pending(user)
+    result = apply(user, F("balance") - amount, {"balance__gte": amount, **(conditions or {})}, updates)
+    if result is None:
+        raise InsufficientFunds("Insufficient Funds")
+    return result
+
+def settle_pending(user):
+    """
+    Flush the write-behind credits of this process if the user has some queued, so a
+    balance check sees the balance the user was shown.
+
+    Inside a transaction nothing is flushed: rolling it back would undo a batch that was
+    already removed from the log. Serializers therefore settle in `validate()`, before
+    their transaction starts, and check the refreshed balance.
+    """
+    if not write_behind.pending_for(user) or transaction.get_connection().in_atomic_block:
+        return
+    write_behind.flush()
+    user.refresh_from_db(fields=["balance", "level_number", "level_name"])
+
+def apply(user, balance, conditions, updates):
+    """
+    Run the conditional UPDATE, read back the new values and raise the level if needed.
+
+    Returns:
+        WalletResult or None: None if no row matched.
+    """
+    with transaction.atomic():
+        if not User.objects.filter(pk=user.pk, **conditions).update(balance=balance, **updates):
+            return None
+        row = User.objects.values("balance", "level_number", "level_name", *updates).get(pk=user.pk)
+
+        level_changed = False
+        rule = levels.resolve_level(row["balance"])
+        if rule and rule.level_number > row["level_number"]:
+            User.objects.filter(pk=user.pk).update(level_number=rule.level_number, level_name=rule.level_name)
+            row["level_number"], row["level_name"] = rule.level_number, rule.level_name
+            level_changed = True
+
+    leaderboards.note_scores(row)
+    transaction.on_commit(lambda: rank_engine.note(user.pk, row))
+    for field, value in row.items():
+        setattr(user, field, value)
+    user.reset_tracking(row)
+    return WalletResult(row["balance"], row["level_number"], row["level_name"], level_changed)
+
+def refresh(user, updates):
+    """
+    Reload the given columns after an UPDATE that used expressions.
+    """
+    if updates:
+        user.refresh_from_db(fields=list(updates))
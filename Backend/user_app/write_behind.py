@@ -0,0 +1,269 @@
+import os
+import uuid
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, models, transaction
+from django.db.models import Case, F, Value, When
+from user_app import levels, rollups
+from user_app.models import BalanceFlush, User
+
+logger = logging.getLogger(__name__)
+
+# Write-behind balance accumulator
+# -----------------------------------------------------------------------------------------
+# When WRITE_BEHIND_BALANCES is enabled, credits are not written to the user row inside the
+# request. They are appended to a per-process log file and summed in memory per telegram_id,
+# then applied every WRITE_BEHIND_FLUSH_MS in one `UPDATE ... SET balance = balance + CASE`.
+#
+# Log layout inside WRITE_BEHIND_LOG_DIR:
+#   active-<pid>.log           credits not yet flushed by process <pid>
+#   batch-<pid>-<batch_id>.log a flush in progress in process <pid>; removed once applied
+# Each applied batch_id is recorded in BalanceFlush in the same transaction as the UPDATE,
+# so replaying a leftover batch file after a crash never credits it twice. Only files of
+# processes that are gone are replayed, never a flush another live process is running.
+
+CHUNK_SIZE = 500 # Keeps the CASE statement under SQLite's variable limit
+
+class BalanceAccumulator:
+    """
+    In-process accumulator of pending balance credits keyed by telegram_id.
+    """
+    def __init__(self, log_dir, interval_ms, fsync=True):
+        self.log_dir = log_dir
+        self.interval = interval_ms / 1000
+        self.fsync = fsync
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.active_path = os.path.join(self.log_dir, f"active-{os.getpid()}.log")
+        if os.path.exists(self.active_path):
+            # Left behind by an earlier process that had the same pid; replay it as a batch
+            os.replace(self.active_path, self.batch_path(uuid.uuid4().hex))
+        self.log = open(self.active_path, "a", encoding="utf-8")
+
+    def add(self, telegram_id, amount):
+        """
+        Durably log a credit and add it to the pending totals.
+        """
+        with self.lock:
+            self.log.write(f"{telegram_id} {amount}\n")
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+            self.pending[telegram_id] = self.pending.get(telegram_id, 0) + amount
+        self.start()
+
+    def batch_path(self, batch_id):
+        return os.path.join(self.log_dir, f"batch-{os.getpid()}-{batch_id}.log")
+
+    def pending_for(self, telegram_id):
+        """
+        Return the credits queued for a user but not yet flushed.
+        """
+        with self.lock:
+            return self.pending.get(telegram_id, 0)
+
+    def start(self):
+        """
+        Start the background flusher if a flush interval is configured.
+        """
+        if self.interval <= 0 or self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="balance-write-behind", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        """
+        Flush pending credits forever, every `interval` seconds.
+        """
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed; credits stay in the log for replay.")
+
+    def flush(self):
+        """
+        Rotate the active log and apply its credits in bulk.
+
+        Returns:
+            int: Number of users whose balance was updated.
+        """
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                amounts, self.pending = self.pending, {}
+                batch_id = uuid.uuid4().hex
+                batch_path = self.batch_path(batch_id)
+                self.log.close()
+                os.replace(self.active_path, batch_path)
+                self.log = open(self.active_path, "a", encoding="utf-8")
+            apply_batch(batch_id, amounts)
+            os.remove(batch_path)
+            return len(amounts)
+
+    def recover(self):
+        """
+        Replay batch files and active logs left behind by processes that died.
+
+        Batch files of this pid are leftovers too, since this process has not flushed yet.
+        A dead process's active log is first renamed to a batch of this process, so only
+        one recovering process takes it. Processes starting together may still replay the
+        same batch file; BalanceFlush applies it once and a file already removed is skipped.
+        """
+        with self.flush_lock:
+            for name in sorted(os.listdir(self.log_dir)):
+                path = os.path.join(self.log_dir, name)
+                try:
+                    if name.startswith("batch-"):
+                        owner, _, batch_id = name[len("batch-"):-len(".log")].partition("-")
+                        if not batch_id:
+                            owner, batch_id = str(os.getpid()), owner # Named before batch files carried their pid
+                        if int(owner) != os.getpid() and is_alive(int(owner)):
+                            continue
+                    elif name.startswith("active-"):
+                        owner = int(name[len("active-"):-len(".log")])
+                        if owner == os.getpid() or is_alive(owner):
+                            continue
+                        batch_id = uuid.uuid4().hex
+                        os.replace(path, self.batch_path(batch_id))
+                        path = self.batch_path(batch_id)
+                    else:
+                        continue
+                    apply_batch(batch_id, read_log(path))
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue # Taken by another recovering process
+
+def is_alive(pid):
+    """
+    Check whether a process with the given pid is still running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def read_log(path):
+    """
+    Sum the credits recorded in a log file by telegram_id.
+    """
+    amounts = {}
+    with open(path, encoding="utf-8") as log:
+        for line in log:
+            parts = line.split()
+            if len(parts) != 2:
+                continue # A torn final line from a crash mid-write
+            telegram_id, amount = int(parts[0]), int(parts[1])
+            amounts[telegram_id] = amounts.get(telegram_id, 0) + amount
+    return amounts
+
+def apply_batch(batch_id, amounts):
+    """
+    Apply a batch of credits with one `UPDATE ... CASE` per chunk, exactly once.
+
+    Args:
+        batch_id (str): Unique id of the batch, recorded in BalanceFlush.
+        amounts (dict): Credits keyed by telegram_id.
+    """
+    if not amounts:
+        return
+    try:
+        with transaction.atomic():
+            BalanceFlush.objects.create(batch_id=batch_id)
+            items = list(amounts.items())
+            for start in range(0, len(items), CHUNK_SIZE):
+                chunk = items[start:start + CHUNK_SIZE]
+                User.objects.filter(telegram_id__in=[telegram_id for telegram_id, _ in chunk]).update(
+                    balance=F("balance") + Case(
+                        *[When(telegram_id=telegram_id, then=Value(amount)) for telegram_id, amount in chunk],
+                        default=Value(0),
+                        output_field=models.PositiveBigIntegerField(),
+                    )
+                )
+            # Count the batch towards the current daily and weekly rollups
+            users = User.objects.filter(telegram_id__in=list(amounts)).only("id", "telegram_id")
+            rollups.record_many({user.pk: amounts[user.telegram_id] for user in users})
+    except IntegrityError:
+        return # Batch already applied before a crash
+    update_levels(amounts.keys())
+
+def update_levels(telegram_ids):
+    """
+    Raise the level of flushed users whose new balance reached a higher level.
+    """
+    users = User.objects.filter(telegram_id__in=list(telegram_ids)).only("id", "balance", "level_number", "level_name")
+    for user in users:
+        rule = levels.resolve_level(user.balance)
+        if rule and rule.level_number > user.level_number:
+            User.objects.filter(pk=user.pk).update(level_number=rule.level_number, level_name=rule.level_name)
+
+_accumulator = None
+_accumulator_lock = threading.Lock()
+
+def is_enabled():
+    """
+    Whether balance credits are buffered instead of written inside the request.
+    """
+    return settings.WRITE_BEHIND_BALANCES
+
+def get_accumulator():
+    """
+    Return the process-wide accumulator, replaying leftover logs on first use.
+    """
+    global _accumulator
+    if _accumulator is None:
+        with _accumulator_lock:
+            if _accumulator is None:
+                accumulator = BalanceAccumulator(
+                    settings.WRITE_BEHIND_LOG_DIR, settings.WRITE_BEHIND_FLUSH_MS, settings.WRITE_BEHIND_FSYNC
+                )
+                accumulator.recover()
+                atexit.register(accumulator.flush)
+                _accumulator = accumulator
+    return _accumulator
+
+def credit(user, amount):
+    """
+    Queue a credit for the user when write-behind is enabled.
+
+    The credit is queued once the surrounding transaction commits, so a rolled back
+    request credits nothing. The user instance is left untouched so that a later save()
+    of it cannot write the projected balance and double count the credit.
+
+    Returns:
+        bool: True if the credit was queued, False if the caller must write it itself.
+    """
+    if not is_enabled():
+        return False
+    telegram_id = user.telegram_id
+    transaction.on_commit(lambda: get_accumulator().add(telegram_id, amount))
+    return True
+
+def pending_for(user):
+    """
+    Credits queued for the user that are not yet visible in the database.
+    """
+    if not is_enabled():
+        return 0
+    return get_accumulator().pending_for(user.telegram_id)
+
+def flush():
+    """
+    Apply all pending credits of this process now.
+    """
+    if _accumulator is None:
+        return 0
+    return _accumulator.flush()